@@ -0,0 +1,76 @@
+# adr.py — Parámetros de radio del collar: comandos ADR y presupuesto de aire
+#
+# El handheld responde cada uplink con un downlink corto (ver frames.py) que
+# puede traer SF, potencia y preámbulo nuevos. Si se pierden `ack_limit`
+# downlinks seguidos el collar vuelve a la configuración por defecto (SF12,
+# potencia máxima), que es la que el handheld siempre escucha.
+#
+# El tiempo en aire se lleva con un balde de fichas: se recarga a razón de
+# `duty_cycle` (1 % = 36 s por hora) y cada transmisión descuenta su ToA.
+import time
+import frames
+
+DL_TURNAROUND_MS = 250    # tiempo que tarda el handheld en contestar
+
+
+class CollarLink:
+    def __init__(self, lora, sf=12, power=14, preamble=8, duty_cycle=0.01, ack_limit=4):
+        self.lora = lora
+        self.default = (sf, power, preamble)
+        self.duty_cycle = duty_cycle
+        self.budget_ms = duty_cycle * 3600 * 1000
+        self.tokens_ms = self.budget_ms
+        self.t_refill = time.ticks_ms()
+        self.ack_limit = ack_limit
+        self.missed = 0
+        self.airtime_ms = 0       # total transmitido desde el arranque
+        self.tx_count = 0
+        self.tx_skipped = 0
+        self.fallbacks = 0
+
+    def _refill(self):
+        now = time.ticks_ms()
+        dt = time.ticks_diff(now, self.t_refill)
+        self.t_refill = now
+        self.tokens_ms = min(self.budget_ms, self.tokens_ms + dt * self.duty_cycle)
+
+    def can_send(self, toa_ms):
+        self._refill()
+        if self.tokens_ms >= toa_ms:
+            return True
+        self.tx_skipped += 1
+        return False
+
+    def charge(self, toa_ms):
+        self.tokens_ms -= toa_ms
+        self.airtime_ms += toa_ms
+        self.tx_count += 1
+
+    def rx_window_ms(self):
+        return DL_TURNAROUND_MS + self.lora.time_on_air_ms(frames.DOWN_MAX_LEN, preamble=8)
+
+    def on_downlink(self, dl):
+        self.missed = 0
+        adr = dl.get(frames.CMD_ADR)
+        if adr:
+            self.apply(*adr)
+
+    def on_missed(self):
+        self.missed += 1
+        if self.missed < self.ack_limit:
+            return
+        self.missed = 0
+        if self.current() != self.default:
+            print("[ADR] {} downlinks perdidos: vuelta a SF{} {} dBm".format(
+                self.ack_limit, self.default[0], self.default[1]))
+            self.fallbacks += 1
+            self.apply(*self.default)
+
+    def current(self):
+        return (self.lora.sf, self.lora.power, self.lora.preamble)
+
+    def apply(self, sf, power, preamble):
+        if (sf, power, preamble) == self.current():
+            return
+        print("[ADR] SF{} {} dBm preámbulo {}".format(sf, power, preamble))
+        self.lora.retune(sf=sf, power=power, preamble=preamble)
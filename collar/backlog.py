@@ -0,0 +1,137 @@
+# backlog.py — Fixes pendientes de confirmar (store-and-forward)
+#
+# Cola FIFO de registros FIXREC de 18 bytes (ver frames.py). Los más nuevos
+# viven en un anillo en RAM; cuando se llena, su contenido entero se pasa
+# de una sola escritura al final de un archivo en flash, que siempre tiene
+# los más viejos. El avance de lectura del archivo se guarda en un .idx de
+# 4 bytes, así que lo que llegó a flash sobrevive a un reset; cuando el
+# archivo se vacía se borran ambos.
+#
+# Si el archivo llega a `max_flash` registros se descartan los más viejos
+# del anillo en lugar de seguir creciendo.
+import os
+import struct
+import frames
+
+REC = frames.FIXREC_LEN
+
+
+class FixQueue:
+    def __init__(self, ram_slots=32, path="/backlog.bin", max_flash=2048):
+        self.ram = bytearray(ram_slots * REC)
+        self.ram_mv = memoryview(self.ram)
+        self.slots = ram_slots
+        self.head = 0
+        self.count = 0
+        self.path = path
+        self.idx_path = path + ".idx"
+        self.max_flash = max_flash
+        self.flash_total = 0      # registros en el archivo (leídos o no)
+        self.flash_read = 0
+        self.spills = 0
+        self.dropped = 0
+        self._idx = bytearray(4)
+        self._load()
+
+    def _load(self):
+        try:
+            self.flash_total = os.stat(self.path)[6] // REC
+        except OSError:
+            return
+        try:
+            with open(self.idx_path, "rb") as f:
+                f.readinto(self._idx)
+            self.flash_read = min(struct.unpack("<I", self._idx)[0], self.flash_total)
+        except OSError:
+            self.flash_read = 0
+        if self.flash_read >= self.flash_total:
+            self._clear_flash()
+        else:
+            print("[BACKLOG] {} fixes pendientes en flash".format(self.flash_total - self.flash_read))
+
+    def __len__(self):
+        return self.flash_total - self.flash_read + self.count
+
+    # ------------------ Escritura ------------------
+    def push(self, rec):
+        if self.count == self.slots:
+            self._spill()
+        i = (self.head + self.count) % self.slots
+        self.ram_mv[i * REC:(i + 1) * REC] = rec
+        self.count += 1
+
+    def _spill(self):
+        if self.flash_total >= self.max_flash:
+            # Flash lleno: se pierde el fix más viejo del anillo
+            self.head = (self.head + 1) % self.slots
+            self.count -= 1
+            self.dropped += 1
+            return
+        try:
+            with open(self.path, "ab") as f:
+                f.write(self.ram_mv[self.head * REC:])
+                if self.head:
+                    f.write(self.ram_mv[:self.head * REC])
+        except OSError as e:
+            print("[BACKLOG] Error escribiendo flash:", e)
+            self.head = (self.head + 1) % self.slots
+            self.count -= 1
+            self.dropped += 1
+            return
+        self.flash_total += self.count
+        self.head = 0
+        self.count = 0
+        self.spills += 1
+
+    # ------------------ Lectura ------------------
+    def peek(self, buf, n):
+        """Copia en `buf` hasta `n` fixes, del más viejo al más nuevo."""
+        mv = memoryview(buf)
+        k = min(n, self.flash_total - self.flash_read)
+        if k:
+            with open(self.path, "rb") as f:
+                f.seek(self.flash_read * REC)
+                f.readinto(mv[:k * REC])
+        for j in range(min(n - k, self.count)):
+            i = (self.head + j) % self.slots
+            mv[k * REC:(k + 1) * REC] = self.ram_mv[i * REC:(i + 1) * REC]
+            k += 1
+        return k
+
+    def newest(self, buf):
+        """Copia en `buf` el fix más nuevo; False si la cola está vacía."""
+        if self.count:
+            i = (self.head + self.count - 1) % self.slots
+            buf[:REC] = self.ram_mv[i * REC:(i + 1) * REC]
+            return True
+        if self.flash_total > self.flash_read:
+            with open(self.path, "rb") as f:
+                f.seek((self.flash_total - 1) * REC)
+                f.readinto(buf)
+            return True
+        return False
+
+    def pop(self, n):
+        """Descarta los `n` fixes más viejos (ya confirmados)."""
+        pending = self.flash_total - self.flash_read
+        m = min(n, pending)
+        if m:
+            self.flash_read += m
+            if self.flash_read >= self.flash_total:
+                self._clear_flash()
+            else:
+                struct.pack_into("<I", self._idx, 0, self.flash_read)
+                with open(self.idx_path, "wb") as f:
+                    f.write(self._idx)
+        m = min(n - m, self.count)
+        self.head = (self.head + m) % self.slots
+        self.count -= m
+
+    def _clear_flash(self):
+        for p in (self.path, self.idx_path):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        self.flash_total = 0
+        self.flash_read = 0
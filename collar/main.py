@@ -1,12 +1,21 @@
 # lora_gps_tx_rp2040.py — RP2040-Zero + GPS NEO-6M + LoRa RA-02 (SX1278)
 
-from machine import SPI, Pin, UART
+from machine import SPI, Pin, UART, lightsleep
 import time
+import random
 from lora_sx127x import SX127x
+import frames
+from adr import CollarLink
+from tdma import SlotScheduler, slot_len_ms
+from nmea import NmeaReader, RMC, GGA
+from power import Battery, EnergyLedger, GpsPower, tx_ma, GPS_LEAD_MS, GPS_BACKUP_MIN_MS
+from backlog import FixQueue
+
+COLLAR_ID = 1
 
 # ------------------ Config debug & tiempos ------------------
 debug = True  # True = más mensajes los primeros 3 min, False = siempre cada sendingInterval
-sendingInterval = 1 * 60 * 1000  # intervalo normal en ms (1 minutos)
+sendingInterval = 1 * 60 * 1000  # intervalo normal en ms (1 minutos) sin hora GPS
 
 DEBUG_FAST_MS = 2000              # intervalo rápido (2 s) cuando debug=True
 DEBUG_DURATION_MS = 3 * 60 * 1000 # duración del modo rápido: 3 minutos
@@ -22,6 +31,8 @@ PIN_DIO0 = 15
 GPS_TX = 4
 GPS_RX = 5
 
+PIN_VBAT = 26    # ADC0, divisor 100k/100k desde la batería
+
 # ------------------ LoRa (SPI1) ------------------
 spi = SPI(1, baudrate=8_000_000, polarity=0, phase=0,
           sck=Pin(PIN_SCK), mosi=Pin(PIN_MOSI), miso=Pin(PIN_MISO))
@@ -36,163 +47,301 @@ lora = SX127x(
     power=14
 )
 
+# ADR + presupuesto de aire (1 % de ciclo de trabajo)
+DUTY_CYCLE = 0.01
+link = CollarLink(lora, sf=12, power=14, duty_cycle=DUTY_CYCLE, ack_limit=4)
+
+# Slots TDMA: por defecto dimensionados para SF12 (el peor caso); el
+# handheld manda el plan definitivo en el downlink. Una TX por frame: el
+# frame tiene que alcanzar para pagar con el 1 % una trama de
+# TDMA_DUTY_FIXES fixes (a SF12 ~165 s); si no, el balde de fichas se
+# saltea slots. Cada BATCH se recorta además a lo que el frame deja
+# (batch_max_len).
+TDMA_DUTY_FIXES = 2     # mismo valor que handheald/main.py
+sched = SlotScheduler(
+    COLLAR_ID,
+    slot_len_ms(lora.time_on_air_ms(frames.FIX_LEN), link.rx_window_ms()),
+    frame_min_ms=lora.time_on_air_ms(frames.batch_len(TDMA_DUTY_FIXES)) / DUTY_CYCLE,
+)
+
 # ------------------ GPS (UART1 @ 9600) ------------------
+# timeout=0: el lector vacía lo que haya sin bloquear nunca el loop
 gps = UART(1, baudrate=9600, bits=8, parity=None, stop=1,
-           tx=Pin(GPS_TX), rx=Pin(GPS_RX), timeout=1000)
+           tx=Pin(GPS_TX), rx=Pin(GPS_RX), timeout=0,
+           rxbuf=2048)  # cubre la ventana RX del downlink sin perder NMEA
+nmea_rd = NmeaReader(gps)
+fix = nmea_rd.fix
 
-# ------------------ Helpers ------------------
-def _clean_field(s):
-    if not s:
-        return ""
-    s = s.split("*", 1)[0]
-    return s.strip().replace("\x00", "")
+# ------------------ Energía ------------------
+# Radio en sleep salvo TX y ventana RX; GPS en backup y RP2040 en
+# lightsleep entre transmisiones (ver power.py). Cada TELEM_EVERY
+# transmisiones se manda la trama TELEM con el consumo estimado en lugar
+# del fix.
+POWER_SAVE = True
+TELEM_EVERY = 60        # una de cada 60 TX (~3 h con frames de ~170 s)
+IDLE_POLL_MS = 50       # con el GPS encendido; la UART (2 KB) cubre ~2 s
 
-def _safe_int(s, default=0):
-    try:
-        s = _clean_field(s)
-        if s == "":
-            return default
-        return int(s)
-    except:
-        return default
-
-def _safe_float(s, default=0.0):
-    try:
-        s = _clean_field(s)
-        if s == "":
-            return default
-        return float(s)
-    except:
-        return default
-
-def _dm_to_deg(dm, hemi):
-    try:
-        dm = _clean_field(dm)
-        if not dm or "." not in dm:
-            return None
-        head, frac = dm.split(".")
-        mins = float(head[-2:] + "." + frac)
-        deg = float(head[:-2]) if head[:-2] else 0.0
-        out = deg + mins / 60.0
-        if hemi in ("S", "W"):
-            out = -out
-        return out
-    except:
-        return None
-
-def parse_nmea(line):
-    if not line:
-        return None
-    try:
-        s = line.decode("ascii", "ignore")
-    except:
-        s = str(line)
-    s = s.strip().replace("\x00", "")
-    if not s.startswith("$") or "*" not in s:
-        return None
-    s = s.split("*", 1)[0]
-    p = s.split(",")
-    tag = p[0][3:] if len(p[0]) >= 6 else p[0]
-
-    # RMC
-    if tag in ("RMC", "GNRMC"):
-        if len(p) < 10:
-            return None
-        status = _clean_field(p[2])
-        if status != "A":
-            return {"valid": False}
-        return {
-            "valid": True,
-            "lat": _dm_to_deg(p[3], _clean_field(p[4])),
-            "lon": _dm_to_deg(p[5], _clean_field(p[6])),
-            "spd_kn": _safe_float(p[7], 0.0),
-            "crs": _safe_float(p[8], 0.0),
-            "date": _clean_field(p[9]),
-            "time": _clean_field(p[1]),
-        }
-
-    # GGA
-    if tag in ("GGA", "GNGGA"):
-        if len(p) < 10:
-            return None
-        return {
-            "gga": True,
-            "fix":  _safe_int(p[6], 0),
-            "lat":  _dm_to_deg(p[2], _clean_field(p[3])),
-            "lon":  _dm_to_deg(p[4], _clean_field(p[5])),
-            "sats": _safe_int(p[7], 0),
-            "hdop": _safe_float(p[8], 99.0),
-            "alt":  _safe_float(p[9], 0.0),
-        }
-
-    return None
-
-# ------------------ Payload reducido ------------------
-def build_payload(rmc, gga):
-    if not rmc or not rmc.get("valid"):
-        return None
-
-    lat, lon = rmc["lat"], rmc["lon"]
-    if lat is None or lon is None:
-        return None
-
-    sats = gga.get("sats") if gga else None
-
-    return '{{"lat":{:.6f},"lon":{:.6f},"sats":{},"spd_kn":{},"crs":{},"gps_time":"{}","bat_v":62,"id":1}}'.format(
-        lat,
-        lon,
-        "null" if sats is None else sats,
-        "{:.1f}".format(rmc.get("spd_kn", 0.0)),
-        "{:.1f}".format(rmc.get("crs", 0.0)),
-        rmc.get("time", "")
+ledger = EnergyLedger()
+bat = Battery(PIN_VBAT)
+gps_pwr = GpsPower(gps, ledger)
+lora.sleep()
+ledger.set("radio", "sleep")
+
+# ------------------ Store-and-forward ------------------
+# Un fix sin ack del handheld va al backlog (RAM y, si se llena, flash).
+# Mientras el enlace responde, cada TX lleva el fix actual y los más
+# viejos del backlog en una trama BATCH delta-codificada, hasta lo que
+# entre en el slot; con el enlace caído se sigue mandando solo el fix.
+BATCH_MAX = 16          # fixes por trama BATCH (incluido el actual)
+BATCH_UNSYNCED = 4      # sin hora GPS no se conoce el slot: tramas cortas
+
+# Cada fix lleva su propio seq (un reenvío conserva el suyo) y el handheld
+# descarta los repetidos. Tras una TX sin ack los atrasados se reintentan
+# con backoff exponencial acotado: sin hora GPS con TX extra (hasta
+# RETRY_LIMIT), con TDMA solo en el slot propio.
+RETRY_BASE_MS = 4000
+RETRY_MAX_MS = 8 * 60 * 1000
+RETRY_LIMIT = 3
+
+backlog = FixQueue(ram_slots=32)
+cur = bytearray(frames.FIXREC_LEN)
+batch_buf = bytearray(BATCH_MAX * frames.FIXREC_LEN)
+batch_mv = memoryview(batch_buf)
+
+# ------------------ Payload binario ------------------
+# Trama FIX de 20 bytes (ver frames.py) en lugar del JSON de ~130 bytes:
+# a SF12/125 kHz el tiempo en aire baja de ~4.9 s a ~1.3 s por fix.
+def batch_max_len():
+    """Trama BATCH más larga que entra en el slot (con su ventana RX) y que
+    el presupuesto de aire paga una vez por frame."""
+    synced = sched.synced()
+    n = BATCH_MAX if synced else BATCH_UNSYNCED
+    allowance = sched.frame_ms * link.duty_cycle
+    while n > 1:
+        size = frames.batch_len(n)
+        toa = lora.time_on_air_ms(size)
+        if not synced or (sched.fits(toa, link.rx_window_ms()) and toa <= allowance):
+            return size
+        n -= 1
+    return frames.BATCH_LEN
+
+def build_payload(fix, seq, flags=0, atrasados=True):
+    """Devuelve (trama, atrasados incluidos, incluye el fix actual, seq del ack)."""
+    if not fix.valid or fix.lat is None or fix.lon is None:
+        return None, 0, False, None
+
+    frames.pack_fixrec(
+        cur, 0, seq, fix.lat, fix.lon,
+        spd_kn=fix.spd_kn,
+        crs=fix.crs,
+        sats=fix.sats,
+        hdop=fix.hdop,
+        bat=bat.percent(),
+        gps_t=fix.gps_t(),
+    )
+    if not atrasados or not len(backlog):
+        pl = frames.encode_fix(
+            COLLAR_ID, seq, fix.lat, fix.lon,
+            spd_kn=fix.spd_kn,
+            crs=fix.crs,
+            sats=fix.sats,
+            hdop=fix.hdop,
+            bat=cur[frames.FIXREC_LEN - 3],
+            gps_t=fix.gps_t(),
+            flags=flags,
+        )
+        return pl, 0, True, seq
+
+    # Atrasados del más viejo al más nuevo y el fix actual al final
+    k = backlog.peek(batch_buf, BATCH_MAX - 1)
+    batch_mv[k * frames.FIXREC_LEN:(k + 1) * frames.FIXREC_LEN] = cur
+    pl, used = frames.encode_batch(COLLAR_ID, batch_buf, k + 1, flags, batch_max_len())
+    return pl, min(used, k), used > k, frames.fixrec_seq(batch_buf, (used - 1) * frames.FIXREC_LEN)
+
+def build_retry(flags=0):
+    """Reintento fuera de horario: solo atrasados, sin fix nuevo."""
+    k = backlog.peek(batch_buf, BATCH_MAX)
+    if not k:
+        return None, 0, False, None
+    pl, used = frames.encode_batch(COLLAR_ID, batch_buf, k, flags, batch_max_len())
+    return pl, used, False, frames.fixrec_seq(batch_buf, (used - 1) * frames.FIXREC_LEN)
+
+def backoff_ms(n):
+    # Hasta ~1 s de jitter: dos collars que perdieron juntos no reintentan juntos
+    return min(RETRY_BASE_MS << min(n - 1, 12), RETRY_MAX_MS) + random.getrandbits(10)
+
+def build_telem(flags=0):
+    ledger.checkpoint()
+    return frames.encode_telem(
+        COLLAR_ID, bat.read_mv(),
+        ledger.mah("mcu"), ledger.mah("gps"), ledger.mah("radio"),
+        ledger.uptime_s(), flags=flags,
     )
 
+def atender_downlink(dl, ack_seq):
+    """True si el downlink confirma la trama recién enviada."""
+    d = frames.decode_downlink(dl) if dl else None
+    if not d or d["id"] != COLLAR_ID:
+        link.on_missed()
+        return False
+    link.on_downlink(d)
+    plan = d.get(frames.CMD_SCHED)
+    if plan:
+        sched.set_plan(*plan)
+    return ack_seq is not None and d["ack"] == ack_seq
+
+def transmitir(pl, ack_seq=None):
+    """Uplink + ventana RX; el radio vuelve a sleep. (salió, ack)."""
+    toa = lora.time_on_air_ms(len(pl))
+    if sched.synced() and not sched.fits(toa, link.rx_window_ms()):
+        print("[TDMA] SF{} no entra en el slot de {} ms".format(lora.sf, sched.slot_ms))
+    if not link.can_send(toa):
+        print("[TX] Presupuesto de aire agotado ({:.0f} ms libres) — se omite".format(link.tokens_ms))
+        return False, False
+    try:
+        lora.send(pl)
+        link.charge(toa)
+        ledger.charge("radio", toa, tx_ma(lora.power))
+        print("[TX {:06d}] {} B SF{} {:.0f} ms".format(seq if ack_seq is None else ack_seq,
+                                                       len(pl), lora.sf, toa))
+
+        # Ventana RX: ack + comandos ADR/TDMA del handheld
+        ledger.set("radio", "rx")
+        dl, rssi, snr = lora.rx_window(link.rx_window_ms())
+        return True, atender_downlink(dl, ack_seq)
+    except Exception as e:
+        print("⚠️ Error TX:", e)
+        return False, False
+    finally:
+        lora.sleep()
+        ledger.set("radio", "sleep")
+
+def reintento_pendiente(now):
+    return (fallos and fallos <= RETRY_LIMIT and len(backlog)
+            and not sched.synced(now) and retry_at is not None)
+
+def proximo_tx(now):
+    if sched.synced(now) and sched.next_tx is not None:
+        return sched.next_tx
+    nxt = time.ticks_add(t0, tx_period)
+    if reintento_pendiente(now) and time.ticks_diff(retry_at, nxt) < 0:
+        return retry_at
+    return nxt
+
+def dormir(now):
+    idle = time.ticks_diff(proximo_tx(now), now)
+    # Solo se apaga el GPS si ya tiene fix (arranca en caliente) y sobra tiempo
+    if (POWER_SAVE and not fast and fix.valid and gps_pwr.awake
+            and idle > GPS_LEAD_MS + GPS_BACKUP_MIN_MS):
+        ms = idle - GPS_LEAD_MS
+        gps_pwr.backup(ms)
+        ledger.set("mcu", "sleep")
+        lightsleep(ms)
+        ledger.set("mcu", "run")
+        gps_pwr.poll(time.ticks_ms())
+    else:
+        time.sleep_ms(max(1, min(idle, IDLE_POLL_MS)))
+
 # ------------------ Main ------------------
 print("🚀 LoRa GPS TX (RP2040-Zero + RA-02) iniciado")
 print("⏳ Esperando FIX GPS... (antena hacia el cielo)")
 
-last_rmc = None
-last_gga = None
 have_fix = False
 
 start_ms = time.ticks_ms()
 t0 = start_ms
 seq = 0
+tx_count = 0
+fast = debug
+
+# Los fixes que quedaron en flash conservan su seq: se sigue desde ahí para
+# no reutilizarlos. Sin backlog el seq vuelve a 0 y FLAG_BOOT le avisa al
+# handheld hasta el primer ack.
+if backlog.newest(cur):
+    seq = (frames.fixrec_seq(cur) + 1) & 0xFFFF
+boot = True
+fallos = 0          # TX seguidas sin ack
+retry_at = None
+
+tx_period = sendingInterval
 
-while True:
+def paso():
+    """Una vuelta del loop: GPS, TX si toca y sueño hasta la próxima.
+
+    Separado del while para poder correr el firmware paso a paso en la PC
+    (ver tools/host).
+    """
+    global have_fix, fast, tx_period, t0, seq, tx_count, boot, fallos, retry_at
     now = time.ticks_ms()
-    uptime_ms = time.ticks_diff(now, start_ms)
 
-    # determinar periodo actual según debug/tiempo
-    if debug and uptime_ms < DEBUG_DURATION_MS:
-        tx_period = DEBUG_FAST_MS
+    # determinar periodo actual según debug/tiempo (solo sin hora GPS);
+    # el modo rápido se apaga una sola vez (ticks_diff da la vuelta en días)
+    if fast and time.ticks_diff(now, start_ms) >= DEBUG_DURATION_MS:
+        fast = False
+    # Sin TDMA tampoco se transmite más seguido de lo que paga el 1 %
+    tx_period = DEBUG_FAST_MS if fast else max(
+        sendingInterval, int(lora.time_on_air_ms(frames.FIX_LEN) / link.duty_cycle))
+
+    gps_pwr.poll(now)
+    got = nmea_rd.poll()
+    if got & GGA and fix.quality >= 1 and not have_fix:
+        have_fix = True
+        print("✅ FIX GPS detectado — TX debug={}".format(debug))
+    if got & RMC:
+        # El receptor da hora UTC antes que posición: sirve para TDMA
+        sched.sync(fix.gps_t(), fix.ms)
+
+    # Con hora GPS se transmite en el slot propio; sin ella, cada tx_period
+    if sched.synced(now):
+        tx_now = sched.due(now)
     else:
-        tx_period = sendingInterval
-
-    if gps.any():
-        raw = gps.readline()
-        if raw:
-            d = parse_nmea(raw)
-            if d:
-                if d.get("gga"):
-                    last_gga = d
-                    if d.get("fix", 0) >= 1 and not have_fix:
-                        have_fix = True
-                        print("✅ FIX GPS detectado — TX debug={}".format(debug))
-                elif "valid" in d:
-                    last_rmc = d
-
-    if time.ticks_diff(now, t0) >= tx_period:
-        t0 = now
-        pl = build_payload(last_rmc, last_gga)
+        tx_now = time.ticks_diff(now, t0) >= tx_period
+    reintento = not tx_now and reintento_pendiente(now) and time.ticks_diff(now, retry_at) >= 0
+    if tx_now or reintento:
+        flags = 0 if sched.assigned else frames.FLAG_NEED_SCHED
+        if boot:
+            flags |= frames.FLAG_BOOT
+        nuevo = False
+        if reintento:
+            pl, atrasados, con_actual, ack_seq = build_retry(flags)
+        elif tx_count % TELEM_EVERY == TELEM_EVERY - 1:
+            t0 = now
+            pl, atrasados, con_actual, ack_seq = build_telem(flags), 0, False, None
+            print("[TELEM]", ledger.report())
+        else:
+            t0 = now
+            # Los atrasados viajan con el fix si el enlace responde o venció el backoff
+            vencido = retry_at is not None and time.ticks_diff(now, retry_at) >= 0
+            pl, atrasados, con_actual, ack_seq = build_payload(fix, seq, flags, not fallos or vencido)
+            nuevo = pl is not None
         if pl:
-            try:
-                lora.send(pl.encode())
-                print("[TX {:06d}] {}".format(seq, pl))
-                seq += 1
-            except Exception as e:
-                print("⚠️ Error TX:", e)
+            if nuevo:
+                seq = (seq + 1) & 0xFFFF
+            salio, ack = transmitir(pl, ack_seq)
+            if not reintento:
+                tx_count += 1
+            if ack:
+                boot = False
+                fallos = 0
+                retry_at = None
+                if atrasados:
+                    backlog.pop(atrasados)
+                    print("[BACKLOG] {} atrasados confirmados, quedan {}".format(atrasados, len(backlog)))
+            elif salio and ack_seq is not None:
+                fallos += 1
+                retry_at = time.ticks_add(time.ticks_ms(), backoff_ms(fallos))
+            if nuevo and (not ack or not con_actual):
+                backlog.push(cur)       # sin ack, o la BATCH no llegó a incluirlo
+        elif reintento:
+            retry_at = None
         else:
             print("[TX] GPS sin fix — esperando...")
 
-    time.sleep_ms(5)
+    dormir(time.ticks_ms())
+
+def run():
+    while True:
+        paso()
+
+if __name__ == "__main__":
+    run()
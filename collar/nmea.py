@@ -0,0 +1,271 @@
+# nmea.py — Lector NMEA incremental (RMC + GGA) sin crear strings
+#
+# poll() vacía el buffer de la UART con readinto sobre un bytearray fijo y
+# pasa byte a byte por una máquina de estados: '$' abre una sentencia, el
+# XOR de los bytes hasta '*' se compara con los dos dígitos hex que siguen
+# y solo las sentencias con checksum correcto se interpretan. Una sentencia
+# puede llegar partida entre varias lecturas.
+#
+# Los campos se leen directo de los bytes de la sentencia y se guardan en
+# un único objeto Fix que se reutiliza; lo único que se crea por sentencia
+# son los floats de posición, velocidad, rumbo, HDOP y altura.
+import frames
+
+RMC = 0x01
+GGA = 0x02
+
+_IDLE = 0
+_BODY = 1
+_CK1 = 2
+_CK2 = 3
+
+MAX_SENTENCE = 96     # NMEA 0183 limita a 82 caracteres
+MAX_FIELDS = 20
+
+
+def _hex(c):
+    if 48 <= c <= 57:
+        return c - 48
+    if 65 <= c <= 70:
+        return c - 55
+    if 97 <= c <= 102:
+        return c - 87
+    return -1
+
+
+class Fix:
+    def __init__(self):
+        self.valid = False      # RMC con estado 'A'
+        self.lat = None
+        self.lon = None
+        self.spd_kn = 0.0
+        self.crs = 0.0
+        self.year = 0
+        self.month = 0
+        self.day = 0
+        self.tod = -1           # segundos UTC del día (-1 = sin hora)
+        self.ms = 0
+        self.quality = 0        # GGA: 0 sin fix, 1 GPS, 2 DGPS...
+        self.sats = None        # None hasta la primera GGA
+        self.hdop = None
+        self.alt = None
+        self.rmc_count = 0
+        self.gga_count = 0
+
+    def gps_t(self):
+        """Segundos UTC desde 2000 (0 si aún no hay fecha y hora)."""
+        if self.tod < 0 or not self.year:
+            return 0
+        return frames.civil_to_t2000(self.year, self.month, self.day) + self.tod
+
+
+class NmeaReader:
+    def __init__(self, uart, fix=None, chunk=128):
+        self.uart = uart
+        self.fix = fix if fix is not None else Fix()
+        self.rx = bytearray(chunk)
+        self.rx_mv = memoryview(self.rx)
+        self.line = bytearray(MAX_SENTENCE)
+        self.n = 0
+        self.state = _IDLE
+        self.ck = 0
+        self.ck_rx = 0
+        self.fields = [0] * (MAX_FIELDS + 1)   # inicio de cada campo
+        self.nfields = 0
+        self.sentences = 0
+        self.bad_checksum = 0
+        self.overflows = 0
+
+    # ------------------ Lectura ------------------
+    def poll(self):
+        """Lee todo lo disponible; devuelve RMC | GGA según lo interpretado."""
+        got = 0
+        while True:
+            k = self.uart.any()
+            if not k:
+                return got
+            if k > len(self.rx):
+                k = len(self.rx)
+            k = self.uart.readinto(self.rx_mv[:k])
+            if not k:
+                return got
+            for i in range(k):
+                got |= self.feed(self.rx[i])
+
+    def feed(self, c):
+        st = self.state
+        if c == 36:                         # '$': siempre empieza de nuevo
+            self.state = _BODY
+            self.n = 0
+            self.ck = 0
+            return 0
+        if st == _BODY:
+            if c == 42:                     # '*'
+                self.state = _CK1
+            elif c < 32 or c > 126:
+                self.state = _IDLE          # fin de línea sin checksum
+            elif self.n >= MAX_SENTENCE:
+                self.overflows += 1
+                self.state = _IDLE
+            else:
+                self.line[self.n] = c
+                self.n += 1
+                self.ck ^= c
+            return 0
+        if st == _CK1:
+            h = _hex(c)
+            self.ck_rx = h << 4
+            self.state = _CK2 if h >= 0 else _IDLE
+            return 0
+        if st == _CK2:
+            self.state = _IDLE
+            h = _hex(c)
+            if h < 0 or (self.ck_rx | h) != self.ck:
+                self.bad_checksum += 1
+                return 0
+            self.sentences += 1
+            return self._dispatch()
+        return 0
+
+    # ------------------ Campos ------------------
+    def _split(self):
+        f = self.fields
+        f[0] = 0
+        nf = 1
+        line = self.line
+        for i in range(self.n):
+            if line[i] == 44 and nf < MAX_FIELDS:   # ','
+                f[nf] = i + 1
+                nf += 1
+        f[nf] = self.n + 1
+        self.nfields = nf
+
+    def _empty(self, k):
+        return k >= self.nfields or self.fields[k + 1] - 1 <= self.fields[k]
+
+    def _char(self, k):
+        return 0 if self._empty(k) else self.line[self.fields[k]]
+
+    def _int(self, k, default=0):
+        if self._empty(k):
+            return default
+        s = self.fields[k]
+        e = self.fields[k + 1] - 1
+        v = 0
+        line = self.line
+        for i in range(s, e):
+            c = line[i]
+            if c < 48 or c > 57:
+                return default
+            v = v * 10 + c - 48
+        return v
+
+    def _num(self, k, default=None):
+        if self._empty(k):
+            return default
+        return self._decimal(self.fields[k], self.fields[k + 1] - 1, default)
+
+    def _decimal(self, s, e, default):
+        v = 0
+        div = 1
+        dot = False
+        line = self.line
+        for i in range(s, e):
+            c = line[i]
+            if c == 46 and not dot:
+                dot = True
+            elif 48 <= c <= 57:
+                v = v * 10 + c - 48
+                if dot:
+                    div *= 10
+            elif c == 45 and i == s:
+                continue
+            else:
+                return default
+        if line[s] == 45:
+            v = -v
+        return v / div
+
+    def _digits(self, s, n):
+        v = 0
+        for i in range(s, s + n):
+            v = v * 10 + self.line[i] - 48
+        return v
+
+    def _coord(self, k, hemi_k, deg_digits):
+        # dddmm.mmmm -> grados decimales
+        if self._empty(k):
+            return None
+        s = self.fields[k]
+        e = self.fields[k + 1] - 1
+        if e - s < deg_digits + 2:
+            return None
+        deg = self._digits(s, deg_digits)
+        mins = self._decimal(s + deg_digits, e, None)
+        if mins is None:
+            return None
+        out = deg + mins / 60.0
+        h = self._char(hemi_k)
+        return -out if h == 83 or h == 87 else out    # 'S' / 'W'
+
+    def _time(self, k):
+        fix = self.fix
+        if self._empty(k):
+            return
+        s = self.fields[k]
+        e = self.fields[k + 1] - 1
+        if e - s < 6:
+            return
+        fix.tod = self._digits(s, 2) * 3600 + self._digits(s + 2, 2) * 60 + self._digits(s + 4, 2)
+        ms = 0
+        if e - s > 7 and self.line[s + 6] == 46:
+            scale = 100
+            for i in range(s + 7, min(e, s + 10)):
+                ms += (self.line[i] - 48) * scale
+                scale //= 10
+        fix.ms = ms
+
+    # ------------------ Sentencias ------------------
+    def _dispatch(self):
+        line = self.line
+        if self.n < 6:
+            return 0
+        a, b, c = line[2], line[3], line[4]
+        if a == 82 and b == 77 and c == 67:         # RMC
+            self._split()
+            return self._rmc()
+        if a == 71 and b == 71 and c == 65:         # GGA
+            self._split()
+            return self._gga()
+        return 0
+
+    def _rmc(self):
+        if self.nfields < 10:
+            return 0
+        fix = self.fix
+        self._time(1)
+        if not self._empty(9):
+            s = self.fields[9]
+            if self.fields[10] - 1 - s == 6:
+                fix.day = self._digits(s, 2)
+                fix.month = self._digits(s + 2, 2)
+                fix.year = 2000 + self._digits(s + 4, 2)
+        fix.valid = self._char(2) == 65                # 'A'
+        if fix.valid:
+            fix.lat = self._coord(3, 4, 2)
+            fix.lon = self._coord(5, 6, 3)
+            fix.spd_kn = self._num(7, 0.0)
+            fix.crs = self._num(8, 0.0)
+        fix.rmc_count += 1
+        return RMC
+
+    def _gga(self):
+        if self.nfields < 10:
+            return 0
+        fix = self.fix
+        fix.quality = self._int(6, 0)
+        fix.sats = self._int(7, 0)
+        fix.hdop = self._num(8, 99.0)
+        fix.alt = self._num(9, 0.0)
+        fix.gga_count += 1
+        return GGA
@@ -0,0 +1,163 @@
+# power.py — Batería, ahorro de energía del GPS y contabilidad de consumo
+#
+# Entre transmisiones el collar apaga lo que no usa: el radio queda en
+# sleep fuera de TX y de la ventana RX, el NEO-6M entra en backup con
+# UBX-RXM-PMREQ y se despierta solo `GPS_LEAD_MS` antes del próximo slot
+# (arranque en caliente), y el RP2040 hace lightsleep mientras tanto.
+#
+# EnergyLedger integra tiempo x corriente por subsistema con corrientes
+# típicas de hoja de datos; no es una medición, pero alcanza para comparar
+# configuraciones y estimar la autonomía. El total viaja en la trama TELEM.
+import time
+import struct
+from machine import ADC, Pin
+
+# Corriente típica por estado (mA)
+CURRENT_MA = {
+    "mcu": {"run": 25.0, "sleep": 1.4},
+    "gps": {"on": 45.0, "backup": 0.1},
+    "radio": {"sleep": 0.001, "standby": 1.6, "rx": 10.8},
+}
+
+# TX del SX1278 por PA_BOOST según potencia (dBm -> mA)
+TX_MA = ((2, 24.0), (5, 28.0), (8, 33.0), (11, 42.0), (14, 60.0), (17, 90.0), (20, 120.0))
+
+GPS_LEAD_MS = 10000         # el GPS se despierta esto antes del TX
+GPS_BACKUP_MIN_MS = 20000   # con menos tiempo libre no conviene apagarlo
+
+# Curva de descarga LiPo 1S (mV, %) de mayor a menor
+LIPO_CURVE = ((4200, 100), (4100, 90), (4000, 80), (3900, 65), (3800, 50),
+              (3700, 30), (3600, 15), (3500, 5), (3300, 0))
+
+
+def tx_ma(power_dbm):
+    for dbm, ma in TX_MA:
+        if power_dbm <= dbm:
+            return ma
+    return TX_MA[-1][1]
+
+
+# ------------------ Batería ------------------
+class Battery:
+    def __init__(self, pin=26, divider=2.0, vref=3.3, samples=8):
+        self.adc = ADC(Pin(pin))
+        self.scale = vref * 1000 * divider / 65535
+        self.samples = samples
+        self.mv = 0
+
+    def read_mv(self):
+        acc = 0
+        for _ in range(self.samples):
+            acc += self.adc.read_u16()
+        self.mv = int(acc / self.samples * self.scale)
+        return self.mv
+
+    def percent(self, mv=None):
+        mv = self.read_mv() if mv is None else mv
+        if mv >= LIPO_CURVE[0][0]:
+            return 100
+        for i in range(1, len(LIPO_CURVE)):
+            hi_mv, hi_pct = LIPO_CURVE[i - 1]
+            lo_mv, lo_pct = LIPO_CURVE[i]
+            if mv >= lo_mv:
+                return lo_pct + (mv - lo_mv) * (hi_pct - lo_pct) // (hi_mv - lo_mv)
+        return 0
+
+
+# ------------------ GPS (UBX) ------------------
+def ubx_packet(cls, id_, payload):
+    out = bytearray(8 + len(payload))
+    out[0] = 0xB5
+    out[1] = 0x62
+    out[2] = cls
+    out[3] = id_
+    struct.pack_into("<H", out, 4, len(payload))
+    out[6:6 + len(payload)] = payload
+    ck_a = ck_b = 0
+    for i in range(2, 6 + len(payload)):
+        ck_a = (ck_a + out[i]) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    out[-2] = ck_a
+    out[-1] = ck_b
+    return out
+
+
+class GpsPower:
+    """Backup temporizado del NEO-6M (UBX-RXM-PMREQ)."""
+
+    def __init__(self, uart, ledger=None):
+        self.uart = uart
+        self.ledger = ledger
+        self.awake = True
+        self.wake_at = 0
+        self.backups = 0
+
+    def backup(self, ms):
+        # flags bit 1 = backup; el receptor vuelve solo al terminar `ms`
+        self.uart.write(ubx_packet(0x02, 0x41, struct.pack("<II", ms, 2)))
+        self.awake = False
+        self.wake_at = time.ticks_add(time.ticks_ms(), ms)
+        self.backups += 1
+        if self.ledger:
+            self.ledger.set("gps", "backup")
+
+    def poll(self, now):
+        if not self.awake and time.ticks_diff(now, self.wake_at) >= 0:
+            self.awake = True
+            if self.ledger:
+                self.ledger.set("gps", "on")
+
+
+# ------------------ Consumo ------------------
+class EnergyLedger:
+    def __init__(self):
+        now = time.ticks_ms()
+        # ticks_ms da la vuelta en ~12 días: el tiempo total se acumula
+        self.uptime_ms = 0
+        self.last = now
+        self.mas = {}             # subsistema -> mA·s acumulados
+        self.state = {}           # subsistema -> (estado, ticks desde)
+        for sub in CURRENT_MA:
+            self.mas[sub] = 0.0
+        self.state["mcu"] = ("run", now)
+        self.state["gps"] = ("on", now)
+        self.state["radio"] = ("rx", now)
+
+    def _close(self, sub, now):
+        st, since = self.state[sub]
+        self.mas[sub] += time.ticks_diff(now, since) * CURRENT_MA[sub][st] / 1000
+
+    def _advance(self, now):
+        self.uptime_ms += time.ticks_diff(now, self.last)
+        self.last = now
+
+    def set(self, sub, st, now=None):
+        now = time.ticks_ms() if now is None else now
+        self._advance(now)
+        if self.state[sub][0] == st:
+            return
+        self._close(sub, now)
+        self.state[sub] = (st, now)
+
+    def charge(self, sub, ms, ma):
+        """Consumo puntual que no es un estado (p. ej. TX a cierta potencia)."""
+        self.mas[sub] += ms * ma / 1000
+
+    def checkpoint(self, now=None):
+        """Cierra los estados abiertos (llamar al menos cada pocos días)."""
+        now = time.ticks_ms() if now is None else now
+        self._advance(now)
+        for sub in self.state:
+            self._close(sub, now)
+            self.state[sub] = (self.state[sub][0], now)
+
+    def mah(self, sub):
+        return self.mas[sub] / 3600
+
+    def uptime_s(self):
+        return self.uptime_ms // 1000
+
+    def report(self):
+        self.checkpoint()
+        return "mcu {:.2f} gps {:.2f} radio {:.2f} mAh en {} s".format(
+            self.mah("mcu"), self.mah("gps"), self.mah("radio"), self.uptime_s())
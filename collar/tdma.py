@@ -0,0 +1,99 @@
+# tdma.py — Slots de transmisión sincronizados con la hora GPS
+#
+# El tiempo se divide en frames de `frame_ms` alineados a la hora UTC
+# (segundos desde 2000, ver frames.gps_to_t2000) y cada frame en `slots`
+# slots iguales. Cada collar transmite una vez por frame, al comienzo de su
+# slot más una guarda, así que con N collars no hay dos uplinks en el aire
+# al mismo tiempo. El slot por defecto es COLLAR_ID % slots; el handheld
+# publica largo de frame, número de slots y slot asignado en el downlink
+# (CMD_SCHED) y el collar lo adopta.
+#
+# El reloj se corrige con cada sentencia RMC que trae hora (aunque todavía
+# no haya fix de posición). Sin PPS la hora de la sentencia llega con unos
+# cientos de ms de retraso; NMEA_LATENCY_MS lo compensa en promedio y la
+# guarda cubre el resto.
+import time
+
+GUARD_MS = 500              # margen al inicio y al final del slot
+NMEA_LATENCY_MS = 150       # retraso típico entre el segundo UTC y la RMC
+SYNC_MAX_AGE_MS = 10 * 60 * 1000   # sin RMC por este tiempo se pierde la sincronía
+DEFAULT_SLOTS = 16
+
+
+def slot_len_ms(toa_ms, rx_window_ms):
+    """Largo mínimo de slot: uplink + ventana del downlink + guardas (múltiplo de 250 ms)."""
+    need = toa_ms + rx_window_ms + 2 * GUARD_MS
+    return (int(need) + 249) // 250 * 250
+
+
+class SlotScheduler:
+    def __init__(self, collar_id, slot_ms, slots=DEFAULT_SLOTS, frame_min_ms=0):
+        self.id = collar_id
+        self.assigned = False     # True cuando el plan viene del handheld
+        self.sync_ticks = None
+        self.sync_ms = 0          # ms desde 2000 en sync_ticks
+        self.next_tx = None
+        self.missed = 0           # slots perdidos (el bucle llegó tarde)
+        # El frame por defecto no baja de frame_min_ms (presupuesto de aire)
+        frame = max(slot_ms * slots, (int(frame_min_ms) + 999) // 1000 * 1000)
+        self._plan(frame, slots, collar_id % slots)
+
+    def _plan(self, frame_ms, slots, slot):
+        self.frame_ms = frame_ms
+        self.slots = slots
+        self.slot = slot
+        self.slot_ms = frame_ms // slots
+        self.next_tx = None
+
+    def set_plan(self, frame_s, slots, slot):
+        if not slots or slot >= slots:
+            return
+        if (frame_s * 1000, slots, slot) != (self.frame_ms, self.slots, self.slot):
+            print("[TDMA] Plan: frame {} s, {} slots, slot {}".format(frame_s, slots, slot))
+            self._plan(frame_s * 1000, slots, slot)
+        self.assigned = True
+
+    def sync(self, t2000, ms=0):
+        """Corrige el reloj con la hora de una RMC (segundos desde 2000 + ms)."""
+        if not t2000:
+            return
+        first = self.sync_ticks is None
+        self.sync_ticks = time.ticks_ms()
+        self.sync_ms = t2000 * 1000 + ms + NMEA_LATENCY_MS
+        if first:
+            print("[TDMA] Hora GPS sincronizada — slot {} de {}".format(self.slot, self.slots))
+
+    def synced(self, now=None):
+        if self.sync_ticks is None:
+            return False
+        now = time.ticks_ms() if now is None else now
+        return time.ticks_diff(now, self.sync_ticks) < SYNC_MAX_AGE_MS
+
+    def utc_ms(self, now):
+        return self.sync_ms + time.ticks_diff(now, self.sync_ticks)
+
+    def ms_to_slot(self, now):
+        """ms hasta el próximo inicio de transmisión propio."""
+        pos = self.utc_ms(now) % self.frame_ms
+        start = self.slot * self.slot_ms + GUARD_MS
+        return (start - pos) % self.frame_ms
+
+    def fits(self, toa_ms, rx_window_ms):
+        return toa_ms + rx_window_ms + 2 * GUARD_MS <= self.slot_ms
+
+    def due(self, now):
+        """True una vez por frame, al comienzo del slot propio."""
+        if self.next_tx is None:
+            self.next_tx = time.ticks_add(now, self.ms_to_slot(now))
+            return False
+        late = time.ticks_diff(now, self.next_tx)
+        if late < 0:
+            return False
+        wait = self.ms_to_slot(now)
+        self.next_tx = time.ticks_add(now, wait if wait > GUARD_MS else wait + self.frame_ms)
+        if late > self.slot_ms - 2 * GUARD_MS:
+            # Llegamos tarde (p. ej. bloqueados en TX/RX): transmitir ahora
+            # pisaría el slot del siguiente collar.
+            self.missed += 1
+            return False
+        return True
@@ -0,0 +1,405 @@
+# frames.py — Formato binario de las tramas LoRa collar -> handheld
+#
+# Módulo compartido (collar y handheld). Todas las tramas empiezan con un
+# byte de cabecera: tipo de trama en el nibble bajo y banderas en el alto.
+# Las tramas JSON heredadas empiezan con '{' (0x7B); su nibble bajo (0xB) no
+# coincide con ningún tipo, así que ambos formatos conviven durante la
+# migración.
+#
+# Trama FIX (tipo 1, 20 bytes, little endian):
+#   B  cabecera      tipo | banderas << 4
+#   B  id            id del collar
+#   H  seq           número de fix del collar (un reenvío conserva el suyo)
+#   i  lat           grados * 1e7
+#   i  lon           grados * 1e7
+#   B  spd           nudos * 10 (tope 25.4; 255 = sin dato)
+#   B  crs           rumbo * 256 / 360
+#   B  sats_hdop     satélites (tope 15) << 4 | HDOP * 2 (tope 14; 15 = sin dato)
+#   B  bat           batería en % (255 = sin dato)
+#   I  gps_t         segundos UTC desde 2000-01-01 (0 = sin hora GPS)
+#
+# Trama TELEM (tipo 2, 14 bytes): consumo estimado del collar
+#   B  cabecera      B  id
+#   H  bat_mv        tensión de batería (mV)
+#   H  mcu, gps, radio   consumo acumulado por subsistema (0.1 mAh, da la vuelta)
+#   I  uptime        segundos desde el arranque
+#
+# Trama BATCH (tipo 3): varios fixes en una trama, en orden cronológico
+#   B  cabecera      B  id          H  seq      (del fix base)
+#   B  n             cantidad de fixes (base + deltas)
+#   B  bat           batería en % (del fix más nuevo)
+#   I  gps_t         i  lat        i  lon      (fix base, como en FIX)
+#   B  spd           B  crs        B  sats_hdop
+#   ... n-1 deltas de 9 bytes, cada uno respecto del fix anterior:
+#   B  dseq          H  dt (s)     h  dlat     h  dlon   (1e-6 grados)
+#   B  spd           B  sats_hdop
+# El downlink confirma una BATCH con el seq de su último fix.
+#
+# Los collars guardan los fixes pendientes como registros FIXREC de 18
+# bytes (I gps_t, i lat*1e7, i lon*1e7, B spd, B crs, B sats_hdop, B bat,
+# H seq) y encode_batch los arma directamente desde ese buffer.
+#
+# Trama DOWN (tipo 8, handheld -> collar, en la ventana RX tras un uplink):
+#   B  cabecera      tipo | banderas << 4
+#   B  id            collar destino
+#   H  ack           seq del uplink que se confirma (el último fix si es BATCH)
+#   ... comandos: 1 byte de código + argumentos de formato fijo (CMD_FMT)
+#
+#   CMD_ADR    B sf, B potencia dBm, H preámbulo (símbolos)
+#   CMD_SCHED  H largo del frame TDMA (s), H número de slots, H slot asignado
+#
+# Banderas del uplink (nibble alto de la cabecera):
+#   FLAG_NEED_SCHED  el collar no tiene plan TDMA del handheld
+#   FLAG_BOOT        el collar arrancó y aún no recibió un ack (seq reiniciado)
+import struct
+import json
+
+KIND_MASK   = 0x0F
+KIND_FIX    = 0x01
+KIND_TELEM  = 0x02
+KIND_BATCH  = 0x03
+
+KIND_DOWN   = 0x08
+
+FIX_FMT = "<BBHiiBBBBI"
+FIX_LEN = 20
+
+TELEM_FMT = "<BBHHHHI"
+TELEM_LEN = 14
+
+FIXREC_FMT = "<IiiBBBBH"
+FIXREC_LEN = 18
+BATCH_FMT = "<BBHBBIiiBBB"
+BATCH_LEN = 21
+DELTA_FMT = "<BHhhBB"
+DELTA_LEN = 9
+DELTA_SCALE = 10          # delta en 1e-6 grados = 10 unidades de 1e-7
+
+DOWN_FMT = "<BBH"
+DOWN_LEN = 4
+DOWN_MAX_LEN = 16     # tope usado para dimensionar la ventana RX del collar
+
+CMD_ADR     = 0x01
+CMD_SCHED   = 0x02
+CMD_FMT = {
+    CMD_ADR: "<BBH",
+    CMD_SCHED: "<HHH",
+}
+
+FLAG_NEED_SCHED = 0x01
+FLAG_BOOT       = 0x02
+
+NA_U8       = 0xFF
+HDOP_NA     = 0x0F
+EPOCH_2000  = 946684800   # segundos entre 1970-01-01 y 2000-01-01
+
+
+# ------------------ Fecha / hora GPS ------------------
+def _days_from_civil(y, m, d):
+    # Días desde 2000-01-01 (algoritmo de H. Hinnant, válido para y >= 2000)
+    y -= m <= 2
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 730425
+
+
+def _civil_from_days(z):
+    z += 730425
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + (3 if mp < 10 else -9)
+    return yoe + era * 400 + (m <= 2), m, d
+
+
+def civil_to_t2000(y, m, d):
+    """Segundos desde 2000 a las 00:00 UTC del día dado."""
+    return _days_from_civil(y, m, d) * 86400
+
+
+def gps_to_t2000(date, hms):
+    """date="DDMMYY", hms="HHMMSS(.sss)" (RMC) -> segundos desde 2000, o 0."""
+    try:
+        if len(date) < 6 or len(hms) < 6:
+            return 0
+        day = civil_to_t2000(2000 + int(date[4:6]), int(date[2:4]), int(date[0:2]))
+        return day + int(hms[0:2]) * 3600 + int(hms[2:4]) * 60 + int(hms[4:6])
+    except ValueError:
+        return 0
+
+
+def t2000_to_gps(t):
+    """Inverso de gps_to_t2000: devuelve ("DDMMYY", "HHMMSS")."""
+    days, secs = divmod(t, 86400)
+    y, m, d = _civil_from_days(days)
+    return ("{:02d}{:02d}{:02d}".format(d, m, y % 100),
+            "{:02d}{:02d}{:02d}".format(secs // 3600, (secs // 60) % 60, secs % 60))
+
+
+def t2000_to_iso(t):
+    """Segundos desde 2000 -> "AAAA-MM-DDTHH:MM:SSZ"."""
+    days, secs = divmod(t, 86400)
+    y, m, d = _civil_from_days(days)
+    return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(
+        y, m, d, secs // 3600, (secs // 60) % 60, secs % 60)
+
+
+# ------------------ Codificación (collar) ------------------
+def _u8(x, scale, na=NA_U8, top=254):
+    if x is None:
+        return na
+    v = int(x * scale + 0.5)
+    return 0 if v < 0 else (top if v > top else v)
+
+
+def encode_fix(id_, seq, lat, lon, spd_kn=None, crs=None, sats=None, hdop=None,
+               bat=None, gps_t=0, flags=0):
+    sats_nib = 0 if sats is None else min(int(sats), 15)
+    hdop_nib = _u8(hdop, 2, HDOP_NA, 14)
+    return struct.pack(
+        FIX_FMT,
+        KIND_FIX | ((flags & 0x0F) << 4),
+        id_ & 0xFF,
+        seq & 0xFFFF,
+        int(round(lat * 1e7)),
+        int(round(lon * 1e7)),
+        _u8(spd_kn, 10),
+        0 if crs is None else int(crs * 256 / 360 + 0.5) & 0xFF,
+        (sats_nib << 4) | hdop_nib,
+        _u8(bat, 1),
+        gps_t,
+    )
+
+
+def encode_telem(id_, bat_mv, mcu_mah, gps_mah, radio_mah, uptime_s, flags=0):
+    return struct.pack(
+        TELEM_FMT,
+        KIND_TELEM | ((flags & 0x0F) << 4),
+        id_ & 0xFF,
+        min(int(bat_mv), 0xFFFF),
+        int(mcu_mah * 10) & 0xFFFF,
+        int(gps_mah * 10) & 0xFFFF,
+        int(radio_mah * 10) & 0xFFFF,
+        int(uptime_s) & 0xFFFFFFFF,
+    )
+
+
+def pack_fixrec(buf, off, seq, lat, lon, spd_kn=None, crs=None, sats=None, hdop=None,
+                bat=None, gps_t=0):
+    sats_nib = 0 if sats is None else min(int(sats), 15)
+    struct.pack_into(
+        FIXREC_FMT, buf, off,
+        gps_t,
+        int(round(lat * 1e7)),
+        int(round(lon * 1e7)),
+        _u8(spd_kn, 10),
+        0 if crs is None else int(crs * 256 / 360 + 0.5) & 0xFF,
+        (sats_nib << 4) | _u8(hdop, 2, HDOP_NA, 14),
+        _u8(bat, 1),
+        seq & 0xFFFF,
+    )
+
+
+def fixrec_seq(buf, off=0):
+    return struct.unpack_from("<H", buf, off + FIXREC_LEN - 2)[0]
+
+
+def batch_len(n):
+    """Largo en bytes de una trama BATCH de n fixes."""
+    return BATCH_LEN + (n - 1) * DELTA_LEN
+
+
+def encode_batch(id_, recs, n, flags=0, max_len=255):
+    """Arma una trama BATCH con los primeros `n` FIXREC de `recs`.
+
+    Corta antes si la trama pasaría de `max_len` o si un delta no entra
+    (salto de tiempo, de posición o de seq demasiado grande). Devuelve
+    (trama, fixes_incluidos).
+    """
+    t, lat, lon, spd, crs, sh, _, seq = struct.unpack_from(FIXREC_FMT, recs, 0)
+    used = 1
+    out = bytearray(BATCH_LEN)
+    prev_t, prev_lat, prev_lon, prev_seq = t, lat, lon, seq
+    while used < n and BATCH_LEN + used * DELTA_LEN <= max_len:
+        t2, lat2, lon2, spd2, _, sh2, _, seq2 = struct.unpack_from(FIXREC_FMT, recs, used * FIXREC_LEN)
+        dseq = (seq2 - prev_seq) & 0xFFFF
+        dt = t2 - prev_t
+        dlat = (lat2 - prev_lat + DELTA_SCALE // 2) // DELTA_SCALE
+        dlon = (lon2 - prev_lon + DELTA_SCALE // 2) // DELTA_SCALE
+        if not (0 < dseq <= 0xFF and 0 <= dt <= 0xFFFF
+                and -0x8000 <= dlat <= 0x7FFF and -0x8000 <= dlon <= 0x7FFF):
+            break
+        out.extend(struct.pack(DELTA_FMT, dseq, dt, dlat, dlon, spd2, sh2))
+        # Se acumula lo transmitido (no el valor exacto) para no arrastrar error
+        prev_t = t2
+        prev_seq = seq2
+        prev_lat += dlat * DELTA_SCALE
+        prev_lon += dlon * DELTA_SCALE
+        used += 1
+    bat = recs[(used - 1) * FIXREC_LEN + FIXREC_LEN - 3]
+    struct.pack_into(BATCH_FMT, out, 0, KIND_BATCH | ((flags & 0x0F) << 4), id_ & 0xFF,
+                     seq, used, bat, t, lat, lon, spd, crs, sh)
+    return bytes(out), used
+
+
+# ------------------ Decodificación (handheld) ------------------
+def _fix_dict(id_, seq, flags, t, lat, lon, spd, crs, sh, bat):
+    hdop = sh & 0x0F
+    out = {
+        "kind": KIND_FIX,
+        "flags": flags,
+        "id": id_,
+        "seq": seq,
+        "lat": lat / 1e7,
+        "lon": lon / 1e7,
+        "alt": None,
+        "sats": sh >> 4,
+        "hdop": None if hdop == HDOP_NA else hdop / 2,
+        "spd_kn": None if spd == NA_U8 else spd / 10,
+        "crs": None if crs is None else crs * 360 / 256,
+        "bat_v": None if bat == NA_U8 else bat,
+        "date": None,
+        "gps_time": None,
+        "ts": None,
+    }
+    if t:
+        out["date"], out["gps_time"] = t2000_to_gps(t)
+        out["ts"] = t + EPOCH_2000
+    return out
+
+
+def fix_fields(pkt):
+    """Campos crudos de una trama FIX, en el orden de _fix_dict (sin dict)."""
+    head, id_, seq, lat, lon, spd, crs, sh, bat, gps_t = struct.unpack(FIX_FMT, pkt)
+    return id_, seq, head >> 4, gps_t, lat, lon, spd, crs, sh, bat
+
+
+def decode_fix(pkt):
+    return _fix_dict(*fix_fields(pkt))
+
+
+def decode_telem(pkt):
+    head, id_, bat_mv, mcu, gps, radio, uptime = struct.unpack(TELEM_FMT, pkt)
+    return {
+        "kind": KIND_TELEM,
+        "flags": head >> 4,
+        "id": id_,
+        "bat_mv": bat_mv,
+        "mcu_mah": mcu / 10,
+        "gps_mah": gps / 10,
+        "radio_mah": radio / 10,
+        "uptime_s": uptime,
+    }
+
+
+def batch_fixes(pkt):
+    """Campos crudos de cada fix de una trama BATCH, del más viejo al actual
+    (tuplas como fix_fields); None si el largo no cuadra."""
+    head, id_, seq, n, bat, t, lat, lon, spd, crs, sh = struct.unpack_from(BATCH_FMT, pkt, 0)
+    if len(pkt) != BATCH_LEN + (n - 1) * DELTA_LEN or n == 0:
+        return None
+    flags = head >> 4
+    fixes = [(id_, seq, flags, t, lat, lon, spd, crs, sh, bat)]
+    off = BATCH_LEN
+    for _ in range(n - 1):
+        dseq, dt, dlat, dlon, spd, sh = struct.unpack_from(DELTA_FMT, pkt, off)
+        seq = (seq + dseq) & 0xFFFF
+        t += dt
+        lat += dlat * DELTA_SCALE
+        lon += dlon * DELTA_SCALE
+        fixes.append((id_, seq, flags, t, lat, lon, spd, None, sh, bat))
+        off += DELTA_LEN
+    return fixes
+
+
+def decode_batch(pkt):
+    fixes = batch_fixes(pkt)
+    if fixes is None:
+        return None
+    id_, seq, flags = fixes[-1][0], fixes[-1][1], fixes[-1][2]
+    # "seq" de la trama = último fix, el que confirma el downlink
+    return {"kind": KIND_BATCH, "flags": flags, "id": id_, "seq": seq,
+            "fixes": [_fix_dict(*f) for f in fixes]}
+
+
+def decode_uplink(pkt):
+    """Devuelve un dict con los campos del fix, o None si no se reconoce.
+
+    Acepta tramas binarias y el JSON heredado de los collares sin actualizar.
+    """
+    if not pkt:
+        return None
+    if pkt[0] == 0x7B:
+        obj = json.loads(pkt.decode("utf-8"))
+        if "gps_time" not in obj and "time" in obj:
+            obj["gps_time"] = obj["time"]
+        return obj
+    kind = pkt[0] & KIND_MASK
+    if kind == KIND_FIX and len(pkt) == FIX_LEN:
+        return decode_fix(pkt)
+    if kind == KIND_TELEM and len(pkt) == TELEM_LEN:
+        return decode_telem(pkt)
+    if kind == KIND_BATCH and len(pkt) >= BATCH_LEN:
+        return decode_batch(pkt)
+    return None
+
+
+def parse_uplink(pkt):
+    """Como decode_uplink pero sin armar un dict por fix (camino del handheld).
+
+    Devuelve (kind, id, seq, flags, cuerpo) o None si no se reconoce. Para
+    FIX y BATCH el cuerpo es la lista de tuplas de campos crudos (ver
+    fix_fields) y seq la del último fix; para TELEM y el JSON heredado
+    (kind 0) es el dict de decode_uplink.
+    """
+    if not pkt:
+        return None
+    kind = pkt[0] & KIND_MASK
+    if pkt[0] != 0x7B:
+        if kind == KIND_FIX and len(pkt) == FIX_LEN:
+            f = fix_fields(pkt)
+            return KIND_FIX, f[0], f[1], f[2], (f,)
+        if kind == KIND_BATCH and len(pkt) >= BATCH_LEN:
+            fixes = batch_fixes(pkt)
+            if fixes is None:
+                return None
+            f = fixes[-1]
+            return KIND_BATCH, f[0], f[1], f[2], fixes
+    obj = decode_uplink(pkt)
+    if obj is None:
+        return None
+    return obj.get("kind") or 0, obj.get("id"), obj.get("seq"), obj.get("flags", 0), obj
+
+
+# ------------------ Downlink ------------------
+def encode_downlink(id_, ack, cmds=(), flags=0):
+    """cmds: secuencia de tuplas (CMD_x, arg1, arg2, ...)."""
+    out = bytearray(struct.pack(DOWN_FMT, KIND_DOWN | ((flags & 0x0F) << 4), id_ & 0xFF, ack & 0xFFFF))
+    for cmd in cmds:
+        out.append(cmd[0])
+        out.extend(struct.pack(CMD_FMT[cmd[0]], *cmd[1:]))
+    return bytes(out)
+
+
+def decode_downlink(pkt):
+    """Devuelve {"id", "ack", "flags", CMD_x: (args...)} o None."""
+    if not pkt or len(pkt) < DOWN_LEN or (pkt[0] & KIND_MASK) != KIND_DOWN:
+        return None
+    head, id_, ack = struct.unpack(DOWN_FMT, pkt[:DOWN_LEN])
+    out = {"id": id_, "ack": ack, "flags": head >> 4}
+    i = DOWN_LEN
+    while i < len(pkt):
+        fmt = CMD_FMT.get(pkt[i])
+        if fmt is None:
+            break       # comando desconocido: se ignora el resto
+        size = struct.calcsize(fmt)
+        if i + 1 + size > len(pkt):
+            break
+        out[pkt[i]] = struct.unpack(fmt, pkt[i + 1:i + 1 + size])
+        i += 1 + size
+    return out
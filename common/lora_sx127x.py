@@ -0,0 +1,508 @@
+# lora_sx127x.py – Driver LoRa SX1278/SX1276 para MicroPython (RP2040 / ESP32)
+#
+# Módulo compartido: el mismo archivo se copia al collar y al handheld.
+from machine import SPI, Pin
+import time
+
+REG_FIFO                = 0x00
+REG_OP_MODE             = 0x01
+REG_FRF_MSB             = 0x06
+REG_FRF_MID             = 0x07
+REG_FRF_LSB             = 0x08
+REG_PA_CONFIG           = 0x09
+REG_OCP                 = 0x0B
+REG_LNA                 = 0x0C
+REG_FIFO_ADDR_PTR       = 0x0D
+REG_FIFO_TX_BASE_ADDR   = 0x0E
+REG_FIFO_RX_BASE_ADDR   = 0x0F
+REG_FIFO_RX_CURRENT_ADDR= 0x10
+REG_IRQ_FLAGS_MASK      = 0x11
+REG_IRQ_FLAGS           = 0x12
+REG_RX_NB_BYTES         = 0x13
+REG_PKT_SNR_VALUE       = 0x19
+REG_MODEM_STAT          = 0x18
+REG_PKT_RSSI_VALUE      = 0x1A
+REG_MODEM_CONFIG_1      = 0x1D
+REG_MODEM_CONFIG_2      = 0x1E
+REG_SYMB_TIMEOUT_LSB    = 0x1F
+REG_PREAMBLE_MSB        = 0x20
+REG_PREAMBLE_LSB        = 0x21
+REG_PAYLOAD_LENGTH      = 0x22
+REG_MODEM_CONFIG_3      = 0x26
+REG_DIO_MAPPING_1       = 0x40
+REG_VERSION             = 0x42
+REG_PA_DAC              = 0x4D
+
+MODE_LONG_RANGE_MODE    = 0x80
+MODE_SLEEP              = 0x00
+MODE_STDBY              = 0x01
+MODE_TX                 = 0x03
+MODE_RX_CONTINUOUS      = 0x05
+
+IRQ_TX_DONE_MASK        = 0x08
+IRQ_RX_DONE_MASK        = 0x40
+IRQ_VALID_HEADER        = 0x10
+IRQ_PAYLOAD_CRC_ERROR   = 0x20
+
+DIO0_RX_DONE            = 0x00
+
+PA_BOOST                = 0x80
+
+# RegModemStat: señal detectada / sincronizada / RX en curso
+MODEM_STAT_BUSY         = 0x07
+
+BW_HZ = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+class SX127x:
+    def __init__(self, spi, cs, reset, dio0,
+                 freq_mhz=433.0, bw=7, cr=1, sf=12, power=17):
+        self.spi = spi
+        self.cs = Pin(cs, Pin.OUT, value=1)
+        self.reset = None if (reset is None) else Pin(reset, Pin.OUT, value=1)
+        self.dio0 = Pin(dio0, Pin.IN)
+        self.payload_max = 255
+
+        # Buffers SPI preasignados: ninguna transacción crea objetos nuevos
+        self._cmd = bytearray(1)
+        self._tx = bytearray(2)
+        self._rx = bytearray(2)
+        self._rxhdr = bytearray(4)   # FIFO_RX_CURRENT_ADDR .. RX_NB_BYTES
+        self._pkt = bytearray(2)     # PKT_SNR_VALUE, PKT_RSSI_VALUE
+        self._rxbuf = bytearray(self.payload_max)   # recv() / rx_window()
+        self._rxbuf_mv = memoryview(self._rxbuf)
+
+        # Evita que el handler de DIO0 corte una secuencia de registros a medias
+        self._busy = 0
+        self._irq_pending = False
+
+        # Modo RX por interrupción (ver start_rx_irq)
+        self._ring = None
+        self._ring_mv = None
+        self._ring_len = None
+        self._ring_rssi = None
+        self._ring_snr = None
+        self._ring_sf = None
+        self._head = 0
+        self._tail = 0
+        self._tx_busy = False
+        self._tx_preamble = None
+        self.last_rx_ms = 0
+        self.last_rx_sf = 0
+        self.on_rx = None
+        self.rx_count = 0
+        self.rx_dropped = 0
+        self.rx_crc_errors = 0
+
+        self._reset()
+        v = self._read(REG_VERSION)
+        if v == 0x00 or v == 0xFF:
+            raise RuntimeError("SX127x not responding. Check pins / power / ant.")
+
+        self._write(REG_OP_MODE, MODE_SLEEP | MODE_LONG_RANGE_MODE)
+        time.sleep_ms(10)
+        self._write(REG_OP_MODE, MODE_STDBY | MODE_LONG_RANGE_MODE)
+
+        self.set_frequency(freq_mhz)
+        self.set_bw_cr_sf(bw=bw, cr=cr, sf=sf)
+        self.set_power(power)
+
+        self.set_preamble(8)
+        self._write(REG_FIFO_TX_BASE_ADDR, 0x00)
+        self._write(REG_FIFO_RX_BASE_ADDR, 0x00)
+
+        self._write(REG_LNA, 0x23)
+        self._write(REG_OCP, 0x20 | 0x0B)
+
+        self._write(REG_DIO_MAPPING_1, 0x40)
+        self.receive()
+
+    def set_power(self, power):
+        if power > 20: power = 20
+        if power < 2: power = 2
+        self._lock()
+        self._write(REG_PA_CONFIG, PA_BOOST | (power - 2))
+        self._write(REG_PA_DAC, 0x87 if power > 17 else 0x84)
+        self._unlock()
+        self.power = power
+
+    def set_frequency(self, mhz):
+        frf = int((mhz * 1000000.0) / 61.03515625)
+        self._lock()
+        self._tx[0] = (frf >> 16) & 0xFF
+        self._tx[1] = (frf >> 8) & 0xFF
+        self.write_burst(REG_FRF_MSB, self._tx)
+        self._write(REG_FRF_LSB, frf & 0xFF)
+        self._unlock()
+
+    def set_bw_cr_sf(self, bw=7, cr=1, sf=12):
+        bw = max(0, min(9, bw))
+        cr = max(1, min(4, cr))
+        sf = max(6, min(12, sf))
+
+        self._lock()
+        self._tx[0] = (bw << 4) | (cr << 1)
+        self._tx[1] = ((sf << 4) & 0xF0) | 0x04
+        self.write_burst(REG_MODEM_CONFIG_1, self._tx)
+        ldo = 0x08 if (sf >= 11 and bw <= 7) else 0x00
+        self._write(REG_MODEM_CONFIG_3, ldo | 0x04)
+        self._write(REG_SYMB_TIMEOUT_LSB, 0xFF)
+        self._unlock()
+        self.bw, self.cr, self.sf = bw, cr, sf
+
+    def set_preamble(self, symbols):
+        symbols = max(6, min(0xFFFF, symbols))
+        self._lock()
+        self._tx[0] = symbols >> 8
+        self._tx[1] = symbols & 0xFF
+        self.write_burst(REG_PREAMBLE_MSB, self._tx)
+        self._unlock()
+        self.preamble = symbols
+
+    def retune(self, sf=None, power=None, preamble=None):
+        """Cambia SF/potencia/preámbulo pasando por standby y vuelve a RX."""
+        self._lock()
+        self.standby()
+        if sf is not None:
+            self.set_bw_cr_sf(bw=self.bw, cr=self.cr, sf=sf)
+        if power is not None:
+            self.set_power(power)
+        if preamble is not None:
+            self.set_preamble(preamble)
+        self.receive()
+        self._unlock()
+
+    def symbol_ms(self, sf=None):
+        return (1 << (sf or self.sf)) * 1000 / BW_HZ[self.bw]
+
+    def time_on_air_ms(self, n, sf=None, preamble=None):
+        """Tiempo en aire de un paquete de n bytes (header explícito, CRC)."""
+        sf = sf or self.sf
+        if preamble is None:
+            preamble = self.preamble
+        de = 1 if (sf >= 11 and self.bw <= 7) else 0
+        num = 8 * n - 4 * sf + 28 + 16
+        den = 4 * (sf - 2 * de)
+        nsym = 8 + max(-(-num // den) * (self.cr + 4), 0)
+        return (preamble + 4.25 + nsym) * self.symbol_ms(sf)
+
+    def signal_detected(self):
+        self._lock()
+        stat = self._read(REG_MODEM_STAT)
+        self._unlock()
+        return bool(stat & MODEM_STAT_BUSY)
+
+    def read_config(self):
+        """Lee la configuración efectiva del chip (para diagnóstico)."""
+        frf = bytearray(3)
+        mc = bytearray(2)
+        self._lock()
+        self.read_burst(REG_FRF_MSB, frf)
+        self.read_burst(REG_MODEM_CONFIG_1, mc)
+        mc3 = self._read(REG_MODEM_CONFIG_3)
+        dio = self._read(REG_DIO_MAPPING_1)
+        self._unlock()
+        return {
+            "freq_mhz": ((frf[0] << 16) | (frf[1] << 8) | frf[2]) * 61.03515625 / 1e6,
+            "bw": (mc[0] >> 4) & 0x0F,
+            "cr": (mc[0] >> 1) & 0x07,
+            "sf": (mc[1] >> 4) & 0x0F,
+            "crc": bool(mc[1] & 0x04),
+            "ldo": bool(mc3 & 0x08),
+            "dio_mapping_1": dio,
+        }
+
+    def verify_spi(self, n=32):
+        """Escribe un patrón en la FIFO y lo relee por ráfaga.
+
+        Sirve para validar que el bus aguanta el reloj configurado.
+        """
+        pattern = bytearray(n)
+        for i in range(n):
+            pattern[i] = (i * 37 + 0x5A) & 0xFF
+        back = bytearray(n)
+        self._lock()
+        self.standby()
+        ok = self._read(REG_VERSION) not in (0x00, 0xFF)
+        self._write(REG_FIFO_ADDR_PTR, 0x80)
+        self.write_burst(REG_FIFO, pattern)
+        self._write(REG_FIFO_ADDR_PTR, 0x80)
+        self.read_burst(REG_FIFO, back)
+        self.receive()
+        self._unlock()
+        return ok and back == pattern
+
+    def sleep(self):
+        self._lock()
+        self._write(REG_OP_MODE, MODE_SLEEP | MODE_LONG_RANGE_MODE)
+        self._unlock()
+
+    def standby(self):
+        self._lock()
+        self._write(REG_OP_MODE, MODE_STDBY | MODE_LONG_RANGE_MODE)
+        self._unlock()
+
+    def receive(self):
+        self._lock()
+        self._write(REG_IRQ_FLAGS, 0xFF)
+        self._write(REG_FIFO_ADDR_PTR, self._read(REG_FIFO_RX_BASE_ADDR))
+        self._write(REG_OP_MODE, MODE_RX_CONTINUOUS | MODE_LONG_RANGE_MODE)
+        self._unlock()
+
+    def transmit(self, data, preamble=None):
+        """Inicia la transmisión sin esperar; ver tx_done().
+
+        `preamble` permite usar otro largo de preámbulo solo para este paquete.
+        """
+        if len(data) > self.payload_max:
+            data = memoryview(data)[:self.payload_max]
+
+        self._lock()
+        try:
+            self.standby()
+            if preamble is not None and preamble != self.preamble:
+                self._tx_preamble = self.preamble
+                self.set_preamble(preamble)
+            self._write(REG_FIFO_ADDR_PTR, self._read(REG_FIFO_TX_BASE_ADDR))
+            self.write_burst(REG_FIFO, data)
+
+            self._write(REG_PAYLOAD_LENGTH, len(data))
+            self._write(REG_IRQ_FLAGS, 0xFF)
+            self._write(REG_OP_MODE, MODE_TX | MODE_LONG_RANGE_MODE)
+            self._tx_busy = True
+        finally:
+            self._unlock()
+
+    def tx_done(self):
+        """True cuando terminó la transmisión (y el radio volvió a RX)."""
+        if not self._tx_busy:
+            return True
+        self._lock()
+        try:
+            if not (self._read(REG_IRQ_FLAGS) & IRQ_TX_DONE_MASK):
+                return False
+            self._write(REG_IRQ_FLAGS, IRQ_TX_DONE_MASK)
+            self._tx_busy = False
+            if self._tx_preamble is not None:
+                self.set_preamble(self._tx_preamble)
+                self._tx_preamble = None
+            self.receive()
+            return True
+        finally:
+            self._unlock()
+
+    def tx_abort(self):
+        self._lock()
+        self._tx_busy = False
+        if self._tx_preamble is not None:
+            self.set_preamble(self._tx_preamble)
+            self._tx_preamble = None
+        self.receive()
+        self._unlock()
+
+    def send(self, data, timeout_ms=5000, preamble=None):
+        self.transmit(data, preamble)
+        t0 = time.ticks_ms()
+        # Antes del tiempo en aire no hay nada que sondear por SPI
+        toa = int(self.time_on_air_ms(min(len(data), self.payload_max), preamble=preamble))
+        time.sleep_ms(min(toa, timeout_ms))
+        while not self.tx_done():
+            if time.ticks_diff(time.ticks_ms(), t0) > timeout_ms:
+                self.tx_abort()
+                raise RuntimeError("TX timeout")
+            time.sleep_ms(1)
+
+    def any(self):
+        return self.dio0.value() == 1
+
+    def recv(self):
+        if self._ring is not None:
+            return self.recv_nowait()
+
+        if not self.any():
+            return None, None, None
+
+        return self._read_packet()
+
+    def rx_window(self, timeout_ms):
+        """Escucha hasta timeout_ms esperando un paquete (sondeando flags).
+
+        No depende del mapeo de DIO0; lo usa el collar para recibir el
+        downlink después de cada uplink. Como recv(), el paquete es un
+        memoryview del buffer de recepción: vale hasta la próxima lectura.
+        """
+        self.receive()
+        t0 = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), t0) < timeout_ms:
+            pkt = self._read_packet()
+            if pkt[0] is not None:
+                return pkt
+            time.sleep_ms(5)
+        return None, None, None
+
+    def _read_packet(self):
+        self._lock()
+        try:
+            hdr = self.read_burst(REG_FIFO_RX_CURRENT_ADDR, self._rxhdr)
+            if not (hdr[2] & IRQ_RX_DONE_MASK):
+                return None, None, None
+            if hdr[2] & IRQ_PAYLOAD_CRC_ERROR:
+                self._write(REG_IRQ_FLAGS, IRQ_PAYLOAD_CRC_ERROR | IRQ_VALID_HEADER | IRQ_RX_DONE_MASK)
+                self.rx_crc_errors += 1
+                return None, None, None
+
+            self._write(REG_FIFO_ADDR_PTR, hdr[0])
+            data = self._rxbuf_mv[:hdr[3]]
+            self.read_burst(REG_FIFO, data)
+            self.read_burst(REG_PKT_SNR_VALUE, self._pkt)
+            self._write(REG_IRQ_FLAGS, IRQ_RX_DONE_MASK | IRQ_VALID_HEADER)
+        finally:
+            self._unlock()
+
+        self.rx_count += 1
+        return data, -164 + self._pkt[1], self._snr_db(self._pkt[0])
+
+    # ---------- RX por interrupción ----------
+    # El handler de DIO0 (RxDone) copia FIFO + RSSI/SNR a un anillo de buffers
+    # preasignados. El handler solo avanza _head y el consumidor solo _tail,
+    # así que no hace falta deshabilitar interrupciones. Con el anillo lleno
+    # se descarta el paquete nuevo y se cuenta en rx_dropped.
+    def start_rx_irq(self, slots=8):
+        self._ring = [bytearray(self.payload_max) for _ in range(slots)]
+        self._ring_mv = [memoryview(b) for b in self._ring]
+        self._ring_len = bytearray(slots)
+        self._ring_rssi = bytearray(slots)
+        self._ring_snr = bytearray(slots)
+        self._ring_sf = bytearray(slots)
+        self._ring_t = [0] * slots
+        self._head = 0
+        self._tail = 0
+        self._write(REG_DIO_MAPPING_1, DIO0_RX_DONE)
+        self.receive()
+        self.dio0.irq(trigger=Pin.IRQ_RISING, handler=self._on_dio0)
+
+    def stop_rx_irq(self):
+        self.dio0.irq(handler=None)
+        self._ring = None
+
+    def _on_dio0(self, pin):
+        if self._busy or self._ring is None:
+            # El código principal está a mitad de una secuencia SPI;
+            # _unlock() llamará de nuevo al handler al terminar.
+            self._irq_pending = self._ring is not None
+            return
+
+        # Una sola ráfaga trae dirección actual, flags y número de bytes
+        hdr = self.read_burst(REG_FIFO_RX_CURRENT_ADDR, self._rxhdr)
+        flags = hdr[2]
+        if not (flags & IRQ_RX_DONE_MASK):
+            return
+        if flags & IRQ_PAYLOAD_CRC_ERROR:
+            self._write(REG_IRQ_FLAGS, IRQ_PAYLOAD_CRC_ERROR | IRQ_VALID_HEADER | IRQ_RX_DONE_MASK)
+            self.rx_crc_errors += 1
+            return
+
+        slots = len(self._ring)
+        nxt = (self._head + 1) % slots
+        if nxt == self._tail:
+            self._write(REG_IRQ_FLAGS, IRQ_RX_DONE_MASK | IRQ_VALID_HEADER)
+            self.rx_dropped += 1
+            return
+
+        h = self._head
+        n = hdr[3]
+        self._write(REG_FIFO_ADDR_PTR, hdr[0])
+        self.read_burst(REG_FIFO, self._ring_mv[h][:n])
+        pkt = self.read_burst(REG_PKT_SNR_VALUE, self._pkt)
+        self._ring_len[h] = n
+        self._ring_snr[h] = pkt[0]
+        self._ring_rssi[h] = pkt[1]
+        self._ring_sf[h] = self.sf
+        self._ring_t[h] = time.ticks_ms()
+        self._write(REG_IRQ_FLAGS, IRQ_RX_DONE_MASK | IRQ_VALID_HEADER)
+
+        self._head = nxt
+        self.rx_count += 1
+        if self.on_rx is not None:
+            self.on_rx()
+
+    def pending(self):
+        if self._ring is None:
+            return 0
+        return (self._head - self._tail) % len(self._ring)
+
+    def recv_nowait(self):
+        if self._ring is None or self._tail == self._head:
+            return None, None, None
+        t = self._tail
+        data = bytes(self._ring_mv[t][:self._ring_len[t]])
+        rssi = -164 + self._ring_rssi[t]
+        snr = self._snr_db(self._ring_snr[t])
+        self.last_rx_ms = self._ring_t[t]
+        self.last_rx_sf = self._ring_sf[t]
+        self._tail = (t + 1) % len(self._ring)
+        return data, rssi, snr
+
+    def recv_many(self, max_n=8):
+        out = []
+        while len(out) < max_n:
+            pkt = self.recv_nowait()
+            if pkt[0] is None:
+                break
+            out.append(pkt)
+        return out
+
+    @staticmethod
+    def _snr_db(reg):
+        if reg > 127: reg -= 256
+        return reg / 4.0
+
+    def _reset(self):
+        if self.reset is None:
+            time.sleep_ms(10)
+            return
+        self.reset.value(0)
+        time.sleep_ms(10)
+        self.reset.value(1)
+        time.sleep_ms(10)
+
+    def _lock(self):
+        self._busy += 1
+
+    def _unlock(self):
+        self._busy -= 1
+        if self._busy == 0 and self._irq_pending:
+            self._irq_pending = False
+            self._on_dio0(None)
+
+    # ---------- Acceso SPI ----------
+    def read_burst(self, addr, buf):
+        """Lee len(buf) bytes a partir de addr en una sola transacción."""
+        self._cmd[0] = addr & 0x7F
+        self.cs.value(0)
+        self.spi.write(self._cmd)
+        self.spi.readinto(buf)
+        self.cs.value(1)
+        return buf
+
+    def write_burst(self, addr, mv):
+        """Escribe mv a partir de addr en una sola transacción."""
+        self._cmd[0] = addr | 0x80
+        self.cs.value(0)
+        self.spi.write(self._cmd)
+        self.spi.write(mv)
+        self.cs.value(1)
+
+    def _read(self, addr):
+        self._tx[0] = addr & 0x7F
+        self._tx[1] = 0x00
+        self.cs.value(0)
+        self.spi.write_readinto(self._tx, self._rx)
+        self.cs.value(1)
+        return self._rx[1]
+
+    def _write(self, addr, val):
+        self._tx[0] = addr | 0x80
+        self._tx[1] = val & 0xFF
+        self.cs.value(0)
+        self.spi.write(self._tx)
+        self.cs.value(1)
@@ -0,0 +1,147 @@
+# adr.py — Data rate adaptativo (ADR) del lado del handheld
+#
+# Por cada collar se guarda el SNR de los últimos uplinks. Con el mejor SNR
+# se elige el SF más bajo de `sfs` que aún deja `margin_db` sobre el SNR
+# mínimo de demodulación, y el margen sobrante se usa para bajar potencia en
+# pasos de 3 dB. El comando viaja en el downlink que sigue al uplink.
+#
+# El SX127x solo demodula un SF a la vez, así que cuando hay collars en
+# varios SF el handheld salta entre ellos (ver dwell_ms / next_sf). Cada
+# collar alarga su preámbulo lo suficiente para cubrir un ciclo completo de
+# saltos y ser detectado sin importar en qué SF estaba escuchando el handheld.
+import time
+from metrics import log, INFO
+
+# SNR mínimo de demodulación por SF (dB, hoja de datos SX127x)
+REQUIRED_SNR = {7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+BW_KHZ = 125
+HOP_DWELL_SYMBOLS = 6     # símbolos que se escucha cada SF antes de saltar
+HOP_OVERHEAD_MS = 5       # standby + reconfiguración por SPI
+SNR_HISTORY = 8
+MIN_SAMPLES = 4           # uplinks necesarios antes de bajar SF/potencia
+POWER_STEP_DB = 3
+RESYNC_EVERY = 16         # reenvía el comando ADR cada N uplinks aunque no cambie
+LINK_STALE_S = 30 * 60    # sin uplinks por este tiempo, el collar ya volvió a SF12
+
+
+def symbol_ms(sf):
+    return (1 << sf) / BW_KHZ
+
+
+def dwell_ms(sf):
+    return HOP_DWELL_SYMBOLS * symbol_ms(sf) + HOP_OVERHEAD_MS
+
+
+class Link:
+    def __init__(self, sf, power, preamble):
+        self.sf = sf
+        self.power = power
+        self.preamble = preamble
+        self.snr = []
+        self.uplinks = 0
+        self.last_rx = 0
+        self.rssi = None
+        self.last_snr = None
+        self.sent = None        # (sf, potencia, preámbulo) del último comando
+        self.since_cmd = 0
+
+
+class Adr:
+    def __init__(self, sfs=(7, 9, 12), pwr_min=2, pwr_max=17, margin_db=10.0):
+        self.sfs = sorted(sfs)
+        self.sf_max = self.sfs[-1]
+        self.pwr_min = pwr_min
+        self.pwr_max = pwr_max
+        self.margin_db = margin_db
+        self.links = {}
+        # El preámbulo se dimensiona con el ciclo de todos los SF permitidos,
+        # no solo los activos, para que no cambie cada vez que un collar
+        # entra o sale de un SF.
+        self.cycle_ms = 0
+        for sf in self.sfs:
+            self.cycle_ms += dwell_ms(sf)
+
+    def preamble_for(self, sf):
+        if len(self.sfs) == 1:
+            return 8
+        return max(8, int((self.cycle_ms - dwell_ms(sf)) / symbol_ms(sf)) + 9)
+
+    def link(self, id_):
+        ln = self.links.get(id_)
+        if ln is None:
+            ln = Link(self.sf_max, self.pwr_max, self.preamble_for(self.sf_max))
+            self.links[id_] = ln
+        return ln
+
+    def on_uplink(self, id_, rx_sf, rssi, snr, now=None):
+        """Registra un uplink; devuelve (sf, potencia, preámbulo) a enviar o None."""
+        now = time.time() if now is None else now
+        ln = self.link(id_)
+        ln.uplinks += 1
+        ln.last_rx = now
+        ln.rssi = rssi
+        ln.last_snr = snr
+
+        if rx_sf != ln.sf:
+            # El collar no aplicó el último comando o volvió a SF12 por
+            # falta de downlinks: se parte de lo que realmente usa.
+            ln.sf = rx_sf
+            ln.power = self.pwr_max
+            ln.preamble = self.preamble_for(rx_sf)
+            ln.snr = []
+            ln.sent = None
+
+        ln.snr.append(snr)
+        if len(ln.snr) > SNR_HISTORY:
+            ln.snr.pop(0)
+        if len(ln.snr) >= MIN_SAMPLES:
+            self._adapt(id_, ln)
+
+        want = (ln.sf, ln.power, ln.preamble)
+        ln.since_cmd += 1
+        if want != ln.sent or ln.since_cmd >= RESYNC_EVERY:
+            ln.sent = want
+            ln.since_cmd = 0
+            return want
+        return None
+
+    def _adapt(self, id_, ln):
+        # SNR que tendría el collar a potencia máxima
+        best = max(ln.snr) + (self.pwr_max - ln.power)
+        sf = self.sf_max
+        margin = best - REQUIRED_SNR[sf] - self.margin_db
+        for cand in self.sfs:
+            m = best - REQUIRED_SNR[cand] - self.margin_db
+            if m >= 0:
+                sf, margin = cand, m
+                break
+
+        power = self.pwr_max
+        if margin > 0:
+            power = max(self.pwr_min, self.pwr_max - int(margin / POWER_STEP_DB) * POWER_STEP_DB)
+
+        if sf != ln.sf or power != ln.power:
+            log(INFO, "[ADR] collar {}: SF{} {} dBm -> SF{} {} dBm (SNR max {:.1f} dB)",
+                id_, ln.sf, ln.power, sf, power, max(ln.snr))
+            ln.sf = sf
+            ln.power = power
+            ln.preamble = self.preamble_for(sf)
+            ln.snr = []
+
+    def active_sfs(self, now=None):
+        """SF en los que hay que escuchar: los de collars recientes + el máximo."""
+        now = time.time() if now is None else now
+        out = [self.sf_max]
+        for ln in self.links.values():
+            if ln.sf not in out and now - ln.last_rx < LINK_STALE_S:
+                out.append(ln.sf)
+        out.sort()
+        return out
+
+    def next_sf(self, current, now=None):
+        sfs = self.active_sfs(now)
+        for sf in sfs:
+            if sf > current:
+                return sf
+        return sfs[0]
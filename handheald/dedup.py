@@ -0,0 +1,142 @@
+# dedup.py — Ventana de seq por collar: descarta repetidos y mide el PDR
+#
+# Cada fix trae el seq con que lo numeró el collar, y un reenvío (ack
+# perdido, backlog en una BATCH) conserva el suyo. Por collar se guarda el
+# seq más alto visto y un bitmap de los últimos WINDOW seq (32 bytes), así
+# que un repetido se descarta antes de llegar al almacén o al dashboard.
+#
+# PDR = fixes únicos / fixes numerados desde el primero visto. Los fixes
+# atrasados que llegan por store-and-forward cuentan cuando llegan, así que
+# el PDR de entrega final sube a medida que el collar vacía su backlog.
+#
+# Un seq más viejo que la ventana (el backlog del collar guarda muchos más
+# que WINDOW fixes y los reenvía tras un ack perdido) se busca con
+# `lookup(id, seq, gps_t)`, en main.py el almacén y su índice: si ya está
+# guardado es repetido; si no, se acepta y se cuenta en `old`. Un collar que reinicia puede repetir seq ya usados (sin
+# backlog vuelve a 0): sus tramas traen FLAG_BOOT hasta el primer ack y la
+# primera que no avanza la ventana la reinicia. Los reenvíos de esa misma
+# trama ya se comparan contra la ventana nueva.
+import frames
+from metrics import log, INFO
+
+WINDOW = 256              # divide a 65536: el índice del bit es seq % WINDOW
+
+
+class SeqWindow:
+    def __init__(self):
+        self.top = None
+        self.bits = bytearray(WINDOW // 8)
+        self.expected = 0
+        self.unique = 0
+        self.dups = 0
+        self.old = 0
+        self.restarts = 0
+        self.booting = False      # ya se reinició por este arranque del collar
+
+    def _test_set(self, seq):
+        i = seq % WINDOW
+        m = 1 << (i & 7)
+        seen = self.bits[i >> 3] & m
+        self.bits[i >> 3] |= m
+        return seen
+
+    def _clear(self, seq):
+        i = seq % WINDOW
+        self.bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    def ahead(self, seq):
+        if self.top is None:
+            return True
+        d = (seq - self.top) & 0xFFFF
+        return 0 < d < 0x8000
+
+    def restart(self, seq):
+        for i in range(len(self.bits)):
+            self.bits[i] = 0
+        self.top = (seq - 1) & 0xFFFF
+        self.restarts += 1
+
+    def behind(self, seq):
+        # Más viejo que la ventana: el bitmap ya no lo recuerda
+        if self.top is None or self.ahead(seq):
+            return False
+        return (self.top - seq) & 0xFFFF >= WINDOW
+
+    def accept(self, seq):
+        """True si `seq` no se había visto (y lo marca)."""
+        if self.top is None:
+            self.top = seq
+            self.expected = 1
+            self.unique = 1
+            self._test_set(seq)
+            return True
+        d = (seq - self.top) & 0xFFFF
+        if d and d < 0x8000:
+            # Más nuevo: se liberan los bits que salen de la ventana
+            for k in range(1, min(d, WINDOW) + 1):
+                self._clear(self.top + k)
+            self.top = seq
+            self.expected += d
+            self._test_set(seq)
+            self.unique += 1
+            return True
+        if (self.top - seq) & 0xFFFF >= WINDOW:
+            self.old += 1
+            self.unique += 1
+            return True
+        if self._test_set(seq):
+            self.dups += 1
+            return False
+        self.unique += 1
+        return True
+
+    def pdr(self):
+        if not self.expected:
+            return None
+        return min(1.0, self.unique / self.expected)
+
+    def stats(self):
+        pdr = self.pdr()
+        return {
+            "top": self.top,
+            "expected": self.expected,
+            "unique": self.unique,
+            "dups": self.dups,
+            "old": self.old,
+            "restarts": self.restarts,
+            "pdr": None if pdr is None else round(pdr, 3),
+        }
+
+
+class Dedup:
+    def __init__(self, lookup=None):
+        self.windows = {}
+        self.lookup = lookup      # callable(id, seq, gps_t) -> True si ya está guardado
+
+    def window(self, id_):
+        w = self.windows.get(id_)
+        if w is None:
+            w = self.windows[id_] = SeqWindow()
+        return w
+
+    def on_frame(self, id_, newest_seq, flags):
+        """Llamar una vez por trama, antes de accept() de sus fixes."""
+        w = self.window(id_)
+        if not flags & frames.FLAG_BOOT:
+            w.booting = False
+            return
+        if not w.booting and not w.ahead(newest_seq):
+            log(INFO, "[DEDUP] Collar {} reinició (seq {} <= {})", id_, newest_seq, w.top)
+            w.restart(newest_seq)
+        w.booting = True
+
+    def accept(self, id_, seq, gps_t=0):
+        w = self.window(id_)
+        if self.lookup is not None and w.behind(seq) and self.lookup(id_, seq, gps_t):
+            w.dups += 1
+            return False
+        return w.accept(seq)
+
+    def stats(self):
+        # claves str: van a JSON
+        return {str(k): w.stats() for k, w in self.windows.items()}
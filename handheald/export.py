@@ -0,0 +1,293 @@
+# export.py — Exportación del almacén completo (/export.csv, /export.ndjson)
+#
+# A diferencia del CSV del dashboard (lo que el navegador tiene en memoria,
+# una muestra cada 5 min), esto recorre los segmentos de store.py a
+# resolución completa y manda cada página de PAGE registros apenas la
+# formatea, con Transfer-Encoding: chunked: la memoria no depende de
+# cuántos días se pidan, ni acá ni en el navegador (va directo a disco).
+#
+# Filtros: id (collar) y from/to en segundos UTC (hora GPS; con from/to los
+# registros sin hora quedan fuera, igual que en /trail). El NDJSON tiene las
+# mismas líneas que data.json; el CSV lleva además el cursor de cada
+# registro y lat/lon exactos (enteros * 1e7, sin pasar por float).
+#
+# Reanudar (Range): la respuesta es el rango de cursores [first, end) del
+# momento en que se pidió y el ETag lo lleva ("nonce-first-end"). Como el
+# almacén solo crece al final, un Range con If-Range de ese ETag vuelve a
+# dar los mismos bytes: se recorre una vez para contar (Content-Range
+# necesita el total) y otra para mandar el tramo pedido. Sin If-Range, o si
+# la retención ya borró el principio y el ETag no coincide, el Range se
+# ignora y va entero (200): los offsets ya no serían los de la descarga
+# anterior.
+#
+# Con Accept-Encoding: deflate y el módulo deflate de MicroPython (>= 1.21)
+# el cuerpo se comprime al vuelo; un Range siempre va sin comprimir.
+import asyncio
+import io
+import json
+import struct
+import frames
+import metrics
+import store
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+PAGE = 32                  # registros leídos y formateados por vez
+DEFLATE_WBITS = 10         # ventana de 1 KB: poca RAM; el CSV baja a menos de la mitad
+
+CSV = "csv"
+NDJSON = "ndjson"
+CTYPE = {CSV: "text/csv; charset=utf-8", NDJSON: "application/x-ndjson"}
+CSV_HEADER = (b"cursor,id,seq,ts,iso_time,lat,lon,alt,sats,hdop,spd_kn,crs,"
+              b"bat_v,rssi,snr,sf,timestamp_local\n")
+
+m_export = metrics.Counter("export_requests_total", "Exportaciones por tipo de respuesta", "kind")
+
+
+def _v(x):
+    return "" if x is None else x
+
+
+def _grados(v):
+    # lat/lon * 1e7 -> texto con 7 decimales exactos
+    if v == store.LATLON_NA:
+        return ""
+    a = -v if v < 0 else v
+    return "{}{}.{:07d}".format("-" if v < 0 else "", a // 10000000, a % 10000000)
+
+
+def linea_csv(buf, off, cursor):
+    d = store.unpack_record(buf, off)
+    lat, lon = struct.unpack_from("<ii", buf, off + 12)
+    ts = d["ts"]
+    return "{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(
+        cursor, d["id"], d["seq"], _v(ts),
+        frames.t2000_to_iso(ts - frames.EPOCH_2000) if ts else "",
+        _grados(lat), _grados(lon), _v(d["alt"]), d["sats"], _v(d["hdop"]),
+        _v(d["spd_kn"]), d["crs"], _v(d["bat_v"]), d["rssi"], d["snr"], d["sf"],
+        d["timestamp_local"])
+
+
+def linea_ndjson(buf, off, cursor):
+    return json.dumps(store.unpack_record(buf, off)) + "\n"
+
+
+def parse_range(value, total):
+    """Un solo rango de bytes -> (inicio, fin exclusivo); -1 si no se puede
+    cumplir, None si la cabecera no se entiende (se manda entero)."""
+    if not value.startswith("bytes=") or "," in value:
+        return None
+    a, _, b = value[6:].strip().partition("-")
+    try:
+        if not a:
+            n = int(b)                      # bytes=-N: los últimos N
+            if n <= 0:
+                return -1
+            return max(0, total - n), total
+        start = int(a)
+        stop = int(b) + 1 if b else total
+    except ValueError:
+        return None
+    if start >= total or stop <= start:
+        return -1
+    return start, min(stop, total)
+
+
+class _Contador:
+    """Destino que solo cuenta bytes (primera pasada de un Range)."""
+
+    def __init__(self):
+        self.n = 0
+
+    async def write(self, data):
+        self.n += len(data)
+
+
+class _Tramo:
+    """Pasa a `out` solo los bytes [start, stop) del cuerpo."""
+
+    def __init__(self, out, start, stop):
+        self.out = out
+        self.start = start
+        self.stop = stop
+        self.pos = 0
+        self.done = False
+
+    async def write(self, data):
+        a = self.pos
+        self.pos += len(data)
+        if self.pos >= self.stop:
+            self.done = True
+        if self.pos <= self.start or a >= self.stop:
+            return
+        i = self.start - a if self.start > a else 0
+        j = self.stop - a if self.stop < self.pos else len(data)
+        await self.out.write(memoryview(data)[i:j])
+
+
+class _Sink(io.IOBase):
+    # Donde DeflateIO deja lo comprimido hasta pasarlo a la respuesta
+    def __init__(self):
+        self.parts = []
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        return len(b)
+
+
+class _Comprimido:
+    """Comprime con deflate (formato zlib) lo que se escribe en `out`."""
+
+    def __init__(self, out):
+        self.out = out
+        self.sink = _Sink()
+        self.z = deflate.DeflateIO(self.sink, deflate.ZLIB, DEFLATE_WBITS)
+
+    async def _pasar(self):
+        parts = self.sink.parts
+        if parts:
+            self.sink.parts = []
+            await self.out.write(b"".join(parts))
+
+    async def write(self, data):
+        self.z.write(data)
+        await self._pasar()
+
+    async def close(self):
+        self.z.close()
+        await self._pasar()
+
+
+class Exporter:
+    def __init__(self, read, first_cursor, end_cursor, nonce):
+        # read(cursor, buf) -> (n, cursor_siguiente), como WriteBuffer.read;
+        # first_cursor() / end_cursor(): rango actual del almacén
+        self.read = read
+        self.first_cursor = first_cursor
+        self.end_cursor = end_cursor
+        self.nonce = nonce
+        self.buf = bytearray(PAGE * store.REC_SIZE)
+        self.busy = False
+
+    async def serve_csv(self, req, resp):
+        await self._serve(req, resp, CSV)
+
+    async def serve_ndjson(self, req, resp):
+        await self._serve(req, resp, NDJSON)
+
+    def _etag(self, first, end):
+        return '"{}-{}-{}"'.format(self.nonce, first, end)
+
+    def _fijado(self, if_range, first, end):
+        # end del ETag de If-Range si sigue siendo un prefijo de lo actual
+        try:
+            nonce, f, e = if_range.strip().strip('"').split("-")
+            f, e = int(f), int(e)
+        except ValueError:
+            return None
+        if nonce != self.nonce or f != first or e > end:
+            return None
+        return e
+
+    async def _recorrer(self, out, fmt, id_, f_from, f_to, first, end):
+        # out: algo con `async write(bytes)`; si tiene `done` se corta ahí
+        fila = linea_csv if fmt == CSV else linea_ndjson
+        buf = self.buf
+        if fmt == CSV:
+            await out.write(CSV_HEADER)
+        cursor = first
+        while cursor < end and not getattr(out, "done", False):
+            n, nxt = self.read(cursor, buf)
+            if not n:
+                break
+            base = nxt - n
+            lines = []
+            for k in range(min(n, end - base)):
+                off = k * store.REC_SIZE
+                if id_ is not None and buf[off + 8] != id_:
+                    continue
+                if f_from or f_to is not None:
+                    gps_t = store.gps_t_of(buf, off)
+                    if not gps_t or gps_t < f_from or (f_to is not None and gps_t > f_to):
+                        continue
+                lines.append(fila(buf, off, base + k))
+            if lines:
+                await out.write("".join(lines).encode())
+            if nxt <= cursor:
+                break
+            cursor = nxt
+            await asyncio.sleep_ms(0)          # que el radio no espere al recorrido
+
+    async def _serve(self, req, resp, fmt):
+        q = req.query
+        try:
+            id_ = int(q["id"]) if q.get("id") else None
+            t_from = int(q["from"]) if q.get("from") else None
+            t_to = int(q["to"]) if q.get("to") else None
+        except ValueError:
+            await resp.send(400, "text/plain", "Parametros: id, from, to")
+            return
+        # Un solo recorrido a la vez: comparten el buffer de página
+        if self.busy:
+            await resp.send(503, "text/plain", "Exportacion en curso", {"Retry-After": 5})
+            return
+        self.busy = True
+        try:
+            f_from = max(0, t_from - frames.EPOCH_2000) if t_from is not None else 0
+            f_to = max(0, t_to - frames.EPOCH_2000) if t_to is not None else None
+            first, end = self.first_cursor(), self.end_cursor()
+            rng = req.header("range")
+            if_range = req.header("if-range")
+            if rng:
+                fijo = self._fijado(if_range, first, end) if if_range is not None else None
+                if fijo is None:
+                    rng = None              # sin versión fija: va entera
+                else:
+                    end = fijo
+            headers = {
+                "ETag": self._etag(first, end),
+                "Accept-Ranges": "bytes",
+                "Cache-Control": "no-store",
+                "Content-Disposition": 'attachment; filename="export.{}"'.format(fmt),
+                "X-Cursor": end,
+            }
+            scan = (fmt, id_, f_from, f_to, first, end)
+
+            if rng:
+                cnt = _Contador()
+                await self._recorrer(cnt, *scan)
+                r = parse_range(rng, cnt.n)
+                if r == -1:
+                    headers["Content-Range"] = "bytes */{}".format(cnt.n)
+                    await resp.send(416, "text/plain", "Rango fuera del archivo", headers)
+                    m_export.inc("range")
+                    return
+                if r is not None:
+                    start, stop = r
+                    headers["Content-Range"] = "bytes {}-{}/{}".format(start, stop - 1, cnt.n)
+                    await resp.start(206, CTYPE[fmt], stop - start, headers)
+                    if not resp.head_only:
+                        await self._recorrer(_Tramo(resp, start, stop), *scan)
+                    m_export.inc("range")
+                    return
+
+            gz = deflate is not None and "deflate" in req.header("accept-encoding", "")
+            if gz:
+                headers["Content-Encoding"] = "deflate"
+                headers["ETag"] = headers["ETag"][:-1] + '-z"'
+            headers["Vary"] = "Accept-Encoding"
+            await resp.start(200, CTYPE[fmt], None, headers, chunked=True)
+            if resp.head_only:
+                return
+            if gz:
+                out = _Comprimido(resp)
+                await self._recorrer(out, *scan)
+                await out.close()
+            else:
+                await self._recorrer(resp, *scan)
+            m_export.inc("deflate" if gz else "full")
+        finally:
+            self.busy = False
@@ -0,0 +1,176 @@
+# geofence.py — Geocerca del rancho evaluada en el handheld
+#
+# El polígono se proyecta una sola vez a metros (equirectangular alrededor
+# de su centro: a la escala de un rancho el error es despreciable) y se
+# precalculan sus aristas y una grilla de GRID x GRID celdas sobre el
+# rectángulo que lo contiene, ampliado en `edge_m`:
+#
+#   - una celda lejos de todas las aristas (más de edge_m + media diagonal
+#     desde su centro) tiene un solo estado, adentro u afuera, que se
+#     guarda directamente;
+#   - una celda mixta guarda las aristas cercanas y si su centro está
+#     adentro. Un punto de la celda está adentro si el segmento punto-centro
+#     cruza un número par de esas aristas (todas las que cruzan la celda
+#     están en la lista), y está en el borde si alguna queda a <= edge_m.
+#
+# Así cada fix cuesta O(1): fuera del rectángulo es "out" sin más, y
+# adentro se miran solo las pocas aristas de su celda.
+#
+# Estados: "ok" (adentro), "edge" (adentro a menos de edge_m del borde) y
+# "out", los mismos que muestra el dashboard.
+import math
+
+OK = "ok"
+EDGE = "edge"
+OUT = "out"
+
+GRID = 16
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON = 111320.0
+
+
+def ordenar_circular(coords):
+    """Mismo orden que sortPolygonCircular de www/app.js."""
+    n = len(coords)
+    clat = sum(c[0] for c in coords) / n
+    clon = sum(c[1] for c in coords) / n
+    return sorted(coords, key=lambda c: math.atan2(c[0] - clat, c[1] - clon))
+
+
+def _cruza(ax, ay, bx, by, cx, cy, dx, dy):
+    # ¿El segmento AB cruza el CD? (orientaciones estrictas)
+    d1 = (dx - cx) * (ay - cy) - (dy - cy) * (ax - cx)
+    d2 = (dx - cx) * (by - cy) - (dy - cy) * (bx - cx)
+    d3 = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    d4 = (bx - ax) * (dy - ay) - (by - ay) * (dx - ax)
+    return (d1 > 0) != (d2 > 0) and (d3 > 0) != (d4 > 0)
+
+
+class Fence:
+    def __init__(self, coords, edge_m=25, grid=GRID):
+        coords = ordenar_circular(coords)
+        n = len(coords)
+        self.lat0 = sum(c[0] for c in coords) / n
+        self.lon0 = sum(c[1] for c in coords) / n
+        self.kx = M_PER_DEG_LON * math.cos(math.radians(self.lat0))
+        self.ky = M_PER_DEG_LAT
+        self.edge_m = edge_m
+        self.edge2 = edge_m * edge_m
+        pts = [self._xy(c[0], c[1]) for c in coords]
+
+        # Aristas: origen, vector y 1/|v|^2
+        self.edges = []
+        for i in range(n):
+            ax, ay = pts[i]
+            bx, by = pts[(i + 1) % n]
+            vx, vy = bx - ax, by - ay
+            l2 = vx * vx + vy * vy
+            self.edges.append((ax, ay, vx, vy, 1.0 / l2 if l2 else 0.0))
+
+        self.x0 = min(p[0] for p in pts) - edge_m
+        self.y0 = min(p[1] for p in pts) - edge_m
+        self.x1 = max(p[0] for p in pts) + edge_m
+        self.y1 = max(p[1] for p in pts) + edge_m
+        self.grid = grid
+        self.cw = (self.x1 - self.x0) / grid
+        self.ch = (self.y1 - self.y0) / grid
+        self.cells = [self._build_cell(i, j) for j in range(grid) for i in range(grid)]
+
+    def _xy(self, lat, lon):
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky
+
+    def _dist2(self, k, x, y):
+        # Distancia al cuadrado del punto a la arista k
+        ax, ay, vx, vy, inv = self.edges[k]
+        t = ((x - ax) * vx + (y - ay) * vy) * inv
+        t = 0.0 if t < 0 else 1.0 if t > 1 else t
+        dx, dy = x - ax - t * vx, y - ay - t * vy
+        return dx * dx + dy * dy
+
+    # ------------------ Precálculo ------------------
+    def _inside_all(self, x, y):
+        # Ray casting contra todas las aristas (solo al armar la grilla)
+        inside = False
+        for ax, ay, vx, vy, _ in self.edges:
+            bx, by = ax + vx, ay + vy
+            if (ay > y) != (by > y) and x < vx * (y - ay) / (by - ay) + ax:
+                inside = not inside
+        return inside
+
+    def _build_cell(self, i, j):
+        cx = self.x0 + (i + 0.5) * self.cw
+        cy = self.y0 + (j + 0.5) * self.ch
+        # Toda arista que cruce la celda o quede a <= edge_m de alguno de sus
+        # puntos está a <= edge_m + media diagonal del centro
+        reach = self.edge_m + math.sqrt(self.cw * self.cw + self.ch * self.ch) / 2
+        near = [k for k in range(len(self.edges)) if self._dist2(k, cx, cy) <= reach * reach]
+        inside = self._inside_all(cx, cy)
+        if not near:
+            return OK if inside else OUT
+        return (inside, cx, cy, tuple(near))
+
+    # ------------------ Evaluación ------------------
+    def status(self, lat, lon):
+        x, y = self._xy(lat, lon)
+        if not (self.x0 <= x < self.x1 and self.y0 <= y < self.y1):
+            return OUT
+        cell = self.cells[int((y - self.y0) / self.ch) * self.grid + int((x - self.x0) / self.cw)]
+        if isinstance(cell, str):
+            return cell
+        inside, cx, cy, near = cell
+        edge = False
+        for k in near:
+            ax, ay, vx, vy, _ = self.edges[k]
+            if _cruza(x, y, cx, cy, ax, ay, ax + vx, ay + vy):
+                inside = not inside
+            if not edge:
+                edge = self._dist2(k, x, y) <= self.edge2
+        if not inside:
+            return OUT
+        return EDGE if edge else OK
+
+
+class Tracker:
+    """Estado por animal y últimas transiciones (para /alerts)."""
+
+    def __init__(self, fence, max_events=64):
+        self.fence = fence
+        self.max_events = max_events
+        self.state = {}           # id -> [estado, ts del último fix evaluado]
+        self.events = []
+        self.next_n = 0           # número del próximo evento (cursor de /alerts)
+
+    def update(self, id_, lat, lon, ts=None):
+        """Evalúa un fix; devuelve el evento si cambió de estado, si no None."""
+        if lat is None or lon is None:
+            return None
+        st = self.state.get(id_)
+        # Un atrasado del backlog no pisa el estado de un fix más nuevo
+        if st is not None and ts is not None and st[1] is not None and ts < st[1]:
+            return None
+        status = self.fence.status(lat, lon)
+        if st is None:
+            self.state[id_] = [status, ts]
+            if status == OK:
+                return None
+            prev = None
+        else:
+            prev = st[0]
+            st[1] = ts
+            if status == prev:
+                return None
+            st[0] = status
+        ev = {"n": self.next_n, "id": id_, "from": prev, "to": status,
+              "lat": lat, "lon": lon, "ts": ts}
+        self.next_n += 1
+        self.events.append(ev)
+        if len(self.events) > self.max_events:
+            self.events.pop(0)
+        return ev
+
+    def since(self, n):
+        return [ev for ev in self.events if ev["n"] >= n]
+
+    def states(self):
+        # claves str: van a JSON
+        return {str(k): v[0] for k, v in self.state.items()}
@@ -0,0 +1,347 @@
+# httpd.py — Servidor HTTP/1.1 asíncrono (asyncio) para el handheld
+#
+# Atiende varios clientes a la vez con keep-alive. Cada conexión tiene su
+# propia corrutina y su propio buffer de envío; cada escritura espera a
+# drain() para respetar la velocidad del cliente sin bloquear al radio.
+#
+# Los archivos estáticos se sirven según el manifest.json que genera
+# tools/build_www.py: versión .gz si el navegador acepta gzip, ETag fuerte
+# (304 con If-None-Match) y Cache-Control por archivo.
+#
+# Una respuesta de largo desconocido (exportaciones) puede ir con
+# Transfer-Encoding: chunked a un cliente HTTP/1.1 y la conexión sigue
+# abierta; sin chunked se delimita cerrando la conexión.
+import asyncio
+import json
+import os
+import time
+import metrics
+from metrics import log, ERROR, INFO, DEBUG
+
+MIME = {
+    "html": "text/html",
+    "css": "text/css",
+    "js": "application/javascript",
+    "json": "application/json",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "txt": "text/plain",
+}
+
+STATUS = {
+    200: "OK",
+    204: "No Content",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "NOT FOUND",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    416: "Range Not Satisfiable",
+    431: "Request Header Fields Too Large",
+    503: "Service Unavailable",
+}
+
+MAX_LINE = 1024          # tamaño máximo de la línea de petición / cabecera
+MAX_HEADERS = 32
+MAX_BODY = 2048
+IDLE_TIMEOUT_S = 10      # espera máxima entre peticiones en keep-alive
+MAX_REQUESTS = 100       # peticiones por conexión antes de cerrarla
+SEND_CHUNK = 4096        # buffer de envío por conexión (se reutilizan)
+
+# Por ruta registrada; los estáticos y los 404 van juntos en "static". La
+# duración va del fin de la petición al último byte de la respuesta (/events
+# queda abierto: cae en +Inf).
+LATENCY_BUCKETS_MS = (2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+m_latency = metrics.Histogram("http_request_ms", "Duración de las peticiones HTTP", LATENCY_BUCKETS_MS, "route")
+m_bytes = metrics.Counter("http_response_bytes_total", "Bytes de cuerpo enviados", "route")
+m_status = metrics.Counter("http_responses_total", "Respuestas HTTP por código", "code")
+
+
+def mime_for(path):
+    dot = path.rfind(".")
+    if dot < 0:
+        return "text/html"
+    return MIME.get(path[dot + 1:].lower(), "application/octet-stream")
+
+
+def parse_query(query):
+    params = {}
+    for part in query.split("&"):
+        if not part:
+            continue
+        if "=" in part:
+            k, v = part.split("=", 1)
+        else:
+            k, v = part, ""
+        params[k] = v
+    return params
+
+
+class Request:
+    def __init__(self, method, target, version):
+        self.method = method
+        self.version = version
+        query = ""
+        if "?" in target:
+            target, query = target.split("?", 1)
+        self.path = target
+        self.query = parse_query(query)
+        self.headers = {}
+        self.body = b""
+
+    def header(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def wants_keep_alive(self):
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return conn == "keep-alive"
+        return conn != "close"
+
+
+class Response:
+    def __init__(self, writer, buf, keep_alive):
+        self.writer = writer
+        self.buf = buf
+        self.keep_alive = keep_alive
+        self.head_only = False
+        self.http11 = False       # el cliente entiende chunked
+        self.chunked = False
+        self.status = 0
+        self.sent = 0
+
+    async def start(self, status=200, ctype="text/html", length=None, headers=None, chunked=False):
+        # Sin Content-Length ni chunked no hay forma de delimitar la
+        # respuesta: se cierra (204 y 304 nunca llevan cuerpo)
+        no_body = status in (204, 304)
+        self.chunked = chunked and length is None and self.http11 and not no_body
+        if length is None and not no_body and not self.chunked:
+            self.keep_alive = False
+        self.status = status
+        head = "HTTP/1.1 {} {}\r\nContent-Type: {}\r\n".format(
+            status, STATUS.get(status, "OK"), ctype)
+        if length is not None and not no_body:
+            head += "Content-Length: {}\r\n".format(length)
+        elif self.chunked:
+            head += "Transfer-Encoding: chunked\r\n"
+        if headers:
+            for k in headers:
+                head += "{}: {}\r\n".format(k, headers[k])
+        head += "Connection: {}\r\n\r\n".format("keep-alive" if self.keep_alive else "close")
+        self.writer.write(head.encode())
+        await self.writer.drain()
+
+    async def write(self, data):
+        if not data or self.head_only:
+            return
+        if self.chunked:
+            self.writer.write("{:x}\r\n".format(len(data)).encode())
+            self.writer.write(data)
+            self.writer.write(b"\r\n")
+        else:
+            self.writer.write(data)
+        self.sent += len(data)
+        await self.writer.drain()
+
+    async def finish(self):
+        # Último trozo (vacío) de una respuesta chunked
+        if self.chunked and not self.head_only:
+            self.writer.write(b"0\r\n\r\n")
+            await self.writer.drain()
+        self.chunked = False
+
+    async def send(self, status, ctype, body, headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        await self.start(status, ctype, len(body), headers)
+        await self.write(body)
+
+    async def send_stream(self, f, length):
+        # Copia `length` bytes de `f` usando el buffer de la conexión
+        buf = self.buf
+        mv = memoryview(buf)
+        remaining = length
+        while remaining > 0:
+            n = f.readinto(buf) if remaining >= len(buf) else f.readinto(mv[:remaining])
+            if not n:
+                break
+            await self.write(mv[:n])
+            remaining -= n
+
+    async def send_file(self, path, ctype=None, headers=None):
+        try:
+            size = os.stat(path)[6]
+            f = open(path, "rb")
+        except OSError:
+            return False
+        try:
+            await self.start(200, ctype or mime_for(path), size, headers)
+            await self.send_stream(f, size)
+        finally:
+            f.close()
+        return True
+
+
+class Server:
+    def __init__(self, port=80, root="/www", max_clients=4):
+        self.port = port
+        self.root = root
+        self.max_clients = max_clients
+        self.clients = 0
+        self.routes = {}
+        self.manifest = {}
+        self._bufs = [bytearray(SEND_CHUNK) for _ in range(max_clients)]
+
+    def route(self, path, handler):
+        self.routes[path] = handler
+
+    def load_manifest(self):
+        try:
+            with open(self.root + "/manifest.json") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            log(INFO, "[WEB] Sin manifest.json: estáticos sin gzip ni caché")
+            self.manifest = {}
+
+    async def start(self):
+        log(INFO, "\n[WEB] Iniciando servidor web...")
+        self.load_manifest()
+        srv = await asyncio.start_server(self._client, "0.0.0.0", self.port, backlog=self.max_clients)
+        log(INFO, "[WEB] Servidor iniciado en puerto {}", self.port)
+        return srv
+
+    async def _client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        self.clients += 1
+        buf = self._bufs.pop() if self._bufs else None
+        try:
+            if buf is None:
+                buf = bytearray(64)
+                resp = Response(writer, buf, False)
+                await resp.send(503, "text/plain", "Ocupado")
+                m_status.inc(503)
+                return
+            log(DEBUG, "[HTTP] Cliente conectado: {}", addr)
+            served = 0
+            while served < MAX_REQUESTS:
+                try:
+                    req = await asyncio.wait_for(self._read_request(reader), IDLE_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    break
+                if req is None:
+                    break
+                if isinstance(req, int):
+                    resp = Response(writer, buf, False)
+                    await resp.send(req, "text/plain", STATUS.get(req, "Error"))
+                    m_status.inc(req)
+                    break
+                served += 1
+                keep = req.wants_keep_alive() and served < MAX_REQUESTS
+                resp = Response(writer, buf, keep)
+                resp.head_only = req.method == "HEAD"
+                resp.http11 = req.version == "HTTP/1.1"
+                t0 = time.ticks_us()
+                await self._dispatch(req, resp)
+                await resp.finish()
+                route = req.path if req.path in self.routes else "static"
+                m_latency.observe(time.ticks_diff(time.ticks_us(), t0) / 1000, route)
+                m_bytes.inc(route, resp.sent)
+                m_status.inc(resp.status)
+                if not resp.keep_alive:
+                    break
+        except OSError as e:
+            log(ERROR, "[HTTP] Error con cliente {}: {}", addr, e)
+        finally:
+            self.clients -= 1
+            if len(buf) == SEND_CHUNK:
+                self._bufs.append(buf)
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _read_request(self, reader):
+        # Devuelve Request, None (conexión cerrada) o un código de error HTTP
+        line = await reader.readline()
+        while line == b"\r\n":
+            line = await reader.readline()
+        if not line:
+            return None
+        if len(line) > MAX_LINE:
+            return 431
+        try:
+            method, target, version = line.decode().strip().split(" ", 2)
+        except ValueError:
+            return 400
+        req = Request(method, target, version)
+
+        for _ in range(MAX_HEADERS + 1):
+            line = await reader.readline()
+            if not line:
+                return None
+            if line == b"\r\n" or line == b"\n":
+                break
+            if len(line) > MAX_LINE:
+                return 431
+            try:
+                s = line.decode()
+            except ValueError:          # UnicodeError: byte que no es UTF-8
+                return 400
+            i = s.find(":")
+            if i > 0:
+                req.headers[s[:i].strip().lower()] = s[i + 1:].strip()
+        else:
+            return 431
+
+        try:
+            n = int(req.headers.get("content-length", "0") or 0)
+        except ValueError:
+            return 400
+        if n > MAX_BODY:
+            return 413
+        if n > 0:
+            try:
+                req.body = await reader.readexactly(n)
+            except EOFError:            # cuerpo cortado: el cliente cerró
+                return None
+        return req
+
+    async def _dispatch(self, req, resp):
+        log(DEBUG, "[HTTP] {} {}", req.method, req.path)
+        handler = self.routes.get(req.path)
+        if handler is not None:
+            await handler(req, resp)
+            return
+        if req.method not in ("GET", "HEAD"):
+            await resp.send(405, "text/plain", "Metodo no permitido")
+            return
+        path = req.path
+        if path == "/" or path == "":
+            path = "/index.html"
+        if ".." not in path:
+            entry = self.manifest.get(path)
+            if entry is not None:
+                if await self._send_asset(req, resp, path, entry):
+                    return
+            elif await resp.send_file(self.root + path):
+                return
+        log(DEBUG, "[WEB] Archivo NO encontrado: {}", req.path)
+        await resp.send(404, "text/plain", "404 No encontrado")
+
+    async def _send_asset(self, req, resp, path, entry):
+        gz = "gz" in entry and "gzip" in req.header("accept-encoding", "")
+        # Cada codificación es una representación distinta: ETag distinto
+        etag = '"{}{}"'.format(entry["etag"], "-gz" if gz else "")
+        headers = {"ETag": etag, "Cache-Control": entry.get("cache", "no-cache")}
+        if "gz" in entry:
+            headers["Vary"] = "Accept-Encoding"
+        if etag in req.header("if-none-match", ""):
+            await resp.send(304, mime_for(path), b"", headers)
+            return True
+        if gz:
+            headers["Content-Encoding"] = "gzip"
+            return await resp.send_file(self.root + path + ".gz", mime_for(path), headers)
+        return await resp.send_file(self.root + path, None, headers)
@@ -0,0 +1,472 @@
+# logindex.py — Índice del almacén por hora y por collar (/query)
+#
+# store.py guarda los registros en orden de llegada. Para contestar "dónde
+# estuvo el collar 7 entre las 02:00 y las 04:00" sin leer todo el log:
+#
+#   - Hora de cada registro: la GPS si la tiene; si no, timestamp_local
+#     (time.time() desde el arranque) más el desfase de ese arranque. El
+#     desfase se aprende de los fixes con hora GPS (Epochs) y se guarda en
+#     epochs.bin por rango de cursores, así que los registros de arranques
+#     anteriores siguen teniendo hora.
+#   - Índice ralo por segmento: cada BLOCK registros, la hora mínima y
+#     máxima del bloque. Un bloque que no se cruza con [from, to] no se lee.
+#     Los fixes atrasados del backlog llegan fuera de orden: solo agrandan
+#     el rango de su bloque.
+#   - Cadenas por collar: por segmento, los índices de los registros de
+#     cada collar en orden de llegada. Con id se leen solo esos registros.
+#
+# Así el costo de una consulta depende de cuántos registros caen en el
+# rango (y del collar pedido), no del tamaño del log.
+#
+# El segmento activo se indexa en RAM a medida que se escriben registros.
+# Al cerrarse, su índice va a seg_NNNNNNNN.idx junto al .bin y en RAM queda
+# solo la tabla de bloques y el directorio de collares: la cadena de un
+# collar se lee del .idx al consultar. Un .idx que falta o no cuadra se
+# rehace leyendo el segmento. Los arrays se escriben tal cual (little
+# endian, como el RP2040 y el ESP32).
+#
+# .idx: cabecera "<4sBBHHH" (magic "RIDX", versión, BLOCK, registros,
+# bloques, collares); bloques "<II" (t_min, t_max); directorio "<BxHI" (id,
+# cantidad, offset) y las cadenas (uint16 por registro).
+import asyncio
+import os
+import struct
+from array import array
+import store
+from metrics import log, INFO
+
+BLOCK = 16                 # registros por entrada del índice ralo
+T_NONE = 0                 # registro sin hora (ni GPS ni desfase conocido)
+T_MAX = 0xFFFFFFFF
+
+IDX_MAGIC = b"RIDX"
+IDX_VERSION = 1
+IDX_HDR = "<4sBBHHH"
+IDX_HDR_SIZE = 12
+IDX_DIR = "<BxHI"
+IDX_DIR_SIZE = 8
+
+EPOCH_FMT = "<Ii"
+EPOCH_SIZE = 8
+EPOCH_NA = -0x80000000
+EPOCH_SAVE_S = 2           # mejora mínima del desfase para reescribir epochs.bin
+
+
+def _array(tc, n):
+    # array de n elementos (valores cualquiera) para llenar con readinto;
+    # array(tc, bytes) no sirve igual en CPython y MicroPython
+    return array(tc, range(n)) if n else array(tc)
+
+
+class Epochs:
+    """Desfase hora local -> segundos desde 2000, por arranque.
+
+    Cada entrada es [primer cursor del arranque, desfase o None]. El
+    desfase se estima como el máximo de gps_t - t_local: un fix nunca llega
+    antes de tomarse, así que la estimación se acerca por abajo y los fixes
+    frescos la dejan a uno o dos segundos.
+    """
+
+    def __init__(self, path, cursor):
+        self.path = path
+        self.entries = []
+        self._saved = {}          # cursor -> desfase guardado
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            for off in range(0, len(data) - EPOCH_SIZE + 1, EPOCH_SIZE):
+                c, d = struct.unpack_from(EPOCH_FMT, data, off)
+                self.entries.append([c, None if d == EPOCH_NA else d])
+                self._saved[c] = d
+        except OSError:
+            pass
+        # Este arranque; uno anterior sin registros queda reemplazado
+        while self.entries and self.entries[-1][0] >= cursor:
+            self.entries.pop()
+        self.entries.append([cursor, None])
+        self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            for c, d in self.entries:
+                f.write(struct.pack(EPOCH_FMT, c, EPOCH_NA if d is None else d))
+        os.rename(tmp, self.path)        # reemplaza el anterior de una vez
+        self._saved = {c: d for c, d in self.entries}
+
+    def _entry(self, cursor):
+        e = self.entries
+        for i in range(len(e) - 1, -1, -1):
+            if e[i][0] <= cursor:
+                return e[i]
+        return e[0]
+
+    def observe(self, cursor, gps_t, t_local):
+        ent = self._entry(cursor)
+        est = gps_t - t_local
+        if ent[1] is not None and est <= ent[1]:
+            return
+        ent[1] = est
+        old = self._saved.get(ent[0])
+        if old is None or old == EPOCH_NA or est - old >= EPOCH_SAVE_S:
+            self._save()
+            log(INFO, "[INDEX] Desfase del arranque en {}: {} s", ent[0], est)
+
+    def to_t2000(self, cursor, t_local):
+        d = self._entry(cursor)[1]
+        return T_NONE if d is None else t_local + d
+
+    def prune(self, first_cursor):
+        # Arranques cuyos registros ya borró la retención
+        n = 0
+        while len(self.entries) - n > 1 and self.entries[n + 1][0] <= first_cursor:
+            n += 1
+        if n:
+            del self.entries[:n]
+            self._save()
+
+
+class SegIndex:
+    def __init__(self, seq):
+        self.seq = seq
+        self.count = 0
+        self.tmin = array("I")
+        self.tmax = array("I")
+        self.chains = {}          # activo: id -> array("H")
+        self.dir = None           # cerrado: id -> (cantidad, offset en .idx)
+
+    def bounds(self):
+        lo, hi = T_MAX, 0
+        for i in range(len(self.tmin)):
+            if self.tmin[i] < lo:
+                lo = self.tmin[i]
+            if self.tmax[i] > hi:
+                hi = self.tmax[i]
+        return lo, hi
+
+    def add(self, id_, t):
+        i = self.count
+        b = i // BLOCK
+        if b == len(self.tmin):
+            self.tmin.append(T_MAX)
+            self.tmax.append(0)
+        if t == T_NONE:
+            # Sin hora: el bloque entra en cualquier consulta y se mira registro por registro
+            self.tmin[b] = 0
+            self.tmax[b] = T_MAX
+        else:
+            if t < self.tmin[b]:
+                self.tmin[b] = t
+            if t > self.tmax[b]:
+                self.tmax[b] = t
+        ch = self.chains.get(id_)
+        if ch is None:
+            ch = self.chains[id_] = array("H")
+        ch.append(i)
+        self.count += 1
+
+
+class LogIndex:
+    def __init__(self, rs, epochs):
+        self.store = rs
+        self.epochs = epochs
+        self.segs = []            # SegIndex, en el orden de rs.segments
+        self.rebuilt = 0          # .idx rehechos al arrancar
+        self.queries = 0
+        self.busy = False         # una consulta a la vez: comparten el buffer de página
+        self.read_records = 0     # registros leídos por las consultas
+        self._found = array("I", range(BLOCK))
+        self._page = bytearray(BLOCK * store.REC_SIZE)
+        self._rec = bytearray(store.REC_SIZE)
+        epochs.prune(rs.first_cursor())
+        self._attach()
+        rs.index = self
+
+    # ------------------ Rutas ------------------
+    def _path(self, seq, tmp=False):
+        return "{}/{}{:08d}{}".format(self.store.root, store.SEG_PREFIX, seq, ".itmp" if tmp else ".idx")
+
+    # ------------------ Arranque ------------------
+    def _attach(self):
+        rs = self.store
+        keep = set()
+        for seg in rs.segments:
+            active = seg is rs.segments[-1]
+            sx = None if active else self._load(seg)
+            if sx is None:
+                sx = self._rebuild(seg)
+                if not active:
+                    self._close(sx)
+                    self.rebuilt += 1
+            self.segs.append(sx)
+            keep.add(seg.seq)
+        # .idx de segmentos que ya no están
+        for name in os.listdir(rs.root):
+            if name.startswith(store.SEG_PREFIX) and (name.endswith(".idx") or name.endswith(".itmp")):
+                try:
+                    seq = int(name[len(store.SEG_PREFIX):name.rfind(".")])
+                except ValueError:
+                    continue
+                if seq not in keep or name.endswith(".itmp"):
+                    os.remove(rs.root + "/" + name)
+        log(INFO, "[INDEX] {} segmentos indexados{}", len(self.segs),
+            ", {} rehechos".format(self.rebuilt) if self.rebuilt else "")
+
+    def _rebuild(self, seg):
+        sx = SegIndex(seg.seq)
+        base = seg.seq * self.store.seg_records
+        buf = self._page
+        done = 0
+        while done < seg.count:
+            k = self.store.read_at(seg.seq, done, buf)
+            if not k:
+                break
+            for j in range(k):
+                self._index_one(sx, base + done + j, buf, j * store.REC_SIZE)
+            done += k
+        return sx
+
+    def _load(self, seg):
+        try:
+            with open(self._path(seg.seq), "rb") as f:
+                hdr = f.read(IDX_HDR_SIZE)
+                magic, ver, block, count, nb, nid = struct.unpack(IDX_HDR, hdr)
+                if magic != IDX_MAGIC or ver != IDX_VERSION or block != BLOCK or count != seg.count:
+                    return None
+                sx = SegIndex(seg.seq)
+                sx.count = count
+                sx.tmin = _array("I", nb)
+                sx.tmax = _array("I", nb)
+                pairs = _array("I", 2 * nb)
+                f.readinto(pairs)
+                for b in range(nb):
+                    sx.tmin[b] = pairs[2 * b]
+                    sx.tmax[b] = pairs[2 * b + 1]
+                d = f.read(nid * IDX_DIR_SIZE)
+                sx.dir = {}
+                for i in range(nid):
+                    id_, n, off = struct.unpack_from(IDX_DIR, d, i * IDX_DIR_SIZE)
+                    sx.dir[id_] = (n, off)
+                sx.chains = None
+                return sx
+        except (OSError, ValueError):
+            return None
+
+    # ------------------ Escritura (llamado desde store) ------------------
+    def _index_one(self, sx, cursor, buf, off):
+        t_local = struct.unpack_from("<I", buf, off)[0]
+        gps_t = store.gps_t_of(buf, off)
+        if gps_t:
+            self.epochs.observe(cursor, gps_t, t_local)
+            t = gps_t
+        else:
+            t = self.epochs.to_t2000(cursor, t_local)
+        sx.add(buf[off + 8], t)
+
+    def added(self, seq, first_idx, buf, start, k):
+        """store.append_packed escribió k registros de buf desde `start`."""
+        sx = self.segs[-1] if self.segs else None
+        if sx is None or sx.seq != seq:
+            sx = SegIndex(seq)
+            self.segs.append(sx)
+        base = seq * self.store.seg_records + first_idx
+        for j in range(k):
+            self._index_one(sx, base + j, buf, (start + j) * store.REC_SIZE)
+
+    def closed(self, seq):
+        """El segmento `seq` se llenó: su índice pasa a disco."""
+        if self.segs and self.segs[-1].seq == seq:
+            self._close(self.segs[-1])
+
+    def dropped(self, seq):
+        """La retención borró el segmento `seq`."""
+        for i, sx in enumerate(self.segs):
+            if sx.seq == seq:
+                self.segs.pop(i)
+                break
+        try:
+            os.remove(self._path(seq))
+        except OSError:
+            pass
+        self.epochs.prune(self.store.first_cursor())
+
+    def _close(self, sx):
+        ids = sorted(sx.chains)
+        nb = len(sx.tmin)
+        off = IDX_HDR_SIZE + nb * 8 + len(ids) * IDX_DIR_SIZE
+        d = {}
+        tmp = self._path(sx.seq, True)
+        with open(tmp, "wb") as f:
+            f.write(struct.pack(IDX_HDR, IDX_MAGIC, IDX_VERSION, BLOCK, sx.count, nb, len(ids)))
+            for b in range(nb):
+                f.write(struct.pack("<II", sx.tmin[b], sx.tmax[b]))
+            for id_ in ids:
+                n = len(sx.chains[id_])
+                f.write(struct.pack(IDX_DIR, id_, n, off))
+                d[id_] = (n, off)
+                off += 2 * n
+            for id_ in ids:
+                f.write(sx.chains[id_])
+        os.rename(tmp, self._path(sx.seq))
+        sx.dir = d
+        sx.chains = None
+
+    def _chain(self, sx, id_):
+        if sx.chains is not None:
+            return sx.chains.get(id_)
+        ent = sx.dir.get(id_)
+        if ent is None:
+            return None
+        n, off = ent
+        ch = _array("H", n)
+        with open(self._path(sx.seq), "rb") as f:
+            f.seek(off)
+            f.readinto(ch)
+        return ch
+
+    # ------------------ Consulta ------------------
+    def time_of(self, cursor, buf, off=0):
+        """Hora del registro en segundos desde 2000 (T_NONE si no se sabe)."""
+        t_local = struct.unpack_from("<I", buf, off)[0]
+        gps_t = store.gps_t_of(buf, off)
+        return gps_t or self.epochs.to_t2000(cursor, t_local)
+
+    def find(self, id_, seq, gps_t=T_NONE):
+        """True si hay guardado un registro del collar `id_` con ese seq (y esa
+        hora GPS, si se da). Con hora solo se leen los bloques que la
+        contienen; sin ella, toda la cadena del collar."""
+        rs = self.store
+        rec = self._rec
+        for k in range(len(self.segs) - 1, -1, -1):
+            sx = self.segs[k]
+            if gps_t:
+                lo, hi = sx.bounds()
+                if gps_t < lo or gps_t > hi:
+                    continue
+            ch = self._chain(sx, id_)
+            if not ch:
+                continue
+            with open(rs.segment_path(sx.seq), "rb") as f:
+                for i in ch:
+                    b = i // BLOCK
+                    if gps_t and (sx.tmax[b] < gps_t or sx.tmin[b] > gps_t):
+                        continue
+                    f.seek(store.HDR_SIZE + i * store.REC_SIZE)
+                    if f.readinto(rec) != store.REC_SIZE:
+                        break
+                    if struct.unpack_from("<H", rec, 10)[0] == seq and \
+                            (not gps_t or store.gps_t_of(rec) == gps_t):
+                        return True
+        return False
+
+    async def query(self, read, end_cursor, emit, id_=None, f_from=0, f_to=T_MAX,
+                    since=0, limit=1000):
+        """Llama `await emit(cursor, buf, off, t)` por cada registro que
+        cumple, en orden de llegada y desde el cursor `since`, hasta `limit`.
+
+        read / end_cursor: los de WriteBuffer, para los registros que todavía
+        no llegaron al almacén. Devuelve (cursor para seguir, hay más).
+        """
+        self.busy = True
+        try:
+            return await self._query(read, end_cursor, emit, id_, f_from, f_to, since, limit)
+        finally:
+            self.busy = False
+
+    async def _query(self, read, end_cursor, emit, id_, f_from, f_to, since, limit):
+        self.queries += 1
+        rs = self.store
+        timed = f_from > 0 or f_to < T_MAX
+        n = 0
+        page = self._page
+        mv = memoryview(page)
+        found = self._found
+        for sx in list(self.segs):
+            base = sx.seq * rs.seg_records
+            if base + sx.count <= since:
+                continue
+            lo, hi = sx.bounds()
+            if hi < f_from or lo > f_to:
+                continue
+            if id_ is not None:
+                # Cadena del collar: solo sus registros, en bloques que se crucen
+                ch = self._chain(sx, id_)
+                if not ch:
+                    continue
+                # De a BLOCK registros; el archivo no queda abierto mientras se manda
+                pos = 0
+                while pos < len(ch):
+                    got = 0
+                    with open(rs.segment_path(sx.seq), "rb") as f:
+                        while pos < len(ch) and got < BLOCK:
+                            i = ch[pos]
+                            pos += 1
+                            b = i // BLOCK
+                            if base + i < since or sx.tmax[b] < f_from or sx.tmin[b] > f_to:
+                                continue
+                            f.seek(store.HDR_SIZE + i * store.REC_SIZE)
+                            if f.readinto(mv[got * store.REC_SIZE:(got + 1) * store.REC_SIZE]) != store.REC_SIZE:
+                                break
+                            found[got] = base + i
+                            got += 1
+                    self.read_records += got
+                    for j in range(got):
+                        c = found[j]
+                        t = self.time_of(c, page, j * store.REC_SIZE)
+                        if timed and (t == T_NONE or t < f_from or t > f_to):
+                            continue
+                        await emit(c, page, j * store.REC_SIZE, t)
+                        n += 1
+                        if n >= limit:
+                            return c + 1, True
+            else:
+                for b in range(len(sx.tmin)):
+                    first = b * BLOCK
+                    if base + first + BLOCK <= since or sx.tmax[b] < f_from or sx.tmin[b] > f_to:
+                        continue
+                    k = rs.read_at(sx.seq, first, page)
+                    self.read_records += k
+                    for j in range(k):
+                        c = base + first + j
+                        if c < since:
+                            continue
+                        t = self.time_of(c, page, j * store.REC_SIZE)
+                        if timed and (t == T_NONE or t < f_from or t > f_to):
+                            continue
+                        await emit(c, page, j * store.REC_SIZE, t)
+                        n += 1
+                        if n >= limit:
+                            return c + 1, True
+            await asyncio.sleep_ms(0)          # que el radio no espere a la consulta
+
+        # Lo que sigue en RAM (WriteBuffer) todavía no está indexado
+        cursor = max(since, rs.end_cursor())
+        end = end_cursor()
+        while cursor < end:
+            k, nxt = read(cursor, page)
+            if not k or nxt <= cursor:
+                break
+            for j in range(k):
+                c = nxt - k + j
+                off = j * store.REC_SIZE
+                if id_ is not None and page[off + 8] != id_:
+                    continue
+                t = self.time_of(c, page, off)
+                if timed and (t == T_NONE or t < f_from or t > f_to):
+                    continue
+                await emit(c, page, off, t)
+                n += 1
+                if n >= limit:
+                    return c + 1, True
+            cursor = nxt
+        return end, False
+
+    def stats(self):
+        return {
+            "segments": len(self.segs),
+            "blocks": sum(len(sx.tmin) for sx in self.segs),
+            "rebuilt": self.rebuilt,
+            "epochs": len(self.epochs.entries),
+            "queries": self.queries,
+            "read_records": self.read_records,
+        }
@@ -1,18 +1,30 @@
 # lora_rx_c3_soft.py — ESP32-C3 Super Mini + RA-02 (SX1278)
-from machine import SoftSPI, Pin
-import time, json
+from machine import SPI, SoftSPI, Pin, RTC
+import time, json, os, struct
 import gc
-import network, socket, _thread
-from lora_sx127x import (
-    SX127x,
-    REG_MODEM_CONFIG_1, REG_MODEM_CONFIG_2, REG_MODEM_CONFIG_3,
-    REG_FRF_MSB, REG_FRF_MID, REG_FRF_LSB,
-    REG_DIO_MAPPING_1,
-    REG_IRQ_FLAGS, IRQ_RX_DONE_MASK, IRQ_VALID_HEADER,
-    REG_FIFO_RX_CURRENT_ADDR, REG_FIFO_ADDR_PTR, REG_RX_NB_BYTES, REG_FIFO,
-    REG_PKT_SNR_VALUE, REG_PKT_RSSI_VALUE
-)
-
+import network
+import asyncio
+import httpd
+import frames
+import adr
+import tdma
+import store
+import push
+import dedup
+import geofence
+import trail
+import export
+import logindex
+import metrics
+from metrics import log, ERROR, INFO, DEBUG
+from lora_sx127x import SX127x, REG_DIO_MAPPING_1, DIO0_RX_DONE
+
+
+# ===== Mensajes =====
+# INFO: arranque, cambios de estado y errores. DEBUG: además una línea por
+# paquete y por petición HTTP (lento con la consola serie conectada). Lo
+# que antes se veía solo por consola se cuenta en /metrics.
+metrics.LEVEL = INFO
 
 # ===== Pines ESP32-C3 Super Mini =====
 PIN_SCK   = 4
@@ -22,22 +34,46 @@ PIN_CS    = 7
 PIN_DIO0  = 3
 PIN_RST   = 2
 
-# ===== SoftSPI =====
-spi = SoftSPI(baudrate=1_000_000, polarity=0, phase=0,
-              sck=Pin(PIN_SCK), mosi=Pin(PIN_MOSI), miso=Pin(PIN_MISO))
+# ===== SPI =====
+# Se intenta primero el SPI por hardware; si el chip no responde o el patrón
+# escrito en la FIFO no se relee igual, se vuelve al SoftSPI a 1 MHz.
+SPI_HW_ID   = 1
+SPI_HW_BAUD = 8_000_000
+SPI_SW_BAUD = 1_000_000
+
+def crear_radio(spi):
+    return SX127x(
+        spi=spi, cs=PIN_CS, reset=PIN_RST, dio0=PIN_DIO0,
+        freq_mhz=433.0,
+        bw=7,            # 125 kHz
+        cr=1,            # 4/5
+        sf=12,           # SF12
+        power=17
+    )
+
+def abrir_radio():
+    spi = None
+    try:
+        spi = SPI(SPI_HW_ID, baudrate=SPI_HW_BAUD, polarity=0, phase=0,
+                  sck=Pin(PIN_SCK), mosi=Pin(PIN_MOSI), miso=Pin(PIN_MISO))
+        radio = crear_radio(spi)
+        if radio.verify_spi():
+            return radio, "SPI({}) @ {} Hz".format(SPI_HW_ID, SPI_HW_BAUD)
+        log(INFO, "[LoRa] SPI hardware no pasó la verificación")
+    except (OSError, ValueError, RuntimeError) as e:
+        log(INFO, "[LoRa] SPI hardware no disponible: {}", e)
+    if spi is not None:
+        spi.deinit()
+
+    spi = SoftSPI(baudrate=SPI_SW_BAUD, polarity=0, phase=0,
+                  sck=Pin(PIN_SCK), mosi=Pin(PIN_MOSI), miso=Pin(PIN_MISO))
+    return crear_radio(spi), "SoftSPI @ {} Hz".format(SPI_SW_BAUD)
 
 # ===== Radio LoRa =====
-lora = SX127x(
-    spi=spi, cs=PIN_CS, reset=PIN_RST, dio0=PIN_DIO0,
-    freq_mhz=433.0,
-    bw=7,            # 125 kHz
-    cr=1,            # 4/5
-    sf=12,           # SF12
-    power=17
-)
+lora, spi_desc = abrir_radio()
 
 # DIO0 = RxDone
-lora._write(REG_DIO_MAPPING_1, 0x00)
+lora._write(REG_DIO_MAPPING_1, DIO0_RX_DONE)
 
 def decode_bw(bw_idx):
     return {0:"7.8",1:"10.4",2:"15.6",3:"20.8",4:"31.25",5:"41.7",6:"62.5",7:"125",8:"250",9:"500"}.get(bw_idx,"?")
@@ -45,27 +81,17 @@ def decode_cr(cr_bits):
     return {1:"4/5",2:"4/6",3:"4/7",4:"4/8"}.get(cr_bits,"?")
 
 # ---- Print config en el chip ----
-mc1 = lora._read(REG_MODEM_CONFIG_1)
-mc2 = lora._read(REG_MODEM_CONFIG_2)
-mc3 = lora._read(REG_MODEM_CONFIG_3)
-frf = (lora._read(REG_FRF_MSB)<<16) | (lora._read(REG_FRF_MID)<<8) | lora._read(REG_FRF_LSB)
-dio = lora._read(REG_DIO_MAPPING_1)
-bw_idx = (mc1>>4)&0x0F
-cr_bits = (mc1>>1)&0x07
-sf_val  = (mc2>>4)&0x0F
-crc_on  = bool(mc2 & 0x04)
-ldo_on  = bool(mc3 & 0x08)
-freq_mhz_eff = frf * 61.03515625 / 1e6
-
-print("=== LoRa RX C3 listo (SoftSPI, RA-02) ===")
-print("Freq  : {:.6f} MHz".format(freq_mhz_eff))
-print("SF    : {}".format(sf_val))
-print("BW    : {} kHz (idx={})".format(decode_bw(bw_idx), bw_idx))
-print("CR    : {}".format(decode_cr(cr_bits)))
-print("CRC   : {}".format("ON" if crc_on else "OFF"))
-print("LDO   : {}".format("ON" if ldo_on else "OFF"))
-print("DIO0  : mapeado a RxDone (REG_DIO_MAPPING_1=0x{:02X})".format(dio))
-print("Esperando paquetes...")
+cfg = lora.read_config()
+
+log(INFO, "=== LoRa RX C3 listo ({}, RA-02) ===", spi_desc)
+log(INFO, "Freq  : {:.6f} MHz", cfg["freq_mhz"])
+log(INFO, "SF    : {}", cfg["sf"])
+log(INFO, "BW    : {} kHz (idx={})", decode_bw(cfg["bw"]), cfg["bw"])
+log(INFO, "CR    : {}", decode_cr(cfg["cr"]))
+log(INFO, "CRC   : {}", "ON" if cfg["crc"] else "OFF")
+log(INFO, "LDO   : {}", "ON" if cfg["ldo"] else "OFF")
+log(INFO, "DIO0  : mapeado a RxDone (REG_DIO_MAPPING_1=0x{:02X})", cfg["dio_mapping_1"])
+log(INFO, "Esperando paquetes...")
 
 
 # ===== Configuración Wi-Fi Access Point =====
@@ -79,236 +105,605 @@ def crear_wifi():
         authmode=network.AUTH_WPA_WPA2_PSK,
         channel=6
     )
-    print("\nPunto de acceso activo")
-    print("SSID:", ap.config('essid'))
-    print("IP:", ap.ifconfig()[0])
+    log(INFO, "\nPunto de acceso activo")
+    log(INFO, "SSID: {}", ap.config('essid'))
+    log(INFO, "IP: {}", ap.ifconfig()[0])
 
 # =========================================================
 #                  ACCESS POINT Y WEB SERVER
 # =========================================================
 
-last_payload = {} 
-def read_packet():
-    flags = lora._read(REG_IRQ_FLAGS)
-    if not (flags & IRQ_RX_DONE_MASK):
-        return None, None, None
+# ===== Última posición por collar =====
+# Último registro empaquetado (store.REC_SIZE bytes) de cada collar; /latest
+# lo serializa y guarda el cuerpo hasta que llega un paquete nuevo. El ETag
+# lleva un nonce de arranque para no coincidir con uno viejo guardado por el
+# navegador.
+last_rec = {}
+latest_body = None
+latest_version = 0
+BOOT_NONCE = "{:08x}".format(int.from_bytes(os.urandom(4), "little"))
+
+# ===== RX por interrupción =====
+# El handler de DIO0 deja cada paquete en el anillo del driver y despierta
+# a radio_task; la recepción ya no depende de qué tan ocupado esté el loop.
+rx_flag = asyncio.ThreadSafeFlag()
+lora.on_rx = rx_flag.set
+lora.start_rx_irq(slots=8)
+
+# ===== ADR =====
+# SF permitidos para los collars. El handheld escucha con el preámbulo al
+# máximo (los collars en SF bajos usan preámbulos largos, ver adr.py) y
+# contesta cada uplink con un downlink de preámbulo normal.
+ADR_SFS = (7, 9, 12)
+RX_PREAMBLE = 0xFFFF
+DL_PREAMBLE = 8
+DL_MAX_DELAY_MS = 200     # después de esto la ventana RX del collar ya cerró
+DL_TIMEOUT_MS = 3000
+
+adr_ctl = adr.Adr(sfs=ADR_SFS, pwr_max=17)
+lora.retune(preamble=RX_PREAMBLE)
+
+# ===== TDMA =====
+# Slots dimensionados para el peor caso (SF12): uplink + ventana RX del
+# collar (turnaround + downlink más largo) + guardas. Durante el comienzo
+# de cada slot se escucha directo en el SF de su collar (ver tdma.py).
+TDMA_FRAME_MIN_S = 60
+DL_TURNAROUND_MS = 250    # mismo valor que collar/adr.py
+UL_TOA_MAX_MS = lora.time_on_air_ms(frames.FIX_LEN, sf=12, preamble=adr_ctl.preamble_for(12))
+TDMA_WINDOW_MS = UL_TOA_MAX_MS + 2 * tdma.GUARD_MS
+
+# Presupuesto de aire del collar: el frame alcanza para pagar con el 1 %
+# una trama de TDMA_DUTY_FIXES fixes en el SF más caro (a SF12 unos 165 s);
+# el collar recorta sus BATCH a lo que el frame le deja (collar/main.py).
+COLLAR_DUTY_CYCLE = 0.01  # mismo valor que collar/main.py
+TDMA_DUTY_FIXES = 2       # mismo valor que collar/main.py
+UL_TOA_DUTY_MS = max(
+    lora.time_on_air_ms(frames.batch_len(TDMA_DUTY_FIXES), sf=sf, preamble=adr_ctl.preamble_for(sf))
+    for sf in ADR_SFS)
+
+tdma_ctl = tdma.Tdma(
+    UL_TOA_MAX_MS + DL_TURNAROUND_MS
+    + lora.time_on_air_ms(frames.DOWN_MAX_LEN, sf=12, preamble=DL_PREAMBLE)
+    + 2 * tdma.GUARD_MS,
+    frame_min_s=TDMA_FRAME_MIN_S,
+    tx_ms=UL_TOA_DUTY_MS,
+    duty_cycle=COLLAR_DUTY_CYCLE,
+)
+log(INFO, "[TDMA] Frame {} s, {} slots de {} ms", tdma_ctl.frame_s, tdma_ctl.slots, tdma_ctl.slot_len)
 
-    if flags & 0x20:
-        lora._write(REG_IRQ_FLAGS, 0x20 | IRQ_VALID_HEADER | IRQ_RX_DONE_MASK)
-        return None, None, None
 
-    fifo_addr = lora._read(REG_FIFO_RX_CURRENT_ADDR)
-    lora._write(REG_FIFO_ADDR_PTR, fifo_addr)
-    n = lora._read(REG_RX_NB_BYTES)
-    data = bytearray()
-    for _ in range(n):
-        data.append(lora._read(REG_FIFO))
+crear_wifi()
 
-    snr_reg = lora._read(REG_PKT_SNR_VALUE)
-    if snr_reg > 127: snr_reg -= 256
-    snr_db = snr_reg / 4.0
-    rssi_dbm = -164 + lora._read(REG_PKT_RSSI_VALUE)
+# ===== Almacén de registros =====
+# Segmentos binarios de 32 B por registro en /data (ver store.py); reemplaza
+# al data.json que crecía sin límite. Tope ~512 KB y 30 días de hora GPS.
+STORE_ROOT = "/data"
+STORE_SEG_RECORDS = 1024
+STORE_MAX_BYTES = 512 * 1024
+STORE_MAX_AGE_S = 30 * 86400
+
+registros = store.RecordStore(STORE_ROOT, STORE_SEG_RECORDS, STORE_MAX_BYTES, STORE_MAX_AGE_S)
+
+# Escritura en grupo: un write a flash cada 16 registros o 10 s; mientras
+# tanto cada registro queda copiado en la memoria RTC (journal).
+WRITE_BATCH = 16
+WRITE_MAX_AGE_MS = 10000
+
+escritor = store.WriteBuffer(registros, WRITE_BATCH, WRITE_MAX_AGE_MS, journal=RTC())
+escritor.recover()
+
+# ===== Índice por hora y collar (/query) =====
+# Después de recover(): lo recuperado del journal es del arranque anterior.
+# epochs.bin guarda el desfase hora local -> hora GPS de cada arranque.
+epocas = logindex.Epochs(STORE_ROOT + "/epochs.bin", registros.end_cursor())
+indice = logindex.LogIndex(registros, epocas)
+
+# ===== Métricas (/metrics) =====
+# Los contadores del driver (paquetes, CRC con error, anillo lleno) se leen
+# al publicar; el resto se cuenta en el camino de cada paquete.
+RSSI_BUCKETS = (-130, -120, -110, -100, -90, -80, -70, -60, -50)
+SNR_BUCKETS = (-20, -15, -10, -5, 0, 5, 10, 15)
+LOOP_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+metrics.Gauge("lora_rx_packets_total", "Paquetes leídos del radio", lambda: lora.rx_count, kind="counter")
+metrics.Gauge("lora_rx_crc_errors_total", "Paquetes con CRC inválido", lambda: lora.rx_crc_errors, kind="counter")
+metrics.Gauge("lora_rx_dropped_total", "Paquetes perdidos con el anillo RX lleno", lambda: lora.rx_dropped, kind="counter")
+m_frames = metrics.Counter("uplink_frames_total", "Tramas de uplink por tipo", "kind")
+m_decode_err = metrics.Counter("uplink_decode_errors_total", "Payloads JSON heredados inválidos")
+m_rssi = metrics.Histogram("uplink_rssi_dbm", "RSSI de los uplinks", RSSI_BUCKETS, "collar")
+m_snr = metrics.Histogram("uplink_snr_db", "SNR de los uplinks", SNR_BUCKETS, "collar")
+m_records = metrics.Counter("ingest_records_total", "Fixes guardados", "collar")
+m_dups = metrics.Counter("ingest_duplicates_total", "Fixes repetidos descartados", "collar")
+m_ingest_err = metrics.Counter("ingest_errors_total", "Fixes que no se pudieron guardar")
+m_downlink = metrics.Counter("downlink_total", "Downlinks por resultado", "result")
+m_fence = metrics.Counter("fence_transitions_total", "Cambios de estado de geocerca", "to")
+m_loop = metrics.Histogram("radio_loop_ms", "Duración de cada vuelta de radio_task", LOOP_BUCKETS_MS)
+metrics.Gauge("store_records", "Registros en el almacén", registros.count)
+metrics.Gauge("store_write_pending", "Registros esperando escritura a flash", escritor.pending)
+metrics.Gauge("mem_free_bytes", "gc.mem_free()", gc.mem_free)
+metrics.Gauge("mem_alloc_bytes", "gc.mem_alloc()", gc.mem_alloc)
+
+# ===== Memoria =====
+# Sin gc.collect() en cada vuelta de radio_task (en el C3 cuesta unos ms
+# aunque no haya llegado nada): el GC automático corre cada vez que se
+# asigna GC_THRESHOLD_DIV-ésimo del heap libre (gc.threshold) y, si la
+# tarea está ociosa y ya se asignó la mitad de eso, se adelanta ahí para no
+# caer en medio de un paquete. gc.mem_alloc() recorre el heap entero: se
+# mira al estar ocioso y, por paquete, uno de cada ALLOC_SAMPLE.
+GC_THRESHOLD_DIV = 4
+ALLOC_SAMPLE = 16
+ALLOC_BUCKETS = (256, 512, 1024, 2048, 4096, 8192)
+GC_PAUSE_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100)
+
+m_gc = metrics.Counter("gc_collections_total", "Recolecciones de basura vistas (idle: adelantada; auto: umbral)", "reason")
+m_gc_pause = metrics.Histogram("gc_pause_ms", "Duración de las recolecciones adelantadas", GC_PAUSE_BUCKETS_MS)
+m_alloc = metrics.Histogram("ingest_alloc_bytes", "Bytes asignados por paquete recibido (1 de cada {})".format(ALLOC_SAMPLE), ALLOC_BUCKETS)
+
+gc.collect()
+gc_umbral = gc.mem_free() // GC_THRESHOLD_DIV
+gc.threshold(gc_umbral)
+gc_base = gc.mem_alloc()       # mem_alloc() después de la última recolección vista
+ingest_n = 0
+
+
+def gc_ocioso():
+    global gc_base
+    alloc = gc.mem_alloc()
+    if alloc < gc_base:
+        # Bajó sin que la llamáramos: corrió el GC automático
+        m_gc.inc("auto")
+        gc_base = alloc
+        return
+    if alloc - gc_base < gc_umbral // 2:
+        return
+    t0 = time.ticks_ms()
+    gc.collect()
+    m_gc_pause.observe(time.ticks_diff(time.ticks_ms(), t0))
+    m_gc.inc("idle")
+    gc_base = gc.mem_alloc()
 
-    lora._write(REG_IRQ_FLAGS, IRQ_RX_DONE_MASK | IRQ_VALID_HEADER)
-    return bytes(data), rssi_dbm, snr_db
 
+FRAME_NAMES = {frames.KIND_FIX: "fix", frames.KIND_BATCH: "batch", frames.KIND_TELEM: "telem"}
 
-crear_wifi()
 
-def web_init():
-    global ws
-    print("\n[WEB] Iniciando servidor web...")
+def decodificar(pkt, rssi, snr):
+    # Tramas binarias (frames.py) o JSON heredado de collares sin actualizar.
+    # FIX y BATCH quedan como tuplas de campos crudos: guardar_registro los
+    # empaqueta directo al formato del almacén, sin dict de por medio.
+    try:
+        up = frames.parse_uplink(pkt)
+    except ValueError as e:
+        m_decode_err.inc()
+        log(ERROR, "[ERROR] Payload JSON no válido: {}", e)
+        return None
+    if up is None:
+        m_frames.inc("unknown")
+        if metrics.LEVEL >= DEBUG:
+            log(DEBUG, "[RX] RSSI={:.1f} dBm SNR={:.1f} dB -> trama desconocida ({} B)", rssi, snr, len(pkt))
+        return None
 
-    addr = socket.getaddrinfo("0.0.0.0", 80)[0][-1]
-    ws = socket.socket()
-    ws.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    ws.bind(addr)
-    ws.listen(3)
-    ws.settimeout(0)
-    print("[WEB] Servidor iniciado en puerto 80")
+    kind, id_ = up[0], up[1]
+    m_frames.inc(FRAME_NAMES.get(kind, "json"))
+    if id_ is not None:
+        m_rssi.observe(rssi, id_)
+        m_snr.observe(snr, id_)
+    if metrics.LEVEL >= DEBUG:
+        if kind == frames.KIND_BATCH:
+            desc = "batch {} B, {} fixes".format(len(pkt), len(up[4]))
+        else:
+            desc = "bin {} B".format(len(pkt)) if kind else "json"
+        log(DEBUG, "[RX] RSSI={:.1f} dBm SNR={:.1f} dB -> {}", rssi, snr, desc)
+    return up
 
 
-def servir_archivo(path):
-    try:
-        if path == "/" or path == "":
-            full = "/www/index.html"
-        else:
-            full = "/www" + path
+def actualizar_ultimo(id_, off):
+    global latest_body, latest_version
+    rec = last_rec.get(id_)
+    if rec is None:
+        rec = last_rec[id_] = bytearray(store.REC_SIZE)
+    rec[:] = escritor.mv[off:off + store.REC_SIZE]
+    latest_version += 1
+    latest_body = None
+    return rec
 
-        print("[WEB] Abriendo:", full)
-        with open(full, "rb") as f:
-            return f.read()
-    except OSError:
-        print("[WEB] Archivo NO encontrado:", path)
-        return None
 
+# Última trama TELEM de cada collar (consumo estimado, ver collar/power.py)
+telemetria = {}
 
 
-def handle_http():
-    try:
-        cl, addr = ws.accept()
-    except:
-        return
+def guardar_telemetria(payload, rssi, snr):
+    payload["rssi"] = rssi
+    payload["snr"] = snr
+    payload["timestamp_local"] = time.time()
+    telemetria[str(payload["id"])] = payload    # claves str: van a JSON
+    log(INFO, "[TELEM] collar {}: {} mV, mcu {} gps {} radio {} mAh, {} h",
+        payload["id"], payload["bat_mv"], payload["mcu_mah"], payload["gps_mah"],
+        payload["radio_mah"], payload["uptime_s"] // 3600)
 
-    print("\n[HTTP] Cliente conectado:", addr)
 
-    try:
-        req = cl.recv(1024).decode()
-    except:
-        cl.close()
+# Repetidos por seq (reenvíos del collar tras un ack perdido) y PDR por
+# collar, ver dedup.py. Solo los fixes únicos llegan al almacén y al SSE.
+def ya_guardado(id_, seq, gps_t):
+    # Seq más viejo que la ventana (backlog reenviado): se busca en el almacén
+    return escritor.find(id_, seq, gps_t) or indice.find(id_, seq, gps_t)
+
+
+dedup_ctl = dedup.Dedup(ya_guardado)
+
+
+def fix_unico(id_, seq, gps_t=0):
+    if id_ is None or not isinstance(seq, int):
+        return True         # JSON heredado sin seq
+    if dedup_ctl.accept(id_, seq, gps_t):
+        return True
+    m_dups.inc(id_)
+    log(DEBUG, "[DEDUP] Collar {} seq {} repetido, se descarta", id_, seq)
+    return False
+
+
+# ===== Geocerca =====
+# Mismo polígono y distancia al borde que el dashboard (RANCH_COORDS y
+# fenceMeters en www/app.js). Cada fix guardado se evalúa aquí, haya o no
+# un navegador abierto; los cambios de estado se publican en /alerts.
+RANCH_COORDS = (
+    (19.2500061, -103.6982934),
+    (19.2490052, -103.6969552),
+    (19.2482673, -103.6975558),
+    (19.2492521, -103.6989217),
+)
+FENCE_EDGE_M = 25
+
+cerca = geofence.Fence(RANCH_COORDS, FENCE_EDGE_M)
+alertas = geofence.Tracker(cerca, max_events=64)
+
+
+def evaluar_cerca(id_, rec):
+    lat, lon = struct.unpack_from("<ii", rec, 12)
+    if lat == store.LATLON_NA:
+        return
+    gps_t = store.gps_t_of(rec)
+    ev = alertas.update(id_, lat / 1e7, lon / 1e7, gps_t + frames.EPOCH_2000 if gps_t else None)
+    if ev is None:
         return
+    m_fence.inc(ev["to"])
+    log(INFO, "[FENCE] Collar {}: {} -> {}", ev["id"], ev["from"], ev["to"])
 
-    print("[HTTP] RAW request:")
-    print(req)
 
+def guardar_registro(fx, rssi, snr, sf):
+    # fx: tupla de campos crudos (frames.fix_fields) o dict del JSON
+    # heredado. Se empaqueta una sola vez, directo en el lugar que le toca en
+    # el WriteBuffer; la última posición, la geocerca y el SSE leen de ahí.
     try:
-        path = req.split(" ")[1]
-    except:
-        cl.close()
-        return
+        off = escritor.slot()
+        if isinstance(fx, dict):
+            fx["rssi"] = rssi
+            fx["snr"] = snr
+            fx["sf"] = sf
+            fx["timestamp_local"] = time.time()
+            store.pack_record(escritor.buf, off, fx)
+            id_ = fx.get("id")
+        else:
+            store.pack_fix(escritor.buf, off, fx, time.time(), rssi, snr, sf)
+            id_ = fx[0]
+        if metrics.LEVEL >= DEBUG:
+            lat, lon = struct.unpack_from("<ii", escritor.buf, off + 12)
+            log(DEBUG, "Payload OK -> ID: {} Lat: {} Lon: {}", id_, lat, lon)
 
-    if "?" in path:
-        path = path.split("?", 1)[0]
+        rec = actualizar_ultimo(id_, off) if id_ is not None else escritor.mv[off:off + store.REC_SIZE]
+        cursor = escritor.commit()
+        if id_ is not None:
+            evaluar_cerca(id_, rec)
+        hub.publish(cursor, rec)
 
-    print("[HTTP] Path:", path)
+        m_records.inc(id_)
+        log(DEBUG, "[OK] Registro {} en cola", cursor)
 
-    if path in ("/data.json", "/data"):
-        try:
-            f = open("data.json", "rb")
-            cl.write("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n")
-            try:
-                while True:
-                    chunk = f.read(512)
-                    if not chunk:
-                        break
-                    cl.write(chunk)
-            except OSError as e:
-                print("[HTTP] Error enviando data.json:", e)
-            f.close()
-        except OSError:
-            cl.write("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n[]")
-        try:
-            cl.close()
-        except:
-            pass
-        return
+    except Exception as e:
+        m_ingest_err.inc()
+        log(ERROR, "[ERROR] No se pudo guardar el registro: {}", e)
+
+
+# ===== Servidor web =====
+# Un /events queda abierto por navegador: se suman conexiones al tope
+server = httpd.Server(port=80, root="/www", max_clients=6)
+hub = push.Hub(escritor.read, escritor.end_cursor, max_clients=3)
 
-    if path == "/" or path == "":
-        fs_path = "/www/index.html"
-    else:
-        fs_path = "/www" + path
-
-    if path.endswith(".css"):
-        mime = "text/css"
-    elif path.endswith(".js"):
-        mime = "application/javascript"
-    elif path.endswith(".png"):
-        mime = "image/png"
-    elif path.endswith(".jpg") or path.endswith(".jpeg"):
-        mime = "image/jpeg"
-    else:
-        mime = "text/html"
 
+DATA_PAGE = 32           # registros por respuesta de /data.json
+data_buf = bytearray(DATA_PAGE * store.REC_SIZE)
+
+
+async def handle_data(req, resp):
+    # Cursor = número de registro en el almacén (ver store.py). Cada
+    # respuesta trae como máximo DATA_PAGE líneas JSON; X-More indica que
+    # quedan más y el cliente vuelve a pedir con el nuevo X-Cursor.
     try:
-        f = open(fs_path, "rb")
-        cl.write("HTTP/1.1 200 OK\r\nContent-Type: " + mime + "\r\nConnection: close\r\n\r\n")
-        try:
-            while True:
-                chunk = f.read(512)
-                if not chunk:
-                    break
-                cl.write(chunk)
-        except OSError as e:
-            print("[HTTP] Error enviando", path, ":", e)
-        f.close()
-    except OSError:
-        cl.write("HTTP/1.1 404 NOT FOUND\r\nContent-Type: text/plain\r\nConnection: close\r\n\r\n404 No encontrado")
+        since = int(req.query.get("since", "0"))
+    except ValueError:
+        since = 0
 
     try:
-        cl.close()
-    except:
-        pass
+        n, cursor = escritor.read(since, data_buf)
+    except OSError as e:
+        log(ERROR, "[HTTP] Error leyendo registros: {}", e)
+        await resp.send(503, "text/plain", "Error de almacenamiento")
+        return
+
+    lines = []
+    size = 0
+    for i in range(n):
+        line = (json.dumps(store.unpack_record(data_buf, i * store.REC_SIZE)) + "\n").encode()
+        lines.append(line)
+        size += len(line)
+
+    await resp.start(200, "application/json", size, {
+        "X-Cursor": cursor,
+        "X-More": 1 if cursor < escritor.end_cursor() else 0,
+        "Cache-Control": "no-store",
+    })
+    for line in lines:
+        await resp.write(line)
+
+
+async def handle_latest(req, resp):
+    global latest_body
+    etag = '"{}-{}"'.format(BOOT_NONCE, latest_version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if req.header("if-none-match") == etag:
+        await resp.send(304, "application/json", b"", headers)
+        return
+    if latest_body is None:
+        latest_body = json.dumps([store.unpack_record(r) for r in last_rec.values()]).encode()
+    await resp.send(200, "application/json", latest_body, headers)
+
+
+async def handle_stats(req, resp):
+    body = json.dumps({
+        "store": registros.stats(),
+        "writer": escritor.stats(),
+        "push": {"subscribers": len(hub.subs), "published": hub.published, "dropped": hub.dropped},
+        "energy": telemetria,
+        "delivery": dedup_ctl.stats(),
+        "index": indice.stats(),
+    })
+    await resp.send(200, "application/json", body, {"Cache-Control": "no-store"})
 
 
-web_init()
+# /trail?id=&from=&to=&max_points=&mode=dp|bucket&tol=: recorrido de un
+# collar reducido en el handheld (ver trail.py); from/to en segundos UTC.
+TRAIL_MAX_POINTS = 2000
 
 
-while True:
+async def handle_trail(req, resp):
+    q = req.query
     try:
-        handle_http()
+        id_ = int(q["id"])
+        t_from = int(q.get("from") or 0)
+        t_to = int(q.get("to") or 0xFFFFFFFF)
+        max_points = min(max(int(q.get("max_points") or 500), 2), TRAIL_MAX_POINTS)
+        tol_m = float(q.get("tol") or 0)
+    except (KeyError, ValueError):
+        await resp.send(400, "text/plain", "Parametros: id, from, to, max_points, mode, tol")
+        return
+    mode = "bucket" if q.get("mode") == "bucket" else "dp"
+    try:
+        body = await trail.consultar(escritor.read, escritor.end_cursor, id_, t_from, t_to,
+                                     max_points, mode, tol_m)
     except OSError as e:
-        print("[HTTP] Error en handle_http:", e)
+        log(ERROR, "[HTTP] Error leyendo registros: {}", e)
+        await resp.send(503, "text/plain", "Error de almacenamiento")
+        return
+    await resp.send(200, "application/json", json.dumps(body), {"Cache-Control": "no-store"})
 
-    pkt, rssi, snr = read_packet()
-    if pkt is not None:
-        try:
-            obj = json.loads(pkt.decode('utf-8'))
-            lat = obj.get('lat'); lon = obj.get('lon')
-            sats = obj.get('sats'); hdop = obj.get('hdop')
-            alt  = obj.get('alt');  spd  = obj.get('spd_kn');
-            crs = obj.get('crs'); date = obj.get('date')
-            gps_time = obj.get('time'); battery = obj.get('bat_v');
-            id_cow = obj.get('id')
-            
-            text = "GPS lat={:.6f} lon={:.6f} alt={}m sats={} hdop={} spd_kn={} crs={} | {}".format(
-                lat if lat is not None else 0.0,
-                lon if lon is not None else 0.0,
-                "NA" if alt is None else "{:.1f}".format(alt),
-                "NA" if sats is None else sats,
-                "NA" if hdop is None else "{:.1f}".format(hdop),
-                "NA" if spd is None else "{:.1f}".format(spd),
-                "NA" if crs is None else "{:.1f}".format(crs),
-                link
-            )
-        except Exception:
-            try:
-                text = pkt.decode('utf-8')
-            except:
-                text = str(pkt)
-        print("[RX] RSSI={:.1f} dBm SNR={:.1f} dB -> {}".format(rssi, snr, text))
 
+async def handle_alerts(req, resp):
+    # ?since=N: eventos desde el número N (el cliente guarda "next")
+    try:
+        since = int(req.query.get("since", "0"))
+    except ValueError:
+        since = 0
+    body = json.dumps({
+        "next": alertas.next_n,
+        "edge_m": FENCE_EDGE_M,
+        "state": alertas.states(),
+        "events": alertas.since(since),
+    })
+    await resp.send(200, "application/json", body, {"Cache-Control": "no-store"})
+
+
+# /export.csv y /export.ndjson?id=&from=&to=: el almacén completo en
+# streaming (chunked, Range para reanudar, deflate opcional; ver export.py)
+exportador = export.Exporter(escritor.read, registros.first_cursor, escritor.end_cursor, BOOT_NONCE)
+
+
+# /query?id=&from=&to=&since=&limit=: registros de un rango de horas (y de
+# un collar) buscando en el índice, sin recorrer el almacén (ver
+# logindex.py). from/to en segundos UTC; registros sin hora GPS usan la hora
+# local más el desfase de su arranque. Cuerpo streaming:
+#   {"records": [...], "next": cursor, "more": true|false}
+# Con more=true se sigue con since=next.
+QUERY_LIMIT = 1000
+QUERY_MAX = 10000
+
+
+async def handle_query(req, resp):
+    q = req.query
+    try:
+        id_ = int(q["id"]) if q.get("id") else None
+        t_from = int(q.get("from") or 0)
+        t_to = int(q.get("to") or 0)
+        since = int(q.get("since") or 0)
+        limit = min(max(int(q.get("limit") or QUERY_LIMIT), 1), QUERY_MAX)
+    except ValueError:
+        await resp.send(400, "text/plain", "Parametros: id, from, to, since, limit")
+        return
+    if indice.busy:
+        await resp.send(503, "text/plain", "Consulta en curso", {"Retry-After": 1})
+        return
+    f_from = max(0, t_from - frames.EPOCH_2000) if t_from else 0
+    f_to = max(0, t_to - frames.EPOCH_2000) if t_to else logindex.T_MAX
+    await resp.start(200, "application/json", None, {"Cache-Control": "no-store"}, chunked=True)
+    if resp.head_only:
+        return
+    sep = [b""]
+
+    async def emit(cursor, buf, off, t):
+        rec = store.unpack_record(buf, off)
+        rec["cursor"] = cursor
+        rec["t"] = t + frames.EPOCH_2000 if t else None
+        await resp.write(sep[0] + json.dumps(rec).encode())
+        sep[0] = b","
+
+    await resp.write(b'{"records":[')
+    try:
+        nxt, more = await indice.query(escritor.read, escritor.end_cursor, emit,
+                                       id_, f_from, f_to, since, limit)
+    except OSError as e:
+        # Ya salió la cabecera: se corta la conexión sin el último trozo
+        log(ERROR, "[HTTP] Error en /query: {}", e)
+        resp.chunked = False
+        resp.keep_alive = False
+        return
+    await resp.write('],"next":{},"more":{}}}'.format(nxt, "true" if more else "false").encode())
+
+
+async def handle_metrics(req, resp):
+    await resp.send(200, metrics.CONTENT_TYPE, b"".join(metrics.render()), {"Cache-Control": "no-store"})
+
+
+server.route("/data.json", handle_data)
+server.route("/data", handle_data)
+server.route("/latest", handle_latest)
+server.route("/events", hub.serve)
+server.route("/stats.json", handle_stats)
+server.route("/metrics", handle_metrics)
+server.route("/alerts", handle_alerts)
+server.route("/trail", handle_trail)
+server.route("/export.csv", exportador.serve_csv)
+server.route("/export.ndjson", exportador.serve_ndjson)
+server.route("/query", handle_query)
+
+
+# ===== Downlink =====
+async def enviar_downlink(dl, sf):
+    if lora.sf != sf:
+        lora.retune(sf=sf)
+    lora.transmit(dl, preamble=DL_PREAMBLE)
+    t0 = time.ticks_ms()
+    while not lora.tx_done():
+        if time.ticks_diff(time.ticks_ms(), t0) > DL_TIMEOUT_MS:
+            m_downlink.inc("timeout")
+            log(ERROR, "[DL] TX timeout")
+            lora.tx_abort()
+            return
+        await asyncio.sleep_ms(10)
+    m_downlink.inc("sent")
+
+
+async def responder(id_, seq, flags, size, rx_sf, rssi, snr, rx_ms):
+    need = flags & frames.FLAG_NEED_SCHED
+    toa = lora.time_on_air_ms(size, sf=rx_sf, preamble=adr_ctl.preamble_for(rx_sf))
+    tdma_ctl.on_uplink(id_, rx_ms, toa,
+                       synced=not need and tdma_ctl.sent.get(id_) == tdma_ctl.version)
+    cmd = adr_ctl.on_uplink(id_, rx_sf, rssi, snr)
+    plan = tdma_ctl.command(id_, need)
+    if time.ticks_diff(time.ticks_ms(), rx_ms) > DL_MAX_DELAY_MS:
+        m_downlink.inc("late")
+        log(INFO, "[DL] Uplink de collar {} atendido tarde, sin downlink", id_)
+        adr_ctl.link(id_).sent = None    # reintentar el comando en el próximo
+        tdma_ctl.sent.pop(id_, None)
+        return
+    cmds = []
+    if cmd:
+        cmds.append((frames.CMD_ADR,) + cmd)
+    if plan:
+        cmds.append((frames.CMD_SCHED,) + plan)
+    await enviar_downlink(frames.encode_downlink(id_, seq or 0, cmds), rx_sf)
+
+
+async def atender_paquetes():
+    """Procesa los paquetes que dejó el handler de DIO0 en el anillo."""
+    global ingest_n
+    while True:
+        pkt, rssi, snr = lora.recv_nowait()
+        if pkt is None:
+            break
+        rx_ms, rx_sf = lora.last_rx_ms, lora.last_rx_sf
+        ingest_n += 1
+        muestra = ingest_n % ALLOC_SAMPLE == 0
+        if muestra:
+            a0 = gc.mem_alloc()
+        up = decodificar(pkt, rssi, snr)
+        if up is None:
+            continue
+        kind, id_, seq, flags, body = up
+        # El downlink va primero: la ventana RX del collar es corta
+        if kind and id_ is not None:
+            await responder(id_, seq, flags, len(pkt), rx_sf, rssi, snr, rx_ms)
+        if kind in (frames.KIND_FIX, frames.KIND_BATCH):
+            dedup_ctl.on_frame(id_, seq, flags)
+            # BATCH: fixes atrasados del collar (store-and-forward), del más viejo al actual
+            for fx in body:
+                if fix_unico(fx[0], fx[1], fx[3]):
+                    guardar_registro(fx, rssi, snr, rx_sf)
+        elif kind == frames.KIND_TELEM:
+            guardar_telemetria(body, rssi, snr)
+        elif fix_unico(id_, seq):
+            guardar_registro(body, rssi, snr, rx_sf)
+        if muestra:
+            a1 = gc.mem_alloc()
+            if a1 >= a0:                 # si corrió el GC en el medio no sirve
+                m_alloc.observe(a1 - a0)
+        await asyncio.sleep_ms(0)
+
+
+# ===== Tarea de radio =====
+def plan_escucha():
+    """(SF objetivo o None, saltando entre SF, ms de espera antes de resintonizar)."""
+    # Si se conoce el collar dueño del slot actual se escucha en su SF
+    owner = tdma_ctl.owner(time.ticks_ms(), TDMA_WINDOW_MS)
+    target = adr_ctl.links[owner].sf if owner in adr_ctl.links else None
+    hopping = target is None and len(adr_ctl.active_sfs()) > 1
+    wait_ms = adr.dwell_ms(lora.sf) if hopping or target is not None else 1000
+    return target, hopping, wait_ms
+
+
+def resintonizar(target, hopping):
+    """Se cumplió la espera sin paquetes: cambia de SF si corresponde."""
+    if lora.any():
+        # Flanco de DIO0 perdido: si sigue en alto, vaciar a mano
+        lora._on_dio0(None)
+    elif target is not None:
+        if lora.sf != target and not lora.signal_detected():
+            lora.retune(sf=target)
+    elif hopping and not lora.signal_detected():
+        lora.retune(sf=adr_ctl.next_sf(lora.sf))
+    elif not hopping and lora.sf != adr_ctl.active_sfs()[0]:
+        lora.retune(sf=adr_ctl.active_sfs()[0])
+
+
+async def radio_task():
+    while True:
+        target, hopping, wait_ms = plan_escucha()
         try:
-            payload = json.loads(text)
-            id_       = payload.get("id")
-            lat       = payload.get("lat")
-            lon       = payload.get("lon")
-            alt       = payload.get("alt")
-            sats      = payload.get("sats")
-            hdop      = payload.get("hdop")
-            spd_kn    = payload.get("spd_kn")
-            crs       = payload.get("crs")
-            date      = payload.get("date")
-            gps_time  = payload.get("gps_time")
-            bat_v     = payload.get("bat_v")
-
-            print("Payload OK -> ID:", id_, "Lat:", lat, "Lon:", lon)
-
-            record = {
-                "id": id_,
-                "lat": lat,
-                "lon": lon,
-                "alt": alt,
-                "sats": sats,
-                "hdop": hdop,
-                "spd_kn": spd_kn,
-                "crs": crs,
-                "date": date,
-                "gps_time": gps_time,
-                "bat_v": bat_v,
-                "timestamp_local": time.time()
-            }
-            with open("data.json", "a") as f:
-                f.write(json.dumps(record) + "\n")
-
-            print("[OK] Registro guardado en data.json")
-
-        except Exception as e:
-            print("[ERROR] Payload no es JSON válido:", e)
-
-     
-        
-        pass
-    else:
-        time.sleep_ms(20)
-    
-    gc.collect()
\ No newline at end of file
+            await asyncio.wait_for(rx_flag.wait(), wait_ms / 1000)
+        except asyncio.TimeoutError:
+            resintonizar(target, hopping)
+            gc_ocioso()
+
+        t0 = time.ticks_us()
+        await atender_paquetes()
+        escritor.poll()
+        m_loop.observe(time.ticks_diff(time.ticks_us(), t0) / 1000)
+
+
+async def main():
+    await server.start()
+    await radio_task()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    finally:
+        escritor.flush()
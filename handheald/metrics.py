@@ -0,0 +1,136 @@
+# metrics.py — Contadores, histogramas y nivel de mensajes del handheld
+#
+# En campo no hay consola serie: lo que pasa en el radio, el almacén y el
+# servidor web se cuenta acá y se publica en /metrics con el formato de
+# texto de Prometheus (se puede raspar desde una PC conectada al AP o mirar
+# con el navegador). Observar un valor solo suma enteros, sin armar
+# strings; la serie de cada etiqueta se crea la primera vez que aparece.
+#
+# Cada métrica admite una sola etiqueta (collar, ruta, ...) con pocos
+# valores posibles. Los histogramas tienen cubetas fijas y se guardan sin
+# acumular; render() las acumula como pide Prometheus.
+#
+# log() reemplaza a los print() sueltos: con LEVEL = INFO (por defecto)
+# solo salen arranque, cambios de estado y errores; los mensajes por
+# paquete o por petición HTTP son DEBUG y no se formatean si no salen.
+ERROR = 0
+INFO = 1
+DEBUG = 2
+
+LEVEL = INFO
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def log(level, msg, *args):
+    if level <= LEVEL:
+        print(msg.format(*args) if args else msg)
+
+
+_metrics = []
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_, label=None):
+        self.name = name
+        self.help = help_
+        self.label = label
+        self.series = {} if label else {None: 0}
+        _metrics.append(self)
+
+    def inc(self, lv=None, n=1):
+        self.series[lv] = self.series.get(lv, 0) + n
+
+    def value(self, lv=None):
+        return self.series.get(lv, 0)
+
+    def samples(self):
+        for lv, v in self.series.items():
+            yield self.name, self.label, lv, None, v
+
+
+class Gauge:
+    """Valor leído al publicar: fn() -> número, o dict etiqueta -> número."""
+
+    def __init__(self, name, help_, fn, label=None, kind="gauge"):
+        self.name = name
+        self.help = help_
+        self.fn = fn
+        self.label = label
+        self.kind = kind          # "counter" si fn lee un contador de otro módulo
+        _metrics.append(self)
+
+    def samples(self):
+        v = self.fn()
+        if isinstance(v, dict):
+            for lv, x in v.items():
+                yield self.name, self.label, lv, None, x
+        elif v is not None:
+            yield self.name, None, None, None, v
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_, buckets, label=None):
+        self.name = name
+        self.help = help_
+        self.buckets = buckets
+        self.label = label
+        self.series = {}          # etiqueta -> [cubetas..., +Inf]
+        self.sums = {}
+        _metrics.append(self)
+
+    def observe(self, v, lv=None):
+        counts = self.series.get(lv)
+        if counts is None:
+            counts = self.series[lv] = [0] * (len(self.buckets) + 1)
+            self.sums[lv] = 0
+        i = 0
+        for b in self.buckets:
+            if v <= b:
+                break
+            i += 1
+        counts[i] += 1
+        self.sums[lv] += v
+
+    def samples(self):
+        for lv, counts in self.series.items():
+            acc = 0
+            for i, b in enumerate(self.buckets):
+                acc += counts[i]
+                yield self.name + "_bucket", self.label, lv, b, acc
+            acc += counts[-1]
+            yield self.name + "_bucket", self.label, lv, "+Inf", acc
+            yield self.name + "_sum", self.label, lv, None, self.sums[lv]
+            yield self.name + "_count", self.label, lv, None, acc
+
+
+def _num(v):
+    if isinstance(v, float):
+        return "{:.6g}".format(v)
+    return str(v)
+
+
+def _sample(name, label, lv, le, v):
+    parts = []
+    if label is not None and lv is not None:
+        parts.append('{}="{}"'.format(label, lv))
+    if le is not None:
+        parts.append('le="{}"'.format(le if isinstance(le, str) else _num(le)))
+    if parts:
+        return "{}{{{}}} {}\n".format(name, ",".join(parts), _num(v))
+    return "{} {}\n".format(name, _num(v))
+
+
+def render():
+    """Lista de líneas (bytes) en formato de texto de Prometheus 0.0.4."""
+    lines = []
+    for m in _metrics:
+        lines.append("# HELP {} {}\n# TYPE {} {}\n".format(m.name, m.help, m.name, m.kind).encode())
+        for s in m.samples():
+            lines.append(_sample(*s).encode())
+    return lines
+
@@ -0,0 +1,109 @@
+# push.py — Server-Sent Events: registros en vivo hacia el dashboard
+#
+# Cada registro guardado se publica una sola vez (JSON serializado una vez
+# y compartido) en la cola de cada suscriptor. El id de cada evento es el
+# cursor del almacén, así que al reconectar el navegador manda
+# Last-Event-ID y se le reenvía lo que se perdió desde el almacén antes de
+# seguir en vivo. Un suscriptor que se atrasa más de `queue` eventos se
+# desconecta; al volver recupera lo pendiente por la misma vía. Un
+# Last-Event-ID más allá del final (de antes de un reinicio que perdió el
+# buffer en RAM) sigue desde el final, no repite el almacén entero.
+import asyncio
+import json
+import store
+from metrics import log, INFO
+
+KEEPALIVE_S = 15          # comentario ": ping" para que el proxy/AP no corte
+RETRY_MS = 3000           # espera de reconexión que se le indica al navegador
+BACKLOG_PAGE = 8          # registros leídos por vez al reenviar el atraso
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = []
+        self.event = asyncio.Event()
+        self.overflow = False
+
+
+class Hub:
+    def __init__(self, read, end_cursor, max_clients=3, queue=32):
+        # read(cursor, buf) -> (n, cursor_siguiente) y end_cursor(), como WriteBuffer
+        self.read = read
+        self.end_cursor = end_cursor
+        self.max_clients = max_clients
+        self.queue_max = queue
+        self.subs = []
+        self.published = 0
+        self.dropped = 0          # suscriptores cortados por atraso
+
+    def publish(self, cursor, buf, off=0):
+        # El registro empaquetado (store.REC_SIZE bytes en buf[off:]): el
+        # JSON se arma solo si hay alguien escuchando
+        if not self.subs:
+            return
+        line = "id: {}\ndata: {}\n\n".format(cursor, json.dumps(store.unpack_record(buf, off))).encode()
+        self.published += 1
+        for sub in self.subs:
+            if len(sub.queue) >= self.queue_max:
+                sub.overflow = True
+            else:
+                sub.queue.append((cursor, line))
+            sub.event.set()
+
+    def _since(self, req):
+        last = req.header("last-event-id")
+        if last is not None:
+            try:
+                return int(last) + 1
+            except ValueError:
+                pass
+        try:
+            return int(req.query.get("since", "-1"))
+        except ValueError:
+            return -1
+
+    async def serve(self, req, resp):
+        """Handler de /events."""
+        if len(self.subs) >= self.max_clients:
+            await resp.send(503, "text/plain", "Demasiados suscriptores")
+            return
+        since = self._since(req)
+        # WriteBuffer.read vuelve al principio con un cursor pasado el final
+        # (sirve para /data.json); acá no se perdió nada que se pueda mandar
+        since = min(since, self.end_cursor())
+        sub = Subscriber()
+        # Registrar antes de mandar el atraso: lo que llegue mientras tanto
+        # queda en la cola y se filtra por cursor.
+        self.subs.append(sub)
+        try:
+            await resp.start(200, "text/event-stream", None, {"Cache-Control": "no-store"})
+            await resp.write("retry: {}\n\n".format(RETRY_MS).encode())
+            sent = since
+            if since >= 0:
+                buf = bytearray(BACKLOG_PAGE * store.REC_SIZE)
+                while True:
+                    n, nxt = self.read(sent, buf)
+                    if n == 0:
+                        break
+                    first = nxt - n
+                    for i in range(n):
+                        await resp.write("id: {}\ndata: {}\n\n".format(
+                            first + i, json.dumps(store.unpack_record(buf, i * store.REC_SIZE))).encode())
+                    sent = nxt
+            while not sub.overflow:
+                try:
+                    await asyncio.wait_for(sub.event.wait(), KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    await resp.write(b": ping\n\n")
+                    continue
+                sub.event.clear()
+                while sub.queue:
+                    cursor, line = sub.queue.pop(0)
+                    if cursor >= sent:
+                        await resp.write(line)
+            self.dropped += 1
+            log(INFO, "[SSE] Suscriptor atrasado, se desconecta")
+        except OSError:
+            pass
+        finally:
+            self.subs.remove(sub)
@@ -0,0 +1,596 @@
+# store.py — Almacén de registros del handheld en segmentos binarios
+#
+# Cada registro ocupa REC_SIZE bytes fijos (en lugar de ~250 bytes de JSON)
+# y se agrega al final del segmento activo, /data/seg_NNNNNNNN.bin. Un
+# segmento lleno se cierra y se abre otro: el nuevo se escribe primero como
+# .tmp con su cabecera y se renombra, así nunca queda un segmento a medias
+# con nombre válido. La retención borra segmentos completos, los más viejos
+# primero, por tamaño total y por antigüedad (hora GPS de su último
+# registro).
+#
+# Recuperación tras un corte de energía: al abrir se borran los .tmp y se
+# revisa la cola del último segmento; un registro incompleto o con checksum
+# inválido se descarta copiando la parte buena (MicroPython no tiene
+# truncate).
+#
+# El cursor de un registro es seq_segmento * seg_records + índice: crece
+# siempre y sigue siendo válido después de borrar segmentos viejos.
+#
+# Cabecera de segmento (16 bytes):
+#   4s magic "RSEG", B versión, B tamaño de registro, H registros por
+#   segmento, I seq del segmento, I hora local de creación
+#
+# Registro (32 bytes, little endian):
+#   I  t_local      time.time() del handheld al recibir
+#   I  gps_t        segundos UTC desde 2000 (0 = sin hora GPS); con
+#                   REC_TOD, segundos del día (JSON heredado con hora y sin
+#                   fecha): leerlo con gps_t_of(), que en ese caso da 0
+#   B  id           B  sf           H  seq
+#   i  lat * 1e7    i  lon * 1e7    (LATLON_NA = sin dato)
+#   h  alt (m)      (ALT_NA = sin dato)
+#   B  spd          B  crs          B  sats_hdop    B  bat  (como en frames.py)
+#   h  rssi (dBm)   b  snr * 4
+#   B  banderas     banderas del uplink | REC_LEGACY | REC_VOLTS | REC_TOD
+#   x  reservado    B  checksum     suma de los 31 bytes anteriores & 0xFF
+import os
+import struct
+import time
+import frames
+from metrics import log, INFO
+
+MAGIC = b"RSEG"
+VERSION = 1
+HDR_FMT = "<4sBBHII"
+HDR_SIZE = 16
+REC_FMT = "<IIBBHiihBBBBhbBxB"
+REC_SIZE = 32
+
+LATLON_NA = -0x80000000
+ALT_NA = -0x8000
+REC_LEGACY = 0x80    # JSON heredado
+REC_VOLTS = 0x40     # bat en volts * 50 (JSON heredado que mandó volts, no %)
+REC_TOD = 0x20       # gps_t = solo hora del día (sin fecha)
+FLAGS_OFF = 29       # offset del byte de banderas
+
+SEG_PREFIX = "seg_"
+SEG_SUFFIX = ".bin"
+
+
+def _u8(x, scale, na=frames.NA_U8, top=254):
+    if x is None:
+        return na
+    v = int(x * scale + 0.5)
+    return 0 if v < 0 else (top if v > top else v)
+
+
+def _clamp(v, lo, hi):
+    return lo if v < lo else (hi if v > hi else v)
+
+
+def _checksum(buf, off=0):
+    s = 0
+    for i in range(off, off + REC_SIZE - 1):
+        s += buf[i]
+    return s & 0xFF
+
+
+def _segundos_del_dia(hms):
+    # "HHMMSS(.sss)" -> segundos desde las 00:00, o None
+    try:
+        if len(hms) < 6:
+            return None
+        return int(hms[0:2]) * 3600 + int(hms[2:4]) * 60 + int(hms[4:6])
+    except ValueError:
+        return None
+
+
+def gps_t_of(buf, off=0):
+    """gps_t del registro en buf[off:]; 0 si no tiene fecha y hora GPS."""
+    if buf[off + FLAGS_OFF] & REC_TOD:
+        return 0
+    return struct.unpack_from("<I", buf, off + 4)[0]
+
+
+def pack_record(buf, off, rec):
+    """Escribe el dict `rec` (fix de frames.py o JSON heredado) en buf[off:off+32]."""
+    legacy = not rec.get("kind")
+    gps_t = rec.get("ts")
+    tod = False
+    if gps_t:
+        gps_t -= frames.EPOCH_2000
+    else:
+        hms = rec.get("gps_time") or ""
+        gps_t = frames.gps_to_t2000(rec.get("date") or "", hms)
+        if not gps_t and hms:
+            # Hora sin fecha: se guarda la hora del día, no sirve para ordenar
+            gps_t = _segundos_del_dia(hms)
+            tod = gps_t is not None
+            gps_t = gps_t or 0
+    lat, lon, alt = rec.get("lat"), rec.get("lon"), rec.get("alt")
+    sats, hdop, crs = rec.get("sats"), rec.get("hdop"), rec.get("crs")
+    bat = rec.get("bat_v")
+    # bat_v llega en %, como en las tramas binarias; solo un float <= 5 son volts
+    volts = isinstance(bat, float) and bat <= 5
+    snr = rec.get("snr")
+    struct.pack_into(
+        REC_FMT, buf, off,
+        int(rec.get("timestamp_local") or 0) & 0xFFFFFFFF,
+        max(0, int(gps_t)),
+        (rec.get("id") or 0) & 0xFF,
+        rec.get("sf") or 0,
+        (rec.get("seq") or 0) & 0xFFFF,
+        LATLON_NA if lat is None else int(round(lat * 1e7)),
+        LATLON_NA if lon is None else int(round(lon * 1e7)),
+        ALT_NA if alt is None else _clamp(int(round(alt)), -32767, 32767),
+        _u8(rec.get("spd_kn"), 10),
+        0 if crs is None else int(crs * 256 / 360 + 0.5) & 0xFF,
+        ((0 if sats is None else min(int(sats), 15)) << 4) | _u8(hdop, 2, frames.HDOP_NA, 14),
+        _u8(bat, 50 if volts else 1),
+        _clamp(int(rec.get("rssi") or 0), -32768, 32767),
+        0 if snr is None else _clamp(int(round(snr * 4)), -128, 127),
+        (rec.get("flags") or 0) & 0x0F | (REC_LEGACY if legacy else 0) | (REC_VOLTS if volts else 0)
+        | (REC_TOD if tod else 0),
+        0,
+    )
+    buf[off + REC_SIZE - 1] = _checksum(buf, off)
+
+
+def pack_fix(buf, off, f, t_local, rssi, snr, sf):
+    """Como pack_record, pero desde los campos crudos de una trama binaria
+    (tupla de frames.fix_fields / batch_fixes): mismas codificaciones, sin
+    pasar por dict ni float."""
+    id_, seq, flags, gps_t, lat, lon, spd, crs, sh, bat = f
+    struct.pack_into(
+        REC_FMT, buf, off,
+        int(t_local) & 0xFFFFFFFF, gps_t, id_, sf, seq, lat, lon, ALT_NA,
+        spd, crs or 0, sh, bat,
+        _clamp(int(rssi), -32768, 32767),
+        0 if snr is None else _clamp(int(round(snr * 4)), -128, 127),
+        flags & 0x0F,
+        0,
+    )
+    buf[off + REC_SIZE - 1] = _checksum(buf, off)
+
+
+def unpack_record(buf, off=0):
+    """Inverso de pack_record: dict con los mismos campos que /data.json."""
+    (t_local, gps_t, id_, sf, seq, lat, lon, alt, spd, crs, sh, bat,
+     rssi, snr4, flags, _) = struct.unpack_from(REC_FMT, buf, off)
+    hdop = sh & 0x0F
+    date = gps_time = ts = None
+    if flags & REC_TOD:
+        gps_time = frames.t2000_to_gps(gps_t)[1]
+    elif gps_t:
+        date, gps_time = frames.t2000_to_gps(gps_t)
+        ts = gps_t + frames.EPOCH_2000
+    return {
+        "id": id_,
+        "lat": None if lat == LATLON_NA else lat / 1e7,
+        "lon": None if lon == LATLON_NA else lon / 1e7,
+        "alt": None if alt == ALT_NA else alt,
+        "sats": sh >> 4,
+        "hdop": None if hdop == frames.HDOP_NA else hdop / 2,
+        "spd_kn": None if spd == frames.NA_U8 else spd / 10,
+        "crs": crs * 360 / 256,
+        "date": date,
+        "gps_time": gps_time,
+        "bat_v": None if bat == frames.NA_U8 else (bat / 50 if flags & REC_VOLTS else bat),
+        "seq": seq,
+        "ts": ts,
+        "rssi": rssi,
+        "snr": snr4 / 4,
+        "sf": sf,
+        "timestamp_local": t_local,
+    }
+
+
+def record_valid(buf, off=0):
+    return buf[off + REC_SIZE - 1] == _checksum(buf, off)
+
+
+class Segment:
+    def __init__(self, seq, count, last_gps_t):
+        self.seq = seq
+        self.count = count
+        self.last_gps_t = last_gps_t
+
+
+class RecordStore:
+    def __init__(self, root="/data", seg_records=1024, max_bytes=512 * 1024,
+                 max_age_s=30 * 86400):
+        self.root = root
+        self.seg_records = seg_records
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.segments = []        # Segment, del más viejo al activo
+        self.newest_gps_t = 0
+        self.recovered = 0        # registros descartados al abrir
+        self.evicted = 0          # segmentos borrados por retención
+        self.writes = 0           # escrituras a flash (una por append_packed y segmento)
+        self.index = None         # logindex.LogIndex: se entera de lo que se escribe y se borra
+        self._rec = bytearray(REC_SIZE)
+        self._open()
+
+    # ------------------ Rutas ------------------
+    def _path(self, seq, tmp=False):
+        return "{}/{}{:08d}{}".format(self.root, SEG_PREFIX, seq, ".tmp" if tmp else SEG_SUFFIX)
+
+    def segment_path(self, seq):
+        return self._path(seq)
+
+    def seg_bytes(self):
+        return HDR_SIZE + self.seg_records * REC_SIZE
+
+    # ------------------ Apertura / recuperación ------------------
+    def _open(self):
+        try:
+            os.mkdir(self.root)
+        except OSError:
+            pass
+        seqs = []
+        for name in os.listdir(self.root):
+            if not name.startswith(SEG_PREFIX):
+                continue
+            if name.endswith(".tmp"):
+                os.remove(self.root + "/" + name)
+                continue
+            if name.endswith(SEG_SUFFIX):
+                try:
+                    seqs.append(int(name[len(SEG_PREFIX):-len(SEG_SUFFIX)]))
+                except ValueError:
+                    pass
+        seqs.sort()
+        for i, seq in enumerate(seqs):
+            seg = self._scan(seq, last=i == len(seqs) - 1)
+            if seg is not None:
+                self.segments.append(seg)
+                self.newest_gps_t = max(self.newest_gps_t, seg.last_gps_t)
+        if not self.segments:
+            self._roll(0)
+        self._enforce()
+        log(INFO, "[STORE] {} segmentos, {} registros{}",
+            len(self.segments), self.count(),
+            ", {} descartados".format(self.recovered) if self.recovered else "")
+
+    def _scan(self, seq, last):
+        path = self._path(seq)
+        try:
+            size = os.stat(path)[6]
+            with open(path, "rb") as f:
+                hdr = f.read(HDR_SIZE)
+                if len(hdr) < HDR_SIZE:
+                    raise ValueError
+                magic, ver, rsize, nrec, hseq, _ = struct.unpack(HDR_FMT, hdr)
+                if (magic != MAGIC or ver != VERSION or rsize != REC_SIZE or hseq != seq
+                        or nrec != self.seg_records):
+                    raise ValueError
+                count = min((size - HDR_SIZE) // REC_SIZE, nrec)
+                good = count
+                # Solo el segmento activo puede tener la cola rota
+                while last and good > 0:
+                    f.seek(HDR_SIZE + (good - 1) * REC_SIZE)
+                    f.readinto(self._rec)
+                    if record_valid(self._rec):
+                        break
+                    good -= 1
+                last_gps_t = 0
+                if good:
+                    f.seek(HDR_SIZE + (good - 1) * REC_SIZE)
+                    f.readinto(self._rec)
+                    last_gps_t = gps_t_of(self._rec)
+        except (OSError, ValueError):
+            log(INFO, "[STORE] Segmento inválido, se borra: {}", path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        if size != HDR_SIZE + good * REC_SIZE:
+            self.recovered += count - good + (1 if (size - HDR_SIZE) % REC_SIZE else 0)
+            self._rewrite(seq, good)
+        return Segment(seq, good, last_gps_t)
+
+    def _rewrite(self, seq, count):
+        # Copia cabecera + `count` registros válidos y reemplaza el original
+        src, tmp = self._path(seq), self._path(seq, True)
+        with open(src, "rb") as f, open(tmp, "wb") as g:
+            g.write(f.read(HDR_SIZE))
+            for _ in range(count):
+                f.readinto(self._rec)
+                g.write(self._rec)
+        # rename reemplaza al original de una vez (LittleFS): si se corta
+        # antes queda el original entero y el .tmp se borra al abrir
+        os.rename(tmp, src)
+
+    # ------------------ Escritura ------------------
+    def _roll(self, seq):
+        tmp = self._path(seq, True)
+        with open(tmp, "wb") as f:
+            f.write(struct.pack(HDR_FMT, MAGIC, VERSION, REC_SIZE, self.seg_records,
+                                seq, int(time.time()) & 0xFFFFFFFF))
+        os.rename(tmp, self._path(seq))
+        self.segments.append(Segment(seq, 0, 0))
+
+    def append(self, rec):
+        """Guarda un registro; devuelve su cursor."""
+        pack_record(self._rec, 0, rec)
+        self.append_packed(self._rec, 1)
+        return self.end_cursor() - 1
+
+    def append_packed(self, buf, n):
+        """Agrega `n` registros ya empaquetados; una escritura por segmento."""
+        mv = memoryview(buf)
+        done = 0
+        while done < n:
+            seg = self.segments[-1]
+            if seg.count >= self.seg_records:
+                if self.index:
+                    self.index.closed(seg.seq)
+                self._roll(seg.seq + 1)
+                seg = self.segments[-1]
+                self._enforce()
+            k = min(n - done, self.seg_records - seg.count)
+            with open(self._path(seg.seq), "ab") as f:
+                f.write(mv[done * REC_SIZE:(done + k) * REC_SIZE])
+            self.writes += 1
+            if self.index:
+                self.index.added(seg.seq, seg.count, buf, done, k)
+            for i in range(done, done + k):
+                gps_t = gps_t_of(buf, i * REC_SIZE)
+                if gps_t:
+                    seg.last_gps_t = gps_t
+                    if gps_t > self.newest_gps_t:
+                        self.newest_gps_t = gps_t
+            seg.count += k
+            done += k
+
+    # ------------------ Retención ------------------
+    def _enforce(self):
+        # Nunca se borra el segmento activo
+        while len(self.segments) > 1:
+            old = self.segments[0]
+            too_big = self.bytes() > self.max_bytes
+            too_old = (self.max_age_s and self.newest_gps_t and old.last_gps_t
+                       and self.newest_gps_t - old.last_gps_t > self.max_age_s)
+            if not (too_big or too_old):
+                break
+            try:
+                os.remove(self._path(old.seq))
+            except OSError:
+                pass
+            self.segments.pop(0)
+            self.evicted += 1
+            if self.index:
+                self.index.dropped(old.seq)
+            log(INFO, "[STORE] Segmento {} borrado por retención ({})",
+                old.seq, "tamaño" if too_big else "antigüedad")
+
+    # ------------------ Lectura ------------------
+    def count(self):
+        n = 0
+        for seg in self.segments:
+            n += seg.count
+        return n
+
+    def bytes(self):
+        n = 0
+        for seg in self.segments:
+            n += HDR_SIZE + seg.count * REC_SIZE
+        return n
+
+    def first_cursor(self):
+        return self.segments[0].seq * self.seg_records
+
+    def end_cursor(self):
+        seg = self.segments[-1]
+        return seg.seq * self.seg_records + seg.count
+
+    def read(self, cursor, buf):
+        """Copia registros desde `cursor` en `buf` (múltiplo de REC_SIZE).
+
+        Devuelve (n, cursor_siguiente). Un cursor anterior al registro más
+        viejo se adelanta a first_cursor(); uno posterior al final, o de un
+        almacén ya reiniciado, vuelve a empezar desde el principio.
+        """
+        if cursor < self.first_cursor() or cursor > self.end_cursor():
+            cursor = self.first_cursor()
+        want = len(buf) // REC_SIZE
+        mv = memoryview(buf)
+        n = 0
+        while n < want and cursor < self.end_cursor():
+            seq, idx = divmod(cursor, self.seg_records)
+            seg = None
+            for s in self.segments:
+                if s.seq == seq:
+                    seg = s
+                    break
+            if seg is None or idx >= seg.count:
+                # Hueco entre segmentos (no debería pasar): saltar al siguiente
+                cursor = (seq + 1) * self.seg_records
+                continue
+            k = min(want - n, seg.count - idx)
+            with open(self._path(seq), "rb") as f:
+                f.seek(HDR_SIZE + idx * REC_SIZE)
+                got = f.readinto(mv[n * REC_SIZE:(n + k) * REC_SIZE]) // REC_SIZE
+            if not got:
+                break
+            n += got
+            cursor += got
+        return n, cursor
+
+    def read_at(self, seq, idx, buf):
+        """Copia registros del segmento `seq` desde el índice `idx` en `buf`;
+        devuelve cuántos (0 si el segmento ya no está)."""
+        for seg in self.segments:
+            if seg.seq == seq:
+                k = min(len(buf) // REC_SIZE, seg.count - idx)
+                if k <= 0:
+                    return 0
+                with open(self._path(seq), "rb") as f:
+                    f.seek(HDR_SIZE + idx * REC_SIZE)
+                    return f.readinto(memoryview(buf)[:k * REC_SIZE]) // REC_SIZE
+        return 0
+
+    def stats(self):
+        return {
+            "segments": len(self.segments),
+            "records": self.count(),
+            "bytes": self.bytes(),
+            "first": self.first_cursor(),
+            "end": self.end_cursor(),
+            "recovered": self.recovered,
+            "evicted": self.evicted,
+            "writes": self.writes,
+        }
+
+
+class WriteBuffer:
+    """Junta registros en RAM y los escribe al almacén en grupo.
+
+    Se vacía al juntar `max_records`, cuando el más viejo cumple
+    `max_age_ms` (poll) o al llamar flush() antes de apagar. Si se pasa
+    `journal` (machine.RTC(): su memory() sobrevive al reset por brown-out y
+    al watchdog, no a un corte total) cada registro se copia ahí sin tocar la
+    flash y al arrancar recover() reescribe lo que no llegó a guardarse. Sin
+    journal, un corte pierde a lo sumo los últimos `max_age_ms`.
+    """
+
+    JOURNAL_MAGIC = b"RJNL"
+    JOURNAL_HDR = "<4sH"
+    JOURNAL_HDR_SIZE = 6
+
+    def __init__(self, store, max_records=16, max_age_ms=10000, journal=None):
+        self.store = store
+        self.max_records = max_records
+        self.max_age_ms = max_age_ms
+        self.journal = journal
+        self.buf = bytearray(self.JOURNAL_HDR_SIZE + max_records * REC_SIZE)
+        self.mv = memoryview(self.buf)
+        self.n = 0
+        self.t_first = 0
+        self.records = 0
+        self.flushes = 0
+        self.by_size = 0
+        self.by_time = 0
+        self.recovered = 0
+        self.flush_ms_max = 0
+        self.flush_ms_total = 0
+
+    def _rec_off(self, i):
+        return self.JOURNAL_HDR_SIZE + i * REC_SIZE
+
+    def _journal_write(self):
+        if self.journal is None:
+            return
+        struct.pack_into(self.JOURNAL_HDR, self.buf, 0, self.JOURNAL_MAGIC, self.n)
+        self.journal.memory(self.mv[:self._rec_off(self.n)])
+
+    def recover(self):
+        """Pasa al almacén los registros que quedaron en el journal."""
+        if self.journal is None:
+            return 0
+        data = self.journal.memory()
+        if len(data) < self.JOURNAL_HDR_SIZE:
+            return 0
+        magic, n = struct.unpack_from(self.JOURNAL_HDR, data, 0)
+        if magic != self.JOURNAL_MAGIC or n == 0:
+            return 0
+        n = min(n, self.max_records, (len(data) - self.JOURNAL_HDR_SIZE) // REC_SIZE)
+        good = 0
+        for i in range(n):
+            off = self._rec_off(i)
+            if record_valid(data, off):
+                self.mv[self._rec_off(good):self._rec_off(good + 1)] = data[off:off + REC_SIZE]
+                good += 1
+        if good:
+            self.store.append_packed(self.mv[self.JOURNAL_HDR_SIZE:], good)
+            self.recovered += good
+            log(INFO, "[STORE] {} registros recuperados del journal", good)
+        self.n = 0
+        self._journal_write()
+        return good
+
+    def pending(self):
+        return self.n
+
+    def end_cursor(self):
+        return self.store.end_cursor() + self.n
+
+    def read(self, cursor, buf):
+        """Como RecordStore.read, pero incluye los registros aún en RAM."""
+        end = self.store.end_cursor()
+        if cursor < self.store.first_cursor() or cursor > end + self.n:
+            cursor = self.store.first_cursor()
+        if cursor < end:
+            return self.store.read(cursor, buf)
+        k = min(len(buf) // REC_SIZE, end + self.n - cursor)
+        off = self._rec_off(cursor - end)
+        memoryview(buf)[:k * REC_SIZE] = self.mv[off:off + k * REC_SIZE]
+        return k, cursor + k
+
+    def find(self, id_, seq, gps_t=0):
+        """True si entre los registros en RAM hay uno del collar `id_` con ese
+        seq (y esa hora GPS, si se da); ver LogIndex.find para el almacén."""
+        for i in range(self.n):
+            off = self._rec_off(i)
+            if self.buf[off + 8] == id_ and struct.unpack_from("<H", self.buf, off + 10)[0] == seq \
+                    and (not gps_t or gps_t_of(self.buf, off) == gps_t):
+                return True
+        return False
+
+    def slot(self):
+        """Offset en self.buf del próximo registro: se empaqueta ahí mismo
+        (pack_record / pack_fix) y se confirma con commit()."""
+        return self._rec_off(self.n)
+
+    def add(self, rec):
+        """Encola un registro; devuelve el cursor que tendrá en el almacén."""
+        pack_record(self.buf, self.slot(), rec)
+        return self.commit()
+
+    def commit(self):
+        """Encola el registro empaquetado en slot(); devuelve su cursor."""
+        if self.n == 0:
+            self.t_first = time.ticks_ms()
+        self.n += 1
+        self.records += 1
+        cursor = self.store.end_cursor() + self.n - 1
+        self._journal_write()
+        if self.n >= self.max_records:
+            self.by_size += 1
+            self.flush()
+        return cursor
+
+    def poll(self, now=None):
+        if not self.n:
+            return
+        now = time.ticks_ms() if now is None else now
+        if time.ticks_diff(now, self.t_first) >= self.max_age_ms:
+            self.by_time += 1
+            self.flush()
+
+    def flush(self):
+        if not self.n:
+            return
+        t0 = time.ticks_ms()
+        self.store.append_packed(self.mv[self.JOURNAL_HDR_SIZE:], self.n)
+        self.n = 0
+        self._journal_write()
+        dt = time.ticks_diff(time.ticks_ms(), t0)
+        self.flushes += 1
+        self.flush_ms_total += dt
+        if dt > self.flush_ms_max:
+            self.flush_ms_max = dt
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "pending": self.n,
+            "flushes": self.flushes,
+            "by_size": self.by_size,
+            "by_time": self.by_time,
+            "recovered": self.recovered,
+            "flush_ms_max": self.flush_ms_max,
+            "flush_ms_avg": self.flush_ms_total / self.flushes if self.flushes else 0,
+            "records_per_write": self.records / self.store.writes if self.store.writes else 0,
+        }
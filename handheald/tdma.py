@@ -0,0 +1,97 @@
+# tdma.py — Plan TDMA que el handheld publica a los collars
+#
+# Cada collar recibe un slot propio dentro de un frame alineado a la hora
+# GPS (ver collar/tdma.py). El largo del slot se calcula con el tiempo en
+# aire del uplink a SF12 (el peor caso que permite el ADR) más la ventana
+# del downlink y las guardas; el frame es el mayor entre `frame_min_s`,
+# slots * slot y el uplink más largo dividido por el ciclo de trabajo del
+# collar: cada collar transmite una vez por frame y con un frame más corto
+# su presupuesto de aire (collar/adr.py) le haría saltear slots que el
+# handheld igual espera. Cuando se llenan los slots se duplica su número y se
+# publica el plan nuevo (versión + 1) en los downlinks siguientes.
+#
+# El handheld no tiene GPS: la fase del frame se deduce del instante en que
+# llega cada uplink, lo que permite saber qué collar ocupa el slot actual y
+# escuchar directamente en su SF en lugar de saltar entre SF.
+import time
+from metrics import log, INFO
+
+GUARD_MS = 500              # mismo valor que en el collar
+MIN_SLOTS = 8
+MAX_SLOTS = 256
+PHASE_STALE_FRAMES = 10     # sin uplinks por este número de frames se pierde la fase
+
+
+class Tdma:
+    def __init__(self, slot_ms, frame_min_s=60, min_slots=MIN_SLOTS, tx_ms=0, duty_cycle=1.0):
+        self.slot_ms = (int(slot_ms) + 249) // 250 * 250
+        self.frame_min_ms = max(frame_min_s * 1000, int(tx_ms / duty_cycle))
+        self.slots = min_slots
+        self.version = 1
+        self.assigned = {}        # id -> slot
+        self.owners = {}          # slot -> id
+        self.sent = {}            # id -> versión del plan enviada
+        self.phase = None         # ticks_ms de un inicio de frame
+        self.phase_at = 0
+        self._resize()
+
+    def _resize(self):
+        frame = max(self.frame_min_ms, self.slots * self.slot_ms)
+        self.frame_s = (frame + 999) // 1000
+        self.frame_ms = self.frame_s * 1000
+        self.slot_len = self.frame_ms // self.slots
+
+    def slot_of(self, id_):
+        slot = self.assigned.get(id_)
+        if slot is not None:
+            return slot
+        slot = id_ % self.slots
+        if slot in self.owners:
+            slot = None
+            for i in range(self.slots):
+                if i not in self.owners:
+                    slot = i
+                    break
+        if slot is None:
+            if self.slots >= MAX_SLOTS:
+                return None
+            self.slots *= 2
+            self.version += 1
+            self._resize()
+            self.phase = None
+            slot = len(self.owners)
+            log(INFO, "[TDMA] {} slots, frame {} s", self.slots, self.frame_s)
+        self.assigned[id_] = slot
+        self.owners[slot] = id_
+        return slot
+
+    def command(self, id_, need=False):
+        """(frame_s, slots, slot) para el downlink, o None si el collar ya lo tiene."""
+        slot = self.slot_of(id_)
+        if slot is None:
+            return None
+        if not need and self.sent.get(id_) == self.version:
+            return None
+        self.sent[id_] = self.version
+        return (self.frame_s, self.slots, slot)
+
+    def on_uplink(self, id_, rx_ticks, toa_ms, synced=True):
+        """Recalcula la fase del frame con el fin de un uplink en su slot."""
+        slot = self.assigned.get(id_)
+        if slot is None or not synced:
+            return
+        self.phase = time.ticks_add(rx_ticks, -int(toa_ms + GUARD_MS + slot * self.slot_len))
+        self.phase_at = rx_ticks
+
+    def owner(self, now, window_ms):
+        """Collar dueño del slot actual, solo durante sus primeros `window_ms`."""
+        if self.phase is None:
+            return None
+        if time.ticks_diff(now, self.phase_at) > PHASE_STALE_FRAMES * self.frame_ms:
+            self.phase = None
+            return None
+        pos = time.ticks_diff(now, self.phase) % self.frame_ms
+        slot = pos // self.slot_len
+        if pos - slot * self.slot_len > window_ms:
+            return None
+        return self.owners.get(slot)
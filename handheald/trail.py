@@ -0,0 +1,222 @@
+# trail.py — Recorrido de un collar reducido en el handheld (/trail)
+#
+# Se recorre el almacén una sola vez, página por página, y los fixes del
+# collar en el rango de horas se guardan en arrays de enteros (lat/lon *
+# 1e7 y hora GPS). Si pasan de `cand_max` se descarta uno de cada dos y a
+# partir de ahí se toma uno de cada 2, 4, ... (decimación en flujo): la
+# memoria no depende de cuántos días se pidan.
+#
+# Los candidatos se ordenan por hora (los atrasados del backlog llegan
+# fuera de orden) y se reducen a `max_points`:
+#
+#   - "dp": Douglas-Peucker por prioridad: se parte siempre el tramo cuyo
+#     punto más alejado de la cuerda está más lejos, hasta juntar
+#     max_points o hasta que la desviación baje de `tol_m`. Conserva las
+#     esquinas del recorrido.
+#   - "bucket": max_points franjas de tiempo iguales, el último punto de
+#     cada una. Más barato y parejo en el tiempo.
+#
+# El resultado va como polyline codificada (algoritmo de Google, 5
+# decimales: ~1 m), unos 4-6 bytes por punto en lugar de ~40 de JSON.
+import asyncio
+import math
+import struct
+from array import array
+from heapq import heappush, heappop
+import frames
+import store
+
+M_PER_DEG = 111320.0
+PAGE = 32                  # registros leídos por vez
+DP_YIELD = 16              # tramos de Douglas-Peucker entre cesiones del loop
+
+
+def encode_polyline(lats, lons, idx):
+    """Polyline codificada de los puntos idx (lat/lon * 1e7)."""
+    out = bytearray()
+    plat = plon = 0
+    for i in idx:
+        lat = (lats[i] + 50) // 100        # 1e7 -> 1e5 redondeado
+        lon = (lons[i] + 50) // 100
+        for d in (lat - plat, lon - plon):
+            v = ~(d << 1) if d < 0 else d << 1
+            while v >= 0x20:
+                out.append((0x20 | (v & 0x1F)) + 63)
+                v >>= 5
+            out.append(v + 63)
+        plat, plon = lat, lon
+    return out.decode()
+
+
+def _mitad(a):
+    # a[::2] (MicroPython no corta arrays con paso)
+    return array(a.typecode, (a[i] for i in range(0, len(a), 2)))
+
+
+class Puntos:
+    """Candidatos de un collar: arrays de enteros con decimación en flujo."""
+
+    def __init__(self, cand_max):
+        self.cand_max = cand_max
+        self.t = array("I")
+        self.lat = array("i")
+        self.lon = array("i")
+        self.stride = 1
+        self.skip = 0
+        self.seen = 0
+
+    def add(self, t, lat, lon):
+        self.seen += 1
+        if self.skip:
+            self.skip -= 1
+            return
+        self.skip = self.stride - 1
+        self.t.append(t)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        if len(self.t) >= self.cand_max:
+            # Uno de cada dos y el doble de paso de acá en adelante
+            self.t = _mitad(self.t)
+            self.lat = _mitad(self.lat)
+            self.lon = _mitad(self.lon)
+            self.stride *= 2
+
+    def __len__(self):
+        return len(self.t)
+
+
+def _desvio(xs, ys, a, b):
+    # (índice, distancia^2) del punto entre a y b más lejos de la cuerda a-b
+    ax, ay = xs[a], ys[a]
+    vx, vy = xs[b] - ax, ys[b] - ay
+    l2 = vx * vx + vy * vy
+    best, best_d = -1, -1.0
+    for i in range(a + 1, b):
+        wx, wy = xs[i] - ax, ys[i] - ay
+        if l2:
+            c = (wx * vy - wy * vx)
+            d = c * c / l2
+        else:
+            d = wx * wx + wy * wy
+        if d > best_d:
+            best, best_d = i, d
+    return best, best_d
+
+
+async def douglas_peucker(xs, ys, max_points, tol_m=0):
+    """Índices (ordenados) que quedan; xs/ys en metros. Cede el loop cada
+    DP_YIELD tramos partidos: con miles de candidatos tarda."""
+    n = len(xs)
+    if n <= max_points:
+        return list(range(n))
+    keep = [0, n - 1]
+    heap = []
+    tol2 = tol_m * tol_m
+    i, d = _desvio(xs, ys, 0, n - 1)
+    if i >= 0:
+        heappush(heap, (-d, i, 0, n - 1))
+    pops = 0
+    while heap and len(keep) < max_points:
+        pops += 1
+        if pops % DP_YIELD == 0:
+            await asyncio.sleep_ms(0)      # que el radio no espere a la reducción
+        d, i, a, b = heappop(heap)
+        if -d <= tol2:
+            break
+        keep.append(i)
+        for lo, hi in ((a, i), (i, b)):
+            if hi - lo > 1:
+                j, dj = _desvio(xs, ys, lo, hi)
+                heappush(heap, (-dj, j, lo, hi))
+    keep.sort()
+    return keep
+
+
+def por_franjas(ts, max_points):
+    """Último punto de cada una de max_points franjas de tiempo iguales."""
+    n = len(ts)
+    if n <= max_points:
+        return list(range(n))
+    # Con max_points - 2 franjas quedan a lo sumo max_points puntos: el
+    # primero, el último de cada franja y el último de todos
+    t0, span = ts[0], ts[-1] - ts[0] or 1
+    nb = max(1, max_points - 2)
+    keep = [0]
+    prev = 0
+    for i in range(1, n):
+        b = (ts[i] - t0) * nb // span
+        if b != prev:
+            if keep[-1] != i - 1:
+                keep.append(i - 1)
+            prev = b
+    if keep[-1] != n - 1:
+        keep.append(n - 1)
+    return keep
+
+
+async def consultar(read, end_cursor, id_, t_from=0, t_to=0xFFFFFFFF,
+                    max_points=500, mode="dp", tol_m=0, cand_max=2048):
+    """Recorre el almacén y devuelve el dict de /trail.
+
+    read(cursor, buf) -> (n, cursor siguiente), como WriteBuffer.read.
+    t_from / t_to en segundos UTC desde 1970. Solo entran fixes con hora
+    GPS: sin ella no se pueden ubicar en el tiempo.
+    """
+    pts = Puntos(max(cand_max, max_points))
+    buf = bytearray(PAGE * store.REC_SIZE)
+    f_from = max(0, t_from - frames.EPOCH_2000)
+    f_to = max(0, t_to - frames.EPOCH_2000)
+    cursor = 0
+    end = end_cursor()
+    while True:
+        n, nxt = read(cursor, buf)
+        if not n:
+            break
+        for k in range(n):
+            off = k * store.REC_SIZE
+            if buf[off + 8] != id_:
+                continue
+            gps_t = store.gps_t_of(buf, off)
+            if not gps_t or gps_t < f_from or gps_t > f_to:
+                continue
+            lat, lon = struct.unpack_from("<ii", buf, off + 12)
+            if lat == store.LATLON_NA or lon == store.LATLON_NA:
+                continue
+            pts.add(gps_t, lat, lon)
+        if nxt >= end or nxt <= cursor:
+            break
+        cursor = nxt
+        await asyncio.sleep_ms(0)          # que el radio no espere al recorrido
+    seen = pts.seen
+
+    # Orden por hora: los arrays se reordenan y la lista de índices se suelta
+    t = pts.t
+    order = sorted(range(len(pts)), key=lambda i: t[i])
+    ts = array("I", (t[i] for i in order))
+    lats = array("i", (pts.lat[i] for i in order))
+    lons = array("i", (pts.lon[i] for i in order))
+    order = pts = t = None
+    if mode == "bucket":
+        keep = por_franjas(ts, max_points)
+    else:
+        # Metros relativos al primer punto: la resta va en enteros, antes de
+        # escalar, para no gastar los 24 bits del float32 en la posición
+        # absoluta (a miles de km de lat/lon 0 quedaba ~1 m de resolución).
+        # array("f"): 4 bytes por punto, sin un float en el heap por cada uno.
+        lat0 = lats[0] if lats else 0
+        lon0 = lons[0] if lons else 0
+        kx = M_PER_DEG * math.cos(math.radians(lat0 / 1e7)) / 1e7
+        ky = M_PER_DEG / 1e7
+        xs = array("f", ((v - lon0) * kx for v in lons))
+        ys = array("f", ((v - lat0) * ky for v in lats))
+        keep = await douglas_peucker(xs, ys, max_points, tol_m)
+        xs = ys = None
+    return {
+        "id": id_,
+        "mode": mode,
+        "matched": seen,
+        "points": len(keep),
+        "t_first": ts[keep[0]] + frames.EPOCH_2000 if keep else None,
+        "t_last": ts[keep[-1]] + frames.EPOCH_2000 if keep else None,
+        "polyline": encode_polyline(lats, lons, keep),
+    }
@@ -4,10 +4,14 @@ console.log('APP JS ACTUAL v13');
 // ===== Estado global =====
 const state = {
   auto: true,
-  animals: new Map(),    // id -> { last, history[] }
+  animals: new Map(),    // id -> { last, history: Ring }
   markers: new Map(),    // id -> L.Marker
   map: null,
-  wsOpen: false,         // reservado para WebSocket (si lo usas después)
+  wsOpen: false,         // true mientras el canal SSE (/events) está abierto
+  es: null,              // EventSource de /events
+  cursor: 0,             // siguiente registro a pedir (cursor del handheld)
+  worker: null,          // worker.js: ingesta y geocerca fuera de este hilo
+  workerNames: [],       // índice del worker -> id
   highlight: null,
   selectedId: null,
 
@@ -16,7 +20,8 @@ const state = {
 
   // Trail en vivo (independiente del CSV)
   trails: new Map(),         // id -> L.Polyline
-  trailPoints: new Map(),    // id -> Array<[lat, lon, t_ms]>
+  trailPoints: new Map(),    // id -> { ring: Ring, added, dropped, rebuild }
+  dirtyTrails: new Set(),    // ids con puntos nuevos sin pasar a su polyline
   trailMinutes: 10,          // ventana visible del trail (minutos)
   trailMaxPts: 300,          // techo de puntos por seguridad
 
@@ -28,7 +33,9 @@ const state = {
   // Geocerca
   geofenceOn: false,
   fenceMeters: 25,
-  lastFenceStatus: new Map(),  // id -> 'ok' | 'edge' | 'out'
+  fence: null,                 // Fence (shared.js)
+  fenceState: new Map(),       // id -> 'ok' | 'edge' | 'out' (último fix)
+  lastFenceStatus: new Map(),  // id -> estado ya avisado
 };
 
 // ===== Constantes de batería =====
@@ -58,88 +65,6 @@ const IMAGE_BOUNDS = [
   [19.2501658, -103.6964777]  // NE: arriba-derecha
 ];
 
-// ===== Handheld helpers (parsing y normalización) =====
-function knotsToKmh(kn){
-  return (typeof kn === 'number') ? kn * 1.852 : null;
-}
-
-function parseNumSafe(x){
-  if (x == null) return null;
-  const n = +String(x).replace(/[^\d.\-+eE]/g, '');
-  return Number.isFinite(n) ? n : null;
-}
-
-/** Convierte date="DDMMYY" y time="HHMMSS(.sss)" a epoch (segundos) */
-function parseNMEADateTime(dateStr, timeStr){
-  // Si no hay date/time, usa ahora
-  if (!dateStr && !timeStr) return Math.floor(Date.now() / 1000);
-
-  const d = String(dateStr ?? '').replace(/\D/g,'');
-  const t = String(timeStr ?? '').replace(/[^\d.]/g,'');
-
-  const DD = parseInt(d.slice(0,2) || '01',10);
-  const MM = parseInt(d.slice(2,4) || '01',10) - 1;
-  const YY = parseInt(d.slice(4,6) || '70',10);
-  const year = 2000 + (YY < 70 ? YY : YY);
-
-  const hh = parseInt(t.slice(0,2) || '0',10);
-  const mm = parseInt(t.slice(2,4) || '0',10);
-  const ssFloat = parseFloat(t.slice(4) || '0');
-  const ms = Math.floor((ssFloat - Math.floor(ssFloat)) * 1000);
-  const ss = Math.floor(ssFloat);
-
-  // IMPORTANTE: NMEA es UTC
-  const msUTC = Date.UTC(year, MM, DD, hh, mm, ss, ms);
-  return Math.floor(msUTC / 1000);
-}
-
-/** Regla simple de calidad: fix_ok si sats>=4 y hdop<=2.5 */
-function fixFromQuality(sats, hdop){
-  if (sats == null && hdop == null) return true;
-  if (sats != null && sats < 4) return false;
-  if (hdop != null && hdop > 2.5) return false;
-  return true;
-}
-
-/** Normaliza un paquete "handheld" a tu esquema interno. */
-function normalizeFromHandheld(raw, idFallback){
-  if (!raw) return null;
-  const id = (raw.id ?? idFallback ?? '').toString().trim().toUpperCase();
-  if (!id) return null;
-
-  const lat   = parseNumSafe(raw.lat);
-  const lon   = parseNumSafe(raw.lon);
-  const alt   = parseNumSafe(raw.alt);
-  const sats  = parseNumSafe(raw.sats);
-  const hdop  = parseNumSafe(raw.hdop);
-  const spdKn = parseNumSafe(raw.spd_kn);
-  const kmh   = knotsToKmh(spdKn);
-  const crs   = parseNumSafe(raw.crs);
-  const battV = parseNumSafe(raw.bat_v);
-  const ts    = parseNMEADateTime(raw.date, raw.time);
-
-  return {
-    id,
-    timestamp: ts,
-    lat, lon,
-    alt, sats, hdop,
-    kmh, crs,
-    batt: (battV ?? raw.batt ?? null),
-    rssi: raw.rssi ?? null,
-    snr:  raw.snr  ?? null,
-    fix_ok: (raw.fix_ok != null) ? !!raw.fix_ok : fixFromQuality(sats, hdop),
-  };
-}
-
-/** Detecta si un objeto luce “handheld”. */
-function isHandheldShape(o){
-  return o && (
-    ('bat_v' in o) || ('batt' in o) ||
-    ('sats' in o) || ('hdop' in o) || ('spd_kn' in o) ||
-    ('date' in o) || ('time' in o)
-  );
-}
-
 // ===== Alias (persistencia local) =====
 function loadAliases(){
   try{
@@ -249,7 +174,7 @@ async function init(){
   });
 
   // CSV / WiFi / CRUD
-  EL('#btnCSV')?.addEventListener('click', () => csvFromState());
+  EL('#btnCSV')?.addEventListener('click', downloadCSV);
   EL('#btnWifi')?.addEventListener('click', async () => {
     if (!confirm('¿Apagar Wi-Fi del handheld?')) return;
     try{ await fetch('/wifi/off', { method:'POST' }); }catch(_){}
@@ -314,7 +239,11 @@ async function init(){
   });
   EL('#fenceDist')?.addEventListener('change', (e) => {
     const v = +e.target.value;
-    if (Number.isFinite(v) && v > 0) state.fenceMeters = v;
+    if (Number.isFinite(v) && v > 0) {
+      state.fenceMeters = v;
+      setupFence();
+      scheduleRender();
+    }
   });
 
   // Inicializa UI
@@ -342,14 +271,22 @@ async function init(){
       state.sampleEverySec = wantSec;
       state.keepHours = wantH;
       state.lastBucket.clear();
-      try { state.animals.forEach(r => r.history = []); } catch(_) {}
+      try { state.animals.forEach(r => { r.history = new Ring(historyCap(), HISTORY_FIELDS); }); } catch(_) {}
     }
   })();
 
-  // Datos iniciales
-  await loadInitial();
+  // Geocerca
+  setupFence();
+
+  // Datos iniciales: en el worker si se puede
+  if (!startWorker()) {
+    await loadInitial();
+
+    // Canal en vivo (SSE); el polling queda como respaldo
+    openEvents();
+  }
 
-  // Polling solo si no hay WebSocket activo
+  // Polling solo si no hay canal en vivo
   if (window.__rgwPoll) {
     clearInterval(window.__rgwPoll);
     window.__rgwPoll = null;
@@ -387,23 +324,6 @@ async function setupMap(){
 }
 
 
-// Ordena un polígono por ángulo alrededor del centro
-function centroidOf(coords){
-  const n = coords.length;
-  let lat = 0, lon = 0;
-  coords.forEach(([la, lo]) => { lat += la; lon += lo; });
-  return [lat / n, lon / n];
-}
-function sortPolygonCircular(coords){
-  if (!Array.isArray(coords) || coords.length < 3) return coords;
-  const [clat, clon] = centroidOf(coords);
-  return [...coords].sort((a, b) => {
-    const angA = Math.atan2(a[0] - clat, a[1] - clon);
-    const angB = Math.atan2(b[0] - clat, b[1] - clon);
-    return angA - angB;
-  });
-}
-
 function getRanchCenter(){
   if (state.ranchPoly) return state.ranchPoly.getBounds().getCenter();
   return state.map?.getCenter() ?? L.latLng(19.245, -103.73);
@@ -428,60 +348,21 @@ function drawRanch(){
   renderedOnce = true;
 }
 
-// ===== Geometría para geocerca =====
-
-// Punto en polígono (ray casting). coords: [[lat,lon],...]
-function pointInPolygon(lat, lon, coords){
-  let inside = false;
-  for (let i = 0, j = coords.length - 1; i < coords.length; j = i++){
-    const xi = coords[i][1], yi = coords[i][0];
-    const xj = coords[j][1], yj = coords[j][0];
-    const intersect = ((yi > lat) !== (yj > lat)) &&
-      (lon < (xj - xi) * (lat - yi) / (yj - yi + 0.0) + xi);
-    if (intersect) inside = !inside;
-  }
-  return inside;
-}
-
-// Distancia de P a un segmento en metros (usando Web Mercator)
-function distancePointToSegmentMeters(map, A, B, P){
-  const z = map.getZoom();
-  const pA = map.project(L.latLng(A[0],A[1]), z);
-  const pB = map.project(L.latLng(B[0],B[1]), z);
-  const pP = map.project(L.latLng(P[0],P[1]), z);
-  const vx = pB.x - pA.x, vy = pB.y - pA.y;
-  const wx = pP.x - pA.x, wy = pP.y - pA.y;
-  const c1 = vx*wx + vy*wy;
-  const c2 = vx*vx + vy*vy;
-  let t = c2 ? (c1 / c2) : 0;
-  t = Math.max(0, Math.min(1, t));
-  const px = pA.x + t*vx, py = pA.y + t*vy;
-  const dx = pP.x - px,  dy = pP.y - py;
-  const distPx = Math.hypot(dx, dy);
-  // metros por pixel
-  const earth = 40075016.686;
-  const mpp = Math.cos(P[0]*Math.PI/180) * earth / (256 * Math.pow(2, z));
-  return distPx * mpp;
-}
-
-function distanceToPolygonEdgeMeters(map, coords, P){
-  let minD = Infinity;
-  for (let i = 0; i < coords.length; i++){
-    const a = coords[i];
-    const b = coords[(i + 1) % coords.length];
-    const d = distancePointToSegmentMeters(map, a, b, P);
-    if (d < minD) minD = d;
-  }
-  return minD;
-}
-
-// Evalúa estado de geocerca para un punto
-function fenceStatus(map, polyCoords, lat, lon, thresholdM){
-  if (!map || !polyCoords || polyCoords.length < 3 || lat == null || lon == null) return 'ok';
-  const inside = pointInPolygon(lat, lon, polyCoords);
-  if (!inside) return 'out';
-  const d = distanceToPolygonEdgeMeters(map, polyCoords, [lat, lon]);
-  return (d <= thresholdM) ? 'edge' : 'ok';
+// ===== Geocerca =====
+// Se evalúa en metros (Fence, shared.js) con cada fix nuevo, en el worker
+// o, sin worker, al ingerir; el render solo lee state.fenceState.
+function setupFence(){
+  state.fence = new Fence(RANCH_COORDS, state.fenceMeters);
+  if (state.worker) {
+    state.worker.postMessage({ type: 'config', coords: RANCH_COORDS, edgeM: state.fenceMeters });
+  } else {
+    state.animals.forEach((_, id) => evalFence(id));
+  }
+}
+
+function evalFence(id){
+  const p = state.animals.get(id)?.last;
+  if (p && state.fence) state.fenceState.set(id, state.fence.status(p.lat, p.lon));
 }
 
 // Aviso opcional (sonido / vibración / notificación) solo en transición
@@ -514,6 +395,93 @@ function alertOnce(id, status){
   }
 }
 
+// ===== Buffers circulares =====
+// Capacidad fija, una columna por campo en typed arrays (sin un objeto por
+// punto) y ordenados por la columna t. Lo normal es agregar al final en
+// O(1); un fix atrasado se inserta corriendo solo los más nuevos que él.
+// Lleno, el más viejo se descarta. Campo sin dato = NaN.
+class Ring {
+  constructor(cap, fields){      // fields: { nombre: Float64Array, ... } (incluye t)
+    this.cap = cap;
+    this.head = 0;               // slot del más viejo
+    this.len = 0;
+    this.names = Object.keys(fields);
+    this.cols = {};
+    for (const k of this.names) this.cols[k] = new fields[k](cap);
+    this.t = this.cols.t;
+  }
+  slot(i){ return (this.head + i) % this.cap; }
+  get(k, i){ return this.cols[k][this.slot(i)]; }
+  lastT(){ return this.len ? this.t[this.slot(this.len - 1)] : -Infinity; }
+  clear(){ this.head = 0; this.len = 0; }
+
+  /** Reserva el lugar de `t` en orden; devuelve [slot, posición] o null. */
+  insert(t){
+    if (this.len === this.cap){
+      if (t < this.t[this.head]) return null;   // más viejo que todo lo guardado
+      this.head = (this.head + 1) % this.cap;
+      this.len--;
+    }
+    let i = this.len;
+    while (i > 0 && this.t[this.slot(i - 1)] > t){
+      const from = this.slot(i - 1), to = this.slot(i);
+      for (const k of this.names) this.cols[k][to] = this.cols[k][from];
+      i--;
+    }
+    this.len++;
+    const s = this.slot(i);
+    this.t[s] = t;
+    return [s, i];
+  }
+
+  /** Descarta los anteriores a `t`; devuelve cuántos. */
+  dropBefore(t){
+    let n = 0;
+    while (this.len && this.t[this.head] < t){
+      this.head = (this.head + 1) % this.cap;
+      this.len--;
+      n++;
+    }
+    return n;
+  }
+}
+
+const TRAIL_FIELDS = { t: Float64Array, lat: Float64Array, lon: Float64Array };
+const HISTORY_FIELDS = {
+  t: Float64Array, lat: Float64Array, lon: Float64Array,
+  batt: Float32Array, rssi: Float32Array, snr: Float32Array,
+  fix: Uint8Array,               // 0 sin fix, 1 fix OK, 2 sin dato
+};
+
+const numOrNaN = v => (typeof v === 'number' ? v : NaN);
+const nanToNull = v => (Number.isNaN(v) ? null : v);
+
+function historyCap(){
+  return Math.max(1, Math.round((state.keepHours * 3600) / Math.max(1, state.sampleEverySec | 0)));
+}
+
+function newAnimal(){
+  return { last: null, history: new Ring(historyCap(), HISTORY_FIELDS) };
+}
+
+/** Guarda `p` en el historial en su lugar por tiempo (sin repetir ts). */
+function pushHistory(ring, p){
+  const t = p.timestamp;
+  // Mismo ts que el vecino anterior (repetido): no se guarda
+  let i = ring.len;
+  while (i > 0 && ring.get('t', i - 1) > t) i--;
+  if (i > 0 && ring.get('t', i - 1) === t) return;
+  const at = ring.insert(t);
+  if (!at) return;
+  const s = at[0], c = ring.cols;
+  c.lat[s] = numOrNaN(p.lat);
+  c.lon[s] = numOrNaN(p.lon);
+  c.batt[s] = numOrNaN(p.batt);
+  c.rssi[s] = numOrNaN(p.rssi);
+  c.snr[s] = numOrNaN(p.snr);
+  c.fix[s] = p.fix_ok == null ? 2 : (p.fix_ok ? 1 : 0);
+}
+
 // ===== Trail en vivo =====
 function ensureTrailLayer(id){
   let line = state.trails.get(id);
@@ -525,33 +493,65 @@ function ensureTrailLayer(id){
   return line;
 }
 
-function updateTrailPolyline(id){
-  const arr = state.trailPoints.get(id);
-  if (!arr || !arr.length) return;
-  const line = ensureTrailLayer(id);
-  line.setLatLngs(arr.map(p => [p[0], p[1]]));
-}
-
-/** Inserta posición al buffer del trail y hace poda por tiempo y tamaño */
+/** Agrega una posición al buffer del trail; la polyline se pone al día
+ *  después, una vez por tanda (flushTrails). */
 function pushTrailPoint(id, lat, lon, tsSec){
   if (lat == null || lon == null) return;
   const tms = (typeof tsSec === 'number' ? tsSec * 1000 : Date.now());
+  if (tms < Date.now() - state.trailMinutes * 60 * 1000) return;   // fuera de la ventana
 
-  let arr = state.trailPoints.get(id);
-  if (!arr) { arr = []; state.trailPoints.set(id, arr); }
-
-  arr.push([lat, lon, tms]);
+  let tr = state.trailPoints.get(id);
+  if (!tr) {
+    tr = { ring: new Ring(state.trailMaxPts, TRAIL_FIELDS), added: 0, dropped: 0, rebuild: false };
+    state.trailPoints.set(id, tr);
+  }
+  const ring = tr.ring;
+  const full = ring.len === ring.cap;
+  // Los fixes atrasados (tramas BATCH del collar) llegan después de otros
+  // más nuevos: se insertan en orden de tiempo
+  const at = ring.insert(tms);
+  if (!at) return;
+  ring.cols.lat[at[0]] = lat;
+  ring.cols.lon[at[0]] = lon;
+  if (full) tr.dropped++;
+  if (at[1] === ring.len - 1) tr.added++;
+  else tr.rebuild = true;
+  state.dirtyTrails.add(id);
+}
 
-  // Poda por ventana de tiempo (últimos trailMinutes)
+/** Pasa a las polylines lo que cambió en los buffers desde la última vez:
+ *  recorta el principio y agrega al final con addLatLng; solo un fix
+ *  atrasado obliga a rearmar la línea. */
+function flushTrails(){
+  if (!state.dirtyTrails.size && !state.trailPoints.size) return;
   const cutoff = Date.now() - state.trailMinutes * 60 * 1000;
-  while (arr.length && arr[0][2] < cutoff) arr.shift();
-
-  // Poda por cantidad (seguridad)
-  if (arr.length > state.trailMaxPts) {
-    arr.splice(0, arr.length - state.trailMaxPts);
-  }
+  state.trailPoints.forEach((tr, id) => {
+    const old = tr.ring.dropBefore(cutoff);
+    if (old) { tr.dropped += old; state.dirtyTrails.add(id); }
+  });
 
-  updateTrailPolyline(id);
+  state.dirtyTrails.forEach(id => {
+    const tr = state.trailPoints.get(id);
+    if (!tr) return;
+    const ring = tr.ring;
+    const line = ensureTrailLayer(id);
+    const lls = line.getLatLngs();
+    if (tr.rebuild || tr.added > ring.len || tr.dropped > lls.length) {
+      const pts = new Array(ring.len);
+      for (let i = 0; i < ring.len; i++) pts[i] = [ring.get('lat', i), ring.get('lon', i)];
+      line.setLatLngs(pts);
+    } else if (tr.added || tr.dropped) {
+      if (tr.dropped) lls.splice(0, tr.dropped);
+      const n = ring.len;
+      for (let i = n - tr.added; i < n - 1; i++) lls.push(L.latLng(ring.get('lat', i), ring.get('lon', i)));
+      if (tr.added) line.addLatLng([ring.get('lat', n - 1), ring.get('lon', n - 1)]);
+      else line.redraw();
+    }
+    tr.added = 0;
+    tr.dropped = 0;
+    tr.rebuild = false;
+  });
+  state.dirtyTrails.clear();
 }
 
 // ===== UI helpers =====
@@ -579,28 +579,147 @@ function setAutoUI(){
 }
 
 // ===== Fuente de datos con fallback =====
+// Pide solo los registros agregados después de state.cursor; el handheld
+// devuelve el siguiente cursor en la cabecera X-Cursor.
+const MAX_PAGES = 64;   // tope de páginas por llamada (32 registros c/u)
+
 async function fetchRecords(){
-  // Solo usamos data.json en el ESP32 (no hay /data)
-  const r = await fetch('data.json', { cache: 'no-store' });
+  // El handheld responde por páginas; X-More=1 indica que quedan registros
+  const records = [];
+  for (let page = 0; page < MAX_PAGES; page++) {
+    const r = await fetch(`data.json?since=${state.cursor}`, { cache: 'no-store' });
 
-  if (!r.ok) {
-    throw new Error('HTTP ' + r.status);
+    if (!r.ok) {
+      throw new Error('HTTP ' + r.status);
+    }
+
+    const text = (await r.text()).trim();
+    const next = parseInt(r.headers.get('X-Cursor'), 10);
+    if (Number.isFinite(next)) state.cursor = next;
+
+    const lines = text ? text.split('\n').filter(Boolean) : [];
+    for (const line of lines) {
+      try {
+        records.push(JSON.parse(line));
+      } catch (e) {
+        console.warn('Línea inválida en data.json:', line, e);
+      }
+    }
+    if (r.headers.get('X-More') !== '1') break;
   }
-  
-  const text = (await r.text()).trim();
-  if (!text) return [];
+  return records;
+}
 
-  const lines = text.split('\n').filter(Boolean);
+// ===== Canal en vivo (Server-Sent Events) =====
+// El handheld manda cada registro apenas lo recibe; el id de cada evento
+// es su cursor, así que el EventSource retoma solo (Last-Event-ID) al
+// reconectar y state.cursor sigue sirviendo si hay que volver al polling.
+function openEvents(){
+  if (!('EventSource' in window) || state.es) return;
+  const es = new EventSource(`events?since=${state.cursor}`);
+  state.es = es;
+  es.onopen = () => { state.wsOpen = true; };
+  // Los eventos que llegan juntos (reconexión, BATCH del collar) se
+  // procesan como una sola tanda
+  let live = [];
+  const flushLive = () => {
+    const objs = live;
+    live = [];
+    ingest(objs);
+    if (state.auto) scheduleRender();
+  };
+  es.onmessage = (ev) => {
+    let obj;
+    try { obj = JSON.parse(ev.data); } catch (_) { return; }
+    const id = parseInt(ev.lastEventId, 10);
+    if (Number.isFinite(id) && id >= state.cursor) state.cursor = id + 1;
+    if (!live.length) setTimeout(flushLive, 50);
+    live.push(obj);
+  };
+  es.onerror = () => {
+    // El navegador reintenta solo; mientras tanto vuelve el polling
+    state.wsOpen = false;
+    if (es.readyState === EventSource.CLOSED) {
+      state.es = null;
+      setTimeout(openEvents, 5000);
+    }
+  };
+}
 
-  const records = [];
-  for (const line of lines) {
-    try {
-      records.push(JSON.parse(line));
-    } catch (e) {
-      console.warn('Línea inválida en data.json:', line, e);
+// Una tanda de registros (página de data.json o eventos SSE juntados):
+// cada uno actualiza los buffers y las polylines se tocan una sola vez
+function ingest(objs){
+  const ids = new Set();
+  for (const obj of objs) {
+    const pkt = isHandheldShape(obj) ? normalizeFromHandheld(obj, obj.id) : obj;
+    const id = upsertPacket(pkt);
+    if (id) ids.add(id);
+  }
+  ids.forEach(evalFence);
+  flushTrails();
+}
+
+// ===== Worker de ingesta =====
+// Con worker.js la página no pide, parsea ni evalúa la geocerca: aplica las
+// tandas que llegan (registros empaquetados y transiciones) y dibuja. Sin
+// worker (navegador viejo, worker.js ausente) todo sigue en este hilo con
+// fetchRecords/openEvents.
+function startWorker(){
+  if (!('Worker' in window) || location.protocol === 'file:') return false;
+  // Misma versión (?v=hash) que shared.js en index.html
+  const src = document.querySelector('script[src^="shared.js"]')?.getAttribute('src') || '';
+  const q = src.includes('?') ? src.slice(src.indexOf('?')) : '';
+  let w;
+  try { w = new Worker('worker.js' + q); } catch (_) { return false; }
+
+  state.worker = w;
+  w.onmessage = (e) => onWorkerMessage(e.data);
+  w.onerror = (e) => {
+    console.warn('worker:', e.message, '→ ingesta en la página');
+    e.preventDefault();
+    w.terminate();
+    state.worker = null;
+    state.wsOpen = false;
+    // Sigue desde el último cursor que mandó el worker
+    loadInitial().then(openEvents);
+  };
+  setupFence();
+  w.postMessage({ type: 'load' });
+  return true;
+}
+
+const workerPkt = {};   // se reusa para cada registro de la tanda
+
+function onWorkerMessage(msg){
+  if (msg.type === 'sse') {
+    state.wsOpen = msg.open;
+    return;
+  }
+  if (msg.type === 'error') {
+    if (msg.first) {
+      console.warn('loadInitial:', msg.message, '→ usando demo');
+      seedDemo();
+      scheduleRender();
     }
+    return;
   }
-  return records;
+  if (msg.type !== 'batch') return;
+
+  const names = state.workerNames;
+  for (let i = 0; i < msg.names.length; i++) names[msg.base + i] = msg.names[i];
+  state.cursor = msg.cursor;
+
+  const rows = msg.rows;
+  for (let off = 0; off < rows.length; off += REC_N) {
+    workerPkt.id = names[unpackRecord(rows, off, workerPkt)];
+    upsertPacket(workerPkt);
+  }
+  const f = msg.fence;
+  for (let i = 0; i < f.length; i += 2) state.fenceState.set(names[f[i]], FENCE_CODES[f[i + 1]]);
+  flushTrails();
+
+  if (msg.first && !rows.length && !state.animals.size) seedDemo();
+  if (msg.first || state.auto || f.length) scheduleRender();
 }
 
 async function loadInitial(){
@@ -609,10 +728,7 @@ async function loadInitial(){
     if (!Array.isArray(arr) || arr.length === 0) {
       seedDemo();
     } else {
-      arr.forEach(obj => {
-        const pkt = isHandheldShape(obj) ? normalizeFromHandheld(obj, obj.id) : obj;
-        upsertPacket(pkt);
-      });
+      ingest(arr);
     }
     scheduleRender();
   }catch(e){
@@ -622,12 +738,14 @@ async function loadInitial(){
   }
 }
 async function refresh(){
+  if (state.worker) {
+    state.worker.postMessage({ type: 'poll' });
+    return;
+  }
   try{
     const arr = await fetchRecords();
-    arr.forEach(obj => {
-      const pkt = isHandheldShape(obj) ? normalizeFromHandheld(obj, obj.id) : obj;
-      upsertPacket(pkt);
-    });
+    if (!arr.length) return;
+    ingest(arr);
     if (state.auto) scheduleRender();
   }catch(_){}
 }
@@ -646,6 +764,7 @@ const scheduleRender = (() => {
 })();
 
 // ===== Upsert de paquetes =====
+// Devuelve el id normalizado (o undefined si el paquete no sirve)
 function upsertPacket(pkt){
   if (!pkt || !pkt.id) return;
 
@@ -653,10 +772,21 @@ function upsertPacket(pkt){
   const id = String(pkt.id).trim().toUpperCase();
 
   // Registro en memoria
-  const rec = state.animals.get(id) || { history: [], last: null };
+  let rec = state.animals.get(id);
+  if (!rec) { rec = newAnimal(); state.animals.set(id, rec); }
+
+  // Fix atrasado (store-and-forward): va al trail y al historial en su
+  // lugar, pero no reemplaza la última posición conocida
+  const lastTs = rec.last && rec.last.timestamp;
+  if (typeof pkt.timestamp === 'number' && typeof lastTs === 'number' && pkt.timestamp < lastTs) {
+    pushTrailPoint(id, pkt.lat, pkt.lon, pkt.timestamp);
+    pushHistory(rec.history, pkt);
+    return id;
+  }
 
-  // Actualiza "last" SIEMPRE (mapa fluido)
-  rec.last = { ...(rec.last || {}), ...pkt };
+  // Actualiza "last" SIEMPRE (mapa fluido), en el mismo objeto
+  if (rec.last) Object.assign(rec.last, pkt);
+  else rec.last = { ...pkt };
 
   // Alimenta el trail en vivo con TODOS los paquetes
   pushTrailPoint(
@@ -679,27 +809,18 @@ function upsertPacket(pkt){
   const prevBucket = state.lastBucket.get(id);
 
   if (prevBucket === undefined || bucket !== prevBucket) {
-    const toSave = { ...rec.last };
-
-    // Evita duplicado exacto (mismo ts consecutivo)
-    const lastSaved = rec.history[rec.history.length - 1];
-    if (!lastSaved || lastSaved.timestamp !== toSave.timestamp) {
-      rec.history.push(toSave);
-    }
+    // El buffer tiene lugar para keepHours de muestras: lleno, se va la más vieja
+    pushHistory(rec.history, rec.last);
 
     // Actualiza candado de ventana
     state.lastBucket.set(id, bucket);
-
-    // Poda para mantener EXACTAMENTE la ventana temporal configurada
-    const maxN = Math.max(1, Math.round((state.keepHours * 3600) / winSec));
-    while (rec.history.length > maxN) rec.history.shift();
   }
-
-  state.animals.set(id, rec);
+  return id;
 }
 
 // ===== Render general =====
 function render(){
+  flushTrails();
   renderMarkers();
   renderList();
 }
@@ -726,9 +847,8 @@ function renderMarkers(){
 
     // Geocerca
     let fence = 'ok';
-    if (state.geofenceOn && state.ranchPoly){
-      const polyCoords = state.ranchPoly.getLatLngs()[0].map(ll => [ll.lat, ll.lng]);
-      fence = fenceStatus(state.map, polyCoords, ll[0], ll[1], state.fenceMeters);
+    if (state.geofenceOn){
+      fence = state.fenceState.get(id) || 'ok';
       if (fence !== 'ok') alertOnce(id, fence);
     }
 
@@ -802,9 +922,8 @@ function renderList(){
     if (r.fix_ok === false) estadoHtml = '<span class="badge nofix">sin fix</span>';
     else if (lowBatt)       estadoHtml = '<span class="badge warn">batería baja</span>';
 
-    if (state.geofenceOn && state.ranchPoly && r.lat != null && r.lon != null){
-      const polyCoords = state.ranchPoly.getLatLngs()[0].map(ll => [ll.lat, ll.lng]);
-      const f = fenceStatus(state.map, polyCoords, r.lat, r.lon, state.fenceMeters);
+    if (state.geofenceOn && r.lat != null && r.lon != null){
+      const f = state.fenceState.get(r.id) || 'ok';
       if (f === 'edge') estadoHtml += ' <span class="badge warn">borde</span>';
       if (f === 'out')  estadoHtml += ' <span class="badge nofix">fuera</span>';
     }
@@ -879,7 +998,7 @@ function addAnimalPrompt(){
   const lon = (lonStr != null && lonStr.trim() !== '' && Number.isFinite(+lonStr)) ? +lonStr : undefined;
 
   const pkt = makePkt(id, lat, lon);
-  upsertPacket(pkt);
+  evalFence(upsertPacket(pkt));
   render();
   state.selectedId = id;
   focusAnimal(id);
@@ -902,9 +1021,11 @@ function deleteAnimalSelected(){
   }
   state.trails.delete(id);
   state.trailPoints.delete(id);
+  state.dirtyTrails.delete(id);
 
   state.markers.delete(id);
   state.animals.delete(id);
+  state.fenceState.delete(id);
   if (state.selectedId === id) state.selectedId = null;
 
   render();
@@ -941,28 +1062,41 @@ function distMeters(a, b){
 }
 
 function resetLogs(){
-  state.animals.forEach(rec => { rec.history = []; });
+  state.animals.forEach(rec => { rec.history.clear(); });
   state.lastBucket.clear();
   console.log('Reset: history y buckets por vaca limpiados');
   render();
 }
 
 // ===== CSV =====
+// Con el handheld: todo el almacén a resolución completa (/export.csv, lo
+// manda en streaming y el navegador lo guarda directo a disco). Lo armado
+// en memoria (24 h, una muestra cada 5 min) queda para el modo demo.
+function downloadCSV(){
+  if (location.protocol === 'file:') return csvFromState();
+  const a = document.createElement('a');
+  a.href = 'export.csv';
+  a.download = 'export.csv';
+  a.click();
+}
+
 function csvFromState(){
   const header = 'id,alias,timestamp,iso_time,lat,lon,batt,rssi,snr,fix_ok';
   const rows = [];
 
   state.animals.forEach((rec, id) => {
-    rec.history.forEach(p => {
+    const h = rec.history;
+    const alias = (state.aliases.get(id) || '').replace(/,/g,' ');
+    for (let i = 0; i < h.len; i++) {
+      const t = h.get('t', i), fix = h.get('fix', i);
       rows.push([
-        id,
-        (state.aliases.get(id) || '').replace(/,/g,' '),
-        p.timestamp ?? '',
-        iso(p.timestamp).replace(/,/g,''),
-        p.lat ?? '', p.lon ?? '',
-        p.batt ?? '', p.rssi ?? '', p.snr ?? '', p.fix_ok ?? ''
+        id, alias, t,
+        iso(t).replace(/,/g,''),
+        nanToNull(h.get('lat', i)) ?? '', nanToNull(h.get('lon', i)) ?? '',
+        nanToNull(h.get('batt', i)) ?? '', nanToNull(h.get('rssi', i)) ?? '',
+        nanToNull(h.get('snr', i)) ?? '', fix === 2 ? '' : fix === 1
       ].join(','));
-    });
+    }
   });
 
   const blob = new Blob([[header, ...rows].join('\n')], {
@@ -989,5 +1123,5 @@ function seedDemo(){
       snr: 7.5,
       fix_ok: true
     },
-  ].forEach(upsertPacket);
+  ].forEach(p => evalFence(upsertPacket(p)));
 }
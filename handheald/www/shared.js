@@ -0,0 +1,182 @@
+// shared.js — Funciones comunes a la página (app.js) y al worker (worker.js)
+//
+// Solo JavaScript puro: nada de DOM ni de Leaflet, para que el worker lo
+// pueda cargar con importScripts().
+
+// ===== Handheld helpers (parsing y normalización) =====
+function knotsToKmh(kn){
+  return (typeof kn === 'number') ? kn * 1.852 : null;
+}
+
+function parseNumSafe(x){
+  if (x == null) return null;
+  const n = +String(x).replace(/[^\d.\-+eE]/g, '');
+  return Number.isFinite(n) ? n : null;
+}
+
+/** Convierte date="DDMMYY" y time="HHMMSS(.sss)" a epoch (segundos) */
+function parseNMEADateTime(dateStr, timeStr){
+  // Si no hay date/time, usa ahora
+  if (!dateStr && !timeStr) return Math.floor(Date.now() / 1000);
+
+  const d = String(dateStr ?? '').replace(/\D/g,'');
+  const t = String(timeStr ?? '').replace(/[^\d.]/g,'');
+
+  const DD = parseInt(d.slice(0,2) || '01',10);
+  const MM = parseInt(d.slice(2,4) || '01',10) - 1;
+  const YY = parseInt(d.slice(4,6) || '70',10);
+  const year = 2000 + (YY < 70 ? YY : YY);
+
+  const hh = parseInt(t.slice(0,2) || '0',10);
+  const mm = parseInt(t.slice(2,4) || '0',10);
+  const ssFloat = parseFloat(t.slice(4) || '0');
+  const ms = Math.floor((ssFloat - Math.floor(ssFloat)) * 1000);
+  const ss = Math.floor(ssFloat);
+
+  // IMPORTANTE: NMEA es UTC
+  const msUTC = Date.UTC(year, MM, DD, hh, mm, ss, ms);
+  return Math.floor(msUTC / 1000);
+}
+
+/** Regla simple de calidad: fix_ok si sats>=4 y hdop<=2.5 */
+function fixFromQuality(sats, hdop){
+  if (sats == null && hdop == null) return true;
+  if (sats != null && sats < 4) return false;
+  if (hdop != null && hdop > 2.5) return false;
+  return true;
+}
+
+/** Normaliza un paquete "handheld" a tu esquema interno. */
+function normalizeFromHandheld(raw, idFallback){
+  if (!raw) return null;
+  const id = (raw.id ?? idFallback ?? '').toString().trim().toUpperCase();
+  if (!id) return null;
+
+  const lat   = parseNumSafe(raw.lat);
+  const lon   = parseNumSafe(raw.lon);
+  const alt   = parseNumSafe(raw.alt);
+  const sats  = parseNumSafe(raw.sats);
+  const hdop  = parseNumSafe(raw.hdop);
+  const spdKn = parseNumSafe(raw.spd_kn);
+  const kmh   = knotsToKmh(spdKn);
+  const crs   = parseNumSafe(raw.crs);
+  const battV = parseNumSafe(raw.bat_v);
+  // Las tramas binarias traen la hora GPS completa ya convertida a epoch
+  const ts    = (typeof raw.ts === 'number') ? raw.ts : parseNMEADateTime(raw.date, raw.time);
+
+  return {
+    id,
+    timestamp: ts,
+    lat, lon,
+    alt, sats, hdop,
+    kmh, crs,
+    batt: (battV ?? raw.batt ?? null),
+    rssi: raw.rssi ?? null,
+    snr:  raw.snr  ?? null,
+    fix_ok: (raw.fix_ok != null) ? !!raw.fix_ok : fixFromQuality(sats, hdop),
+  };
+}
+
+/** Detecta si un objeto luce “handheld”. */
+function isHandheldShape(o){
+  return o && (
+    ('bat_v' in o) || ('batt' in o) ||
+    ('sats' in o) || ('hdop' in o) || ('spd_kn' in o) ||
+    ('date' in o) || ('time' in o)
+  );
+}
+
+// ===== Polígono =====
+// Ordena un polígono por ángulo alrededor del centro
+function centroidOf(coords){
+  const n = coords.length;
+  let lat = 0, lon = 0;
+  coords.forEach(([la, lo]) => { lat += la; lon += lo; });
+  return [lat / n, lon / n];
+}
+function sortPolygonCircular(coords){
+  if (!Array.isArray(coords) || coords.length < 3) return coords;
+  const [clat, clon] = centroidOf(coords);
+  return [...coords].sort((a, b) => {
+    const angA = Math.atan2(a[0] - clat, a[1] - clon);
+    const angB = Math.atan2(b[0] - clat, b[1] - clon);
+    return angA - angB;
+  });
+}
+
+// ===== Geocerca en metros =====
+// El polígono se proyecta una sola vez a metros (equirectangular alrededor
+// de su centro, igual que handheald/geofence.py): a la escala de un rancho
+// el error es despreciable y el resultado no depende del zoom del mapa.
+const M_PER_DEG_LAT = 110540;
+const M_PER_DEG_LON = 111320;
+
+class Fence {
+  constructor(coords, edgeM){
+    const pts = sortPolygonCircular(coords);
+    const [lat0, lon0] = centroidOf(pts);
+    this.lat0 = lat0;
+    this.lon0 = lon0;
+    this.kx = M_PER_DEG_LON * Math.cos(lat0 * Math.PI / 180);
+    this.ky = M_PER_DEG_LAT;
+    this.edgeM = edgeM;
+    this.edge2 = edgeM * edgeM;
+    this.xs = Float64Array.from(pts, p => (p[1] - lon0) * this.kx);
+    this.ys = Float64Array.from(pts, p => (p[0] - lat0) * this.ky);
+  }
+
+  /** 'ok' (adentro), 'edge' (adentro a <= edgeM del borde) u 'out'. */
+  status(lat, lon){
+    if (lat == null || lon == null) return 'ok';
+    const x = (lon - this.lon0) * this.kx;
+    const y = (lat - this.lat0) * this.ky;
+    const xs = this.xs, ys = this.ys, n = xs.length;
+    let inside = false, d2 = Infinity;
+    for (let i = 0, j = n - 1; i < n; j = i++){
+      const ax = xs[j], ay = ys[j], bx = xs[i], by = ys[i];
+      // Ray casting
+      if ((ay > y) !== (by > y) && x < (bx - ax) * (y - ay) / (by - ay) + ax) inside = !inside;
+      // Distancia al cuadrado a la arista
+      const vx = bx - ax, vy = by - ay;
+      const l2 = vx * vx + vy * vy;
+      let t = l2 ? ((x - ax) * vx + (y - ay) * vy) / l2 : 0;
+      t = t < 0 ? 0 : t > 1 ? 1 : t;
+      const dx = x - ax - t * vx, dy = y - ay - t * vy;
+      const d = dx * dx + dy * dy;
+      if (d < d2) d2 = d;
+    }
+    if (!inside) return 'out';
+    return d2 <= this.edge2 ? 'edge' : 'ok';
+  }
+}
+
+// Código numérico de cada estado (viaja en las transiciones del worker)
+const FENCE_CODES = ['ok', 'edge', 'out'];
+
+// ===== Registros empaquetados =====
+// El worker manda cada tanda como un Float64Array de REC_N columnas por
+// registro (se transfiere sin copiar). Columna 0: índice del animal en la
+// tabla de nombres; las demás, los campos de REC_FIELDS y fix_ok
+// (1/0). Campo sin dato = NaN.
+const REC_FIELDS = ['timestamp', 'lat', 'lon', 'alt', 'sats', 'hdop', 'kmh', 'crs', 'batt', 'rssi', 'snr'];
+const REC_N = REC_FIELDS.length + 2;
+
+function packRecord(rows, off, k, p){
+  rows[off] = k;
+  for (let i = 0; i < REC_FIELDS.length; i++){
+    const v = p[REC_FIELDS[i]];
+    rows[off + 1 + i] = (typeof v === 'number') ? v : NaN;
+  }
+  rows[off + REC_N - 1] = (p.fix_ok == null) ? NaN : (p.fix_ok ? 1 : 0);
+}
+
+/** Llena `o` con el registro en `off`; devuelve el índice del animal. */
+function unpackRecord(rows, off, o){
+  for (let i = 0; i < REC_FIELDS.length; i++){
+    const v = rows[off + 1 + i];
+    o[REC_FIELDS[i]] = Number.isNaN(v) ? null : v;
+  }
+  const f = rows[off + REC_N - 1];
+  o.fix_ok = Number.isNaN(f) ? null : f === 1;
+  return rows[off];
+}
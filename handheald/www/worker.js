@@ -0,0 +1,178 @@
+// worker.js — Ingesta del dashboard fuera del hilo de la página
+//
+// Pide data.json y escucha /events, parsea y normaliza los registros, lleva
+// la última posición de cada animal y evalúa la geocerca en metros. A la
+// página le manda solo lo nuevo:
+//
+//   { type: 'batch', base, names, rows, fence, cursor, first }
+//
+//   - names: ids que aparecieron en esta tanda (índices base, base+1, ...);
+//   - rows:  Float64Array con los registros empaquetados (ver packRecord);
+//   - fence: Int32Array de pares [índice, estado] con las transiciones.
+//
+// rows y fence se transfieren (no se copian). La página nada más aplica la
+// tanda y dibuja: el mapa no se traba por más grande que sea el log.
+//
+// Mensajes de la página: 'config' (polígono y metros de borde), 'load'
+// (carga inicial y luego /events) y 'poll' (pedir lo nuevo).
+importScripts('shared.js' + self.location.search);
+
+const MAX_PAGES = 64;   // tope de páginas por llamada (32 registros c/u)
+const SSE_BATCH_MS = 50;
+
+let cursor = 0;
+let fence = null;
+let busy = false;
+let es = null;
+
+// Estado por animal, por índice
+const index = new Map();   // id -> índice
+const names = [];
+let sentNames = 0;         // nombres que la página ya conoce
+const lastT = [];
+const lastLat = [];
+const lastLon = [];
+const fenceOf = [];        // código en FENCE_CODES
+
+function evalFence(k, trans){
+  if (!fence) return;
+  const code = FENCE_CODES.indexOf(fence.status(lastLat[k], lastLon[k]));
+  if (code !== fenceOf[k]) {
+    fenceOf[k] = code;
+    trans.push(k, code);
+  }
+}
+
+/** Normaliza y empaqueta una tanda y la manda a la página. */
+function post(objs, first, trans = []){
+  const rows = new Float64Array(objs.length * REC_N);
+  let n = 0;
+  for (const obj of objs) {
+    const p = isHandheldShape(obj) ? normalizeFromHandheld(obj, obj.id) : obj;
+    if (!p || !p.id) continue;
+    const id = String(p.id).trim().toUpperCase();
+    let k = index.get(id);
+    if (k === undefined) {
+      k = names.length;
+      names.push(id);
+      index.set(id, k);
+      lastT[k] = -Infinity;
+      fenceOf[k] = -1;
+    }
+    packRecord(rows, n * REC_N, k, p);
+    n++;
+
+    // Un atrasado del backlog no pisa la última posición conocida
+    const t = p.timestamp;
+    if (typeof t === 'number') {
+      if (t < lastT[k]) continue;
+      lastT[k] = t;
+    }
+    if (p.lat == null || p.lon == null) continue;
+    lastLat[k] = p.lat;
+    lastLon[k] = p.lon;
+    evalFence(k, trans);
+  }
+
+  const used = rows.subarray(0, n * REC_N).slice();   // buffer justo
+  const fenceArr = Int32Array.from(trans);
+  self.postMessage({
+    type: 'batch',
+    base: sentNames,
+    names: names.slice(sentNames),
+    rows: used,
+    fence: fenceArr,
+    cursor,
+    first: !!first,
+  }, [used.buffer, fenceArr.buffer]);
+  sentNames = names.length;
+}
+
+// ===== data.json por páginas =====
+async function fetchRecords(){
+  // El handheld responde por páginas; X-More=1 indica que quedan registros
+  const records = [];
+  for (let page = 0; page < MAX_PAGES; page++) {
+    const r = await fetch(`data.json?since=${cursor}`, { cache: 'no-store' });
+    if (!r.ok) throw new Error('HTTP ' + r.status);
+
+    const text = (await r.text()).trim();
+    const next = parseInt(r.headers.get('X-Cursor'), 10);
+    if (Number.isFinite(next)) cursor = next;
+
+    const lines = text ? text.split('\n') : [];
+    for (const line of lines) {
+      if (!line) continue;
+      try {
+        records.push(JSON.parse(line));
+      } catch (e) {
+        console.warn('Línea inválida en data.json:', line, e);
+      }
+    }
+    if (r.headers.get('X-More') !== '1') break;
+  }
+  return records;
+}
+
+async function poll(first){
+  if (busy) return;
+  busy = true;
+  try {
+    const recs = await fetchRecords();
+    if (recs.length || first) post(recs, first);
+  } catch (e) {
+    self.postMessage({ type: 'error', message: e.message, first: !!first });
+  } finally {
+    busy = false;
+  }
+}
+
+// ===== Canal en vivo (Server-Sent Events) =====
+// Los eventos que llegan juntos (reconexión, BATCH del collar) salen como
+// una sola tanda
+function openEvents(){
+  if (!('EventSource' in self) || es) return;
+  es = new EventSource(`events?since=${cursor}`);
+  let live = [];
+  const flushLive = () => {
+    const objs = live;
+    live = [];
+    post(objs, false);
+  };
+  es.onopen = () => self.postMessage({ type: 'sse', open: true });
+  es.onmessage = (ev) => {
+    let obj;
+    try { obj = JSON.parse(ev.data); } catch (_) { return; }
+    const id = parseInt(ev.lastEventId, 10);
+    if (Number.isFinite(id) && id >= cursor) cursor = id + 1;
+    if (!live.length) setTimeout(flushLive, SSE_BATCH_MS);
+    live.push(obj);
+  };
+  es.onerror = () => {
+    // El navegador reintenta solo; mientras tanto la página vuelve al polling
+    self.postMessage({ type: 'sse', open: false });
+    if (es.readyState === EventSource.CLOSED) {
+      es = null;
+      setTimeout(openEvents, 5000);
+    }
+  };
+}
+
+// ===== Mensajes de la página =====
+self.onmessage = async (e) => {
+  const msg = e.data || {};
+  if (msg.type === 'config') {
+    fence = new Fence(msg.coords, msg.edgeM);
+    // Reevalúa a todos con el borde nuevo
+    const trans = [];
+    for (let k = 0; k < names.length; k++) {
+      if (lastLat[k] != null) evalFence(k, trans);
+    }
+    if (trans.length) post([], false, trans);
+  } else if (msg.type === 'load') {
+    await poll(true);
+    openEvents();
+  } else if (msg.type === 'poll') {
+    poll(false);
+  }
+};
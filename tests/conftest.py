@@ -0,0 +1,40 @@
+# conftest.py — Los módulos del handheld cargados con tools/host
+#
+# Cada test recibe una placa nueva (Board) con su flash en tmp_path, así
+# que time, asyncio, os y open() son los simulados, igual que al correr
+# main.py en la PC. Se corre desde la raíz del repo:
+#
+#   python -m pytest -q
+import os
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+from tools.host.board import Board  # noqa: E402
+
+
+@pytest.fixture
+def placa(tmp_path):
+    return Board("handheld", [os.path.join(REPO, "handheald"), os.path.join(REPO, "common")],
+                 str(tmp_path))
+
+
+@pytest.fixture
+def frames(placa):
+    return placa.load("frames")
+
+
+@pytest.fixture
+def store(placa):
+    return placa.load("store")
+
+
+@pytest.fixture
+def handheld(tmp_path):
+    # main.py entero (radio, almacén, índice, dedup) sin arrancar su loop
+    from tools.host import handheld as cargar
+    return cargar(str(tmp_path / "hh"))
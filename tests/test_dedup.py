@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def dedup(placa):
+    return placa.load("dedup")
+
+
+def test_ventana(dedup):
+    d = dedup.Dedup()
+    assert [d.accept(1, s) for s in (10, 11, 11, 9, 9, 200, 11)] == \
+        [True, True, False, True, False, True, False]
+    st = d.stats()["1"]
+    assert (st["top"], st["dups"], st["old"]) == (200, 3, 0)
+
+
+def test_vuelta_de_seq(dedup):
+    d = dedup.Dedup()
+    assert [d.accept(1, s) for s in (65534, 65535, 0, 1, 65535)] == [True] * 4 + [False]
+    assert d.stats()["1"]["top"] == 1
+
+
+def test_fuera_de_ventana_sin_lookup(dedup):
+    # Sin almacén no se puede saber: se acepta y se cuenta en old
+    d = dedup.Dedup()
+    assert [d.accept(1, s) for s in (1000, 500, 500)] == [True, True, True]
+    assert d.stats()["1"]["old"] == 2
+
+
+def test_fuera_de_ventana_con_lookup(dedup):
+    guardados = set()
+
+    def lookup(id_, seq, gps_t):
+        return (id_, seq) in guardados
+
+    d = dedup.Dedup(lookup)
+    out = []
+    for s in (1000, 500, 500, 499):
+        ok = d.accept(1, s)
+        if ok:
+            guardados.add((1, s))
+        out.append(ok)
+    assert out == [True, True, False, True]
+    assert d.stats()["1"]["dups"] == 1
+
+
+def _entregar(hh, pkts):
+    frames = hh.board.modules["frames"]
+    for seq, gps_t in pkts:
+        hh.radio.deliver(frames.encode_fix(1, seq, 19.249, -103.698, sats=8, hdop=1,
+                                           bat=80, gps_t=gps_t))
+        asyncio.run(hh.atender_paquetes())
+
+
+def _seqs(hh):
+    buf = bytearray(64 * 32)
+    n, _ = hh.escritor.read(hh.registros.first_cursor(), buf)
+    return sorted(hh.store.unpack_record(buf, i * 32)["seq"] for i in range(n))
+
+
+@pytest.mark.parametrize("flush", [False, True])
+def test_backlog_reenviado_no_se_guarda_dos_veces(handheld, flush):
+    # Un fix del backlog más viejo que la ventana, reenviado tras un ack perdido
+    _entregar(handheld, [(1000, 700001000), (500, 700000500)])
+    if flush:
+        handheld.escritor.flush()            # ya en flash: lo encuentra el índice
+    _entregar(handheld, [(500, 700000500), (499, 700000499)])
+    handheld.escritor.flush()
+    assert _seqs(handheld) == [499, 500, 1000]
+    assert handheld.dedup_ctl.stats()["1"]["dups"] == 1
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def export(placa):
+    return placa.load("export")
+
+
+class _Junta:
+    def __init__(self):
+        self.data = bytearray()
+
+    async def write(self, data):
+        self.data.extend(data)
+
+
+@pytest.mark.parametrize("value, rango", [
+    ("bytes=0-99", (0, 100)),
+    ("bytes=10-", (10, 1000)),
+    ("bytes=-100", (900, 1000)),
+    ("bytes=900-5000", (900, 1000)),
+    ("bytes=1000-", -1),
+    ("bytes=20-10", -1),
+    ("bytes=-0", -1),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=a-", None),
+])
+def test_parse_range(export, value, rango):
+    assert export.parse_range(value, 1000) == rango
+
+
+@pytest.mark.parametrize("start, stop", [(0, 1), (3, 17), (5, 6), (0, 40), (39, 40), (16, 32)])
+def test_tramo(export, start, stop):
+    body = bytes(range(40))
+    out = _Junta()
+    tramo = export._Tramo(out, start, stop)
+
+    async def mandar():
+        for i in range(0, len(body), 8):
+            if tramo.done:
+                break
+            await tramo.write(body[i:i + 8])
+
+    asyncio.run(mandar())
+    assert bytes(out.data) == body[start:stop]
+    assert tramo.done
+
+
+def _exportador(export, store):
+    rs = store.RecordStore("/data", seg_records=16, max_age_s=0)
+    for i in range(50):
+        rs.append({"id": 1 + i % 2, "seq": i, "lat": 19.2 + i * 1e-5, "lon": -103.7,
+                   "ts": 1700000000 + i * 60})
+    return export.Exporter(rs.read, rs.first_cursor, rs.end_cursor, "ab12"), rs
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_tramo_del_export(export, store, fmt):
+    ex, rs = _exportador(export, store)
+    first, end = rs.first_cursor(), rs.end_cursor()
+    scan = (fmt, None, 0, None, first, end)
+    todo = _Junta()
+    asyncio.run(ex._recorrer(todo, *scan))
+    cnt = export._Contador()
+    asyncio.run(ex._recorrer(cnt, *scan))
+    assert cnt.n == len(todo.data)
+    assert len(todo.data.splitlines()) == 50 + (fmt == "csv")
+
+    a, b = export.parse_range("bytes=1000-2999", cnt.n)
+    parte = _Junta()
+    asyncio.run(ex._recorrer(export._Tramo(parte, a, b), *scan))
+    assert parte.data == todo.data[a:b]
+
+
+def test_if_range(export, store):
+    ex, rs = _exportador(export, store)
+    first, end = rs.first_cursor(), rs.end_cursor()
+    etag = ex._etag(first, 40)
+    # Lo agregado después no cambia los bytes de [first, 40)
+    assert ex._fijado(etag, first, end) == 40
+    assert ex._fijado('"otro-0-40"', first, end) is None
+    assert ex._fijado(ex._etag(first + 16, 40), first, end) is None
+    assert ex._fijado(ex._etag(first, end + 1), first, end) is None
+    assert ex._fijado("W/basura", first, end) is None
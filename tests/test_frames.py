@@ -0,0 +1,96 @@
+import struct
+
+import pytest
+
+
+def test_fix_ida_y_vuelta(frames):
+    pkt = frames.encode_fix(7, 513, 19.2491234, -103.6981234, spd_kn=1.3, crs=90, sats=9,
+                            hdop=1.5, bat=81, gps_t=700000000, flags=frames.FLAG_NEED_SCHED)
+    assert len(pkt) == frames.FIX_LEN
+    f = frames.decode_uplink(pkt)
+    assert f["kind"] == frames.KIND_FIX
+    assert (f["id"], f["seq"], f["flags"]) == (7, 513, frames.FLAG_NEED_SCHED)
+    assert f["lat"] == pytest.approx(19.2491234, abs=1e-7)
+    assert f["lon"] == pytest.approx(-103.6981234, abs=1e-7)
+    assert (f["spd_kn"], f["crs"], f["sats"], f["hdop"], f["bat_v"]) == (1.3, 90, 9, 1.5, 81)
+    assert f["ts"] == 700000000 + frames.EPOCH_2000
+
+
+def test_fix_sin_datos(frames):
+    f = frames.decode_fix(frames.encode_fix(1, 0, 0.0, 0.0))
+    assert f["hdop"] is None and f["spd_kn"] is None and f["bat_v"] is None
+    assert f["ts"] is None and f["date"] is None
+
+
+def test_hora_gps(frames):
+    t = frames.gps_to_t2000("170324", "123456.00")
+    assert frames.t2000_to_gps(t) == ("170324", "123456")
+    assert frames.gps_to_t2000("", "123456") == 0
+
+
+def test_parse_uplink_fix_igual_a_decode(frames):
+    pkt = frames.encode_fix(3, 9, 19.25, -103.7, sats=6, hdop=2, bat=50, gps_t=1234)
+    kind, id_, seq, flags, body = frames.parse_uplink(pkt)
+    assert (kind, id_, seq, flags) == (frames.KIND_FIX, 3, 9, 0)
+    assert body == (frames.fix_fields(pkt),)
+    assert frames._fix_dict(*body[0]) == frames.decode_fix(pkt)
+
+
+def _fixrecs(frames, n, paso_t=30, paso=1e-5):
+    recs = bytearray(n * frames.FIXREC_LEN)
+    for i in range(n):
+        frames.pack_fixrec(recs, i * frames.FIXREC_LEN, 100 + i, 19.249 + i * paso,
+                           -103.698 - i * paso, spd_kn=0.5, crs=45, sats=8, hdop=1,
+                           bat=77, gps_t=5000 + i * paso_t)
+    return recs
+
+
+def test_batch_ida_y_vuelta(frames):
+    recs = _fixrecs(frames, 5)
+    pkt, used = frames.encode_batch(4, recs, 5)
+    assert used == 5 and len(pkt) == frames.batch_len(5)
+    fixes = frames.batch_fixes(pkt)
+    assert [f[1] for f in fixes] == [100, 101, 102, 103, 104]
+    assert [f[3] for f in fixes] == [5000 + i * 30 for i in range(5)]
+    for i, f in enumerate(fixes):
+        t, lat, lon = struct.unpack_from("<Iii", recs, i * frames.FIXREC_LEN)
+        assert abs(f[4] - lat) <= frames.DELTA_SCALE and abs(f[5] - lon) <= frames.DELTA_SCALE
+    b = frames.decode_uplink(pkt)
+    assert b["kind"] == frames.KIND_BATCH and b["seq"] == 104 and len(b["fixes"]) == 5
+    kind, id_, seq, _, body = frames.parse_uplink(pkt)
+    assert (kind, id_, seq) == (frames.KIND_BATCH, 4, 104) and body == fixes
+
+
+def test_batch_corta_por_largo_y_salto(frames):
+    recs = _fixrecs(frames, 6)
+    pkt, used = frames.encode_batch(4, recs, 6, max_len=frames.batch_len(3))
+    assert used == 3 and len(pkt) == frames.batch_len(3)
+    # Un salto de tiempo que no entra en el delta corta la trama
+    recs = _fixrecs(frames, 3, paso_t=0x10000)
+    assert frames.encode_batch(4, recs, 3)[1] == 1
+
+
+def test_batch_largo_invalido(frames):
+    pkt, _ = frames.encode_batch(4, _fixrecs(frames, 3), 3)
+    assert frames.batch_fixes(pkt[:-1]) is None
+    assert frames.parse_uplink(pkt[:-1]) is None
+
+
+def test_telem_y_json_heredado(frames):
+    t = frames.decode_uplink(frames.encode_telem(2, 3900, 1.5, 20.1, 3.2, 3600))
+    assert (t["id"], t["bat_mv"], t["gps_mah"], t["uptime_s"]) == (2, 3900, 20.1, 3600)
+    kind, id_, seq, flags, obj = frames.parse_uplink(b'{"id":5,"seq":2,"lat":19.2,"time":"101010"}')
+    assert (kind, id_, seq, flags) == (0, 5, 2, 0)
+    assert obj["gps_time"] == "101010"
+    assert frames.parse_uplink(b"") is None
+    assert frames.parse_uplink(bytes([frames.KIND_FIX, 1])) is None
+
+
+def test_downlink(frames):
+    pkt = frames.encode_downlink(9, 300, [(frames.CMD_SCHED, 172, 8, 3)], flags=1)
+    d = frames.decode_downlink(pkt)
+    assert (d["id"], d["ack"], d["flags"]) == (9, 300, 1)
+    assert d[frames.CMD_SCHED] == (172, 8, 3)
+    # Un comando cortado se ignora
+    assert frames.CMD_SCHED not in frames.decode_downlink(pkt[:-1])
+    assert frames.decode_downlink(b"\x00") is None
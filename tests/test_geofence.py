@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+# Un cuadrado de ~1.1 km de lado y una L, con los vértices desordenados
+CUADRADO = [(19.25, -103.70), (19.26, -103.69), (19.25, -103.69), (19.26, -103.70)]
+ELE = [(19.25, -103.70), (19.27, -103.70), (19.27, -103.69), (19.26, -103.69),
+       (19.26, -103.68), (19.25, -103.68)]
+
+
+@pytest.fixture
+def geofence(placa):
+    return placa.load("geofence")
+
+
+def _adentro(coords, lat, lon):
+    # Par-impar directo sobre el polígono (sin grilla) como referencia
+    dentro = False
+    n = len(coords)
+    for i in range(n):
+        (ay, ax), (by, bx) = coords[i], coords[i - 1]
+        if (ay > lat) != (by > lat) and lon < ax + (lat - ay) * (bx - ax) / (by - ay):
+            dentro = not dentro
+    return dentro
+
+
+def test_estados_cuadrado(geofence):
+    f = geofence.Fence(CUADRADO, edge_m=25)
+    assert f.status(19.255, -103.695) == geofence.OK
+    assert f.status(19.2501, -103.695) == geofence.EDGE        # ~11 m del borde sur
+    assert f.status(19.2499, -103.695) == geofence.OUT
+    assert f.status(19.3, -103.5) == geofence.OUT
+
+
+def test_grilla_igual_a_referencia(geofence):
+    f = geofence.Fence(ELE, edge_m=0.01)
+    poligono = geofence.ordenar_circular(ELE)
+    rnd = random.Random(7)
+    for _ in range(2000):
+        lat = rnd.uniform(19.245, 19.275)
+        lon = rnd.uniform(-103.705, -103.675)
+        esperado = _adentro(poligono, lat, lon)
+        assert (f.status(lat, lon) != geofence.OUT) == esperado, (lat, lon)
+
+
+def test_tracker_transiciones(geofence):
+    t = geofence.Tracker(geofence.Fence(CUADRADO), max_events=2)
+    assert t.update(1, 19.255, -103.695, ts=100) is None          # primer fix adentro
+    ev = t.update(1, 19.24, -103.695, ts=200)
+    assert (ev["from"], ev["to"], ev["n"]) == ("ok", "out", 0)
+    assert t.update(1, 19.24, -103.695, ts=300) is None           # sin cambio
+    # Un atrasado del backlog no pisa el estado
+    assert t.update(1, 19.255, -103.695, ts=150) is None
+    assert t.states() == {"1": "out"}
+    ev = t.update(2, 19.3, -103.7)                               # primer fix afuera
+    assert (ev["from"], ev["to"]) == (None, "out")
+    t.update(1, 19.255, -103.695, ts=400)
+    assert [e["n"] for e in t.since(0)] == [1, 2]                 # max_events
+    assert t.update(3, None, None) is None
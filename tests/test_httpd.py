@@ -0,0 +1,91 @@
+import asyncio
+import socket
+
+import pytest
+
+
+@pytest.fixture
+def httpd(placa):
+    return placa.load("httpd")
+
+
+def _leer(httpd, data):
+    async def leer():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await httpd.Server()._read_request(reader)
+
+    return asyncio.run(leer())
+
+
+def test_peticion(httpd):
+    req = _leer(httpd, b"POST /x?a=1 HTTP/1.1\r\nHost: h\r\nContent-Length: 3\r\n\r\nabc")
+    assert (req.method, req.path, req.query, req.body) == ("POST", "/x", {"a": "1"}, b"abc")
+    assert req.header("host") == "h"
+
+
+@pytest.mark.parametrize("data, esperado", [
+    (b"GET /\r\n\r\n", 400),                                  # sin versión
+    (b"GET /\xff HTTP/1.1\r\n\r\n", 400),                      # línea de petición no UTF-8
+    (b"GET / HTTP/1.1\r\nX-A: \xff\xfe\r\n\r\n", 400),         # cabecera no UTF-8
+    (b"POST / HTTP/1.1\r\nContent-Length: x\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length: 99999\r\n\r\n", 413),
+    (b"GET /" + b"a" * 2000 + b" HTTP/1.1\r\n\r\n", 431),
+    (b"GET / HTTP/1.1\r\n" + b"X-A: 1\r\n" * 40 + b"\r\n", 431),
+])
+def test_peticion_mal_formada(httpd, data, esperado):
+    assert _leer(httpd, data) == esperado
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"GET / HTTP/1.1\r\nHost: h\r\n",                           # cabeceras cortadas
+    b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc",        # cuerpo cortado
+])
+def test_peticion_cortada(httpd, data):
+    assert _leer(httpd, data) is None
+
+
+def _conversar(httpd, data):
+    # Manda `data` a un servidor real, cierra la escritura y devuelve lo recibido
+    errores = []
+
+    async def correr():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: errores.append(ctx))
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        srv_ = httpd.Server(port=port)
+
+        async def hola(req, resp):
+            await resp.send(200, "text/plain", "hola")
+
+        srv_.route("/hola", hola)
+        srv = await srv_.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        writer.write_eof()
+        out = await reader.read()
+        writer.close()
+        while srv_.clients:
+            await asyncio.sleep(0.01)
+        srv.close()
+        await srv.wait_closed()
+        return out
+
+    out = asyncio.run(correr())
+    assert not errores
+    return out
+
+
+def test_cabecera_no_utf8_da_400(httpd):
+    out = _conversar(httpd, b"GET /hola HTTP/1.1\r\nX-A: \xff\r\n\r\n")
+    assert out.startswith(b"HTTP/1.1 400")
+
+
+def test_cuerpo_cortado_cierra(httpd):
+    out = _conversar(httpd, b"POST /hola HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc")
+    assert out == b""
+    assert _conversar(httpd, b"GET /hola HTTP/1.1\r\n\r\n").endswith(b"hola")
@@ -0,0 +1,116 @@
+import asyncio
+import random
+import struct
+
+import pytest
+
+T0 = 700000000             # segundos desde 2000 del primer fix
+DESFASE = T0 - 1000        # gps_t - timestamp_local del arranque simulado
+
+
+@pytest.fixture
+def logindex(placa):
+    return placa.load("logindex")
+
+
+def _abrir(store, logindex):
+    rs = store.RecordStore("/data", seg_records=64, max_age_s=0)
+    epocas = logindex.Epochs("/data/epochs.bin", rs.end_cursor())
+    return rs, epocas, logindex.LogIndex(rs, epocas)
+
+
+def _llenar(store, rs, n=300, seed=3):
+    # Varios collares, fixes atrasados del backlog y algunos sin hora GPS
+    rnd = random.Random(seed)
+    wb = store.WriteBuffer(rs, max_records=16)
+    for i in range(n):
+        t_local = 1000 + i * 10
+        t = T0 + i * 10 - (rnd.randrange(600) if rnd.random() < 0.2 else 0)
+        rec = {"kind": 1, "id": rnd.randrange(1, 6), "seq": i, "lat": 19.2, "lon": -103.7,
+               "timestamp_local": t_local}
+        if i < 5 or rnd.random() > 0.1:
+            rec["ts"] = t + store.frames.EPOCH_2000
+        wb.add(rec)
+    return wb
+
+
+def _todos(store, wb):
+    buf = bytearray(store.REC_SIZE)
+    out = []
+    for c in range(wb.store.first_cursor(), wb.end_cursor()):
+        wb.read(c, buf)
+        t_local = struct.unpack_from("<I", buf, 0)[0]
+        out.append((c, buf[8], store.gps_t_of(buf) or t_local + DESFASE))
+    return out
+
+
+def _consultar(indice, wb, id_=None, f_from=0, f_to=0xFFFFFFFF, since=0, limit=1000):
+    got = []
+
+    async def emit(cursor, buf, off, t):
+        got.append((cursor, buf[off + 8], t))
+
+    nxt, more = asyncio.run(indice.query(wb.read, wb.end_cursor, emit, id_, f_from, f_to,
+                                         since, limit))
+    return got, nxt, more
+
+
+VENTANAS = [(None, 0, 0xFFFFFFFF), (3, 0, 0xFFFFFFFF), (None, T0 + 500, T0 + 900),
+            (2, T0 + 1000, T0 + 2500), (5, T0 - 1000, T0), (4, T0 + 99999, T0 + 999999)]
+
+
+@pytest.mark.parametrize("id_, f_from, f_to", VENTANAS)
+def test_igual_a_recorrer_todo(store, logindex, id_, f_from, f_to):
+    rs, _, indice = _abrir(store, logindex)
+    wb = _llenar(store, rs)
+    assert wb.pending()                 # una parte sigue en RAM
+    esperado = [r for r in _todos(store, wb)
+                if (id_ is None or r[1] == id_) and f_from <= r[2] <= f_to]
+    got, nxt, more = _consultar(indice, wb, id_, f_from, f_to)
+    assert got == esperado and not more
+    if esperado and (id_ is not None or f_from):
+        assert indice.read_records < len(_todos(store, wb))
+
+
+def test_paginas(store, logindex):
+    rs, _, indice = _abrir(store, logindex)
+    wb = _llenar(store, rs)
+    todo = _consultar(indice, wb, 2)[0]
+    paginas = []
+    since, more = 0, True
+    while more:
+        got, since, more = _consultar(indice, wb, 2, since=since, limit=7)
+        paginas.extend(got)
+    assert paginas == todo
+
+
+def test_reabrir_y_rehacer_idx(placa, store, logindex):
+    rs, _, indice = _abrir(store, logindex)
+    wb = _llenar(store, rs)
+    wb.flush()
+    antes = [_consultar(indice, wb, *v)[0] for v in VENTANAS]
+
+    rs, _, indice = _abrir(store, logindex)
+    wb = store.WriteBuffer(rs)
+    assert indice.rebuilt == 0
+    assert [_consultar(indice, wb, *v)[0] for v in VENTANAS] == antes
+
+    for name in placa.os.listdir("/data"):
+        if name.endswith(".idx"):
+            placa.os.remove("/data/" + name)
+    rs, _, indice = _abrir(store, logindex)
+    wb = store.WriteBuffer(rs)
+    assert indice.rebuilt == len(rs.segments) - 1
+    assert [_consultar(indice, wb, *v)[0] for v in VENTANAS] == antes
+
+
+def test_retencion(store, logindex):
+    rs = store.RecordStore("/data", seg_records=64, max_bytes=3 * (store.HDR_SIZE + 64 * 32),
+                           max_age_s=0)
+    epocas = logindex.Epochs("/data/epochs.bin", rs.end_cursor())
+    indice = logindex.LogIndex(rs, epocas)
+    wb = _llenar(store, rs)
+    wb.flush()
+    assert rs.evicted
+    got = _consultar(indice, wb)[0]
+    assert got[0][0] == rs.first_cursor() and len(got) == rs.count()
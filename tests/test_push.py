@@ -0,0 +1,64 @@
+import asyncio
+
+from tools.host import handheld as cargar
+
+
+class _Resp:
+    def __init__(self):
+        self.ids = []
+
+    async def start(self, *args, **kw):
+        pass
+
+    async def write(self, data):
+        for line in bytes(data).decode().split("\n"):
+            if line.startswith("id: "):
+                self.ids.append(int(line[4:]))
+
+
+def _guardar(hh, seqs):
+    frames = hh.board.modules["frames"]
+    for seq in seqs:
+        pkt = frames.encode_fix(1, seq, 19.249, -103.698, sats=8, hdop=1, bat=80,
+                                gps_t=700000000 + seq)
+        hh.guardar_registro(frames.fix_fields(pkt), -100, 5.0, 9)
+
+
+def _suscribir(hh, last_id, nuevos=()):
+    # Reconecta con Last-Event-ID, espera el atraso y guarda `nuevos` en vivo
+    req = hh.board.modules["httpd"].Request("GET", "/events", "HTTP/1.1")
+    req.headers["last-event-id"] = str(last_id)
+    resp = _Resp()
+
+    async def correr():
+        task = asyncio.create_task(hh.hub.serve(req, resp))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        _guardar(hh, nuevos)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(correr())
+    return resp.ids
+
+
+def test_reanuda_desde_el_atraso(tmp_path):
+    hh = cargar(str(tmp_path / "hh"))
+    _guardar(hh, range(20))
+    assert _suscribir(hh, 9, [20]) == list(range(10, 21))
+
+
+def test_reanuda_tras_reinicio(tmp_path):
+    root = str(tmp_path / "hh")
+    hh = cargar(root)
+    _guardar(hh, range(20))               # 16 en flash, 4 en el buffer en RAM
+    assert hh.escritor.pending() == 4
+    # Reinicio sin journal (corte total): el navegador vio hasta el id 19,
+    # que ya no existe. No se le repite el almacén; sigue lo nuevo.
+    hh = cargar(root)
+    assert hh.escritor.end_cursor() == 16
+    assert _suscribir(hh, 19, [30, 31]) == [16, 17]
+    # /data.json sigue volviendo al principio con un cursor pasado el final
+    buf = bytearray(4 * 32)
+    assert hh.escritor.read(40, buf)[0] == 4
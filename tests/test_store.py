@@ -0,0 +1,93 @@
+import pytest
+
+
+def _fix(frames, seq=1, gps_t=700000000):
+    pkt = frames.encode_fix(3, seq, 19.2491234, -103.6981234, spd_kn=0.7, crs=180, sats=7,
+                            hdop=1.5, bat=64, gps_t=gps_t)
+    return pkt, frames.decode_fix(pkt)
+
+
+def _registro(store, rec):
+    buf = bytearray(store.REC_SIZE)
+    store.pack_record(buf, 0, rec)
+    assert store.record_valid(buf)
+    return buf
+
+
+def test_fix_ida_y_vuelta(frames, store):
+    _, f = _fix(frames)
+    f.update(rssi=-112, snr=-7.25, sf=10, timestamp_local=12345)
+    r = store.unpack_record(_registro(store, f))
+    for k in ("id", "seq", "sats", "hdop", "spd_kn", "crs", "bat_v", "ts", "date", "gps_time",
+              "rssi", "snr", "sf", "timestamp_local"):
+        assert r[k] == f[k], k
+    assert r["lat"] == pytest.approx(f["lat"], abs=1e-7)
+    assert r["lon"] == pytest.approx(f["lon"], abs=1e-7)
+    assert r["alt"] is None
+
+
+def test_pack_fix_igual_a_pack_record(frames, store):
+    pkt, f = _fix(frames, gps_t=0)
+    f.update(rssi=-90, snr=3.5, sf=9, timestamp_local=77)
+    a = _registro(store, f)
+    b = bytearray(store.REC_SIZE)
+    store.pack_fix(b, 0, frames.fix_fields(pkt), 77, -90, 3.5, 9)
+    assert a == b
+
+
+def test_checksum(store):
+    buf = _registro(store, {"id": 1, "lat": 19.2, "lon": -103.7})
+    buf[12] ^= 1
+    assert not store.record_valid(buf)
+
+
+@pytest.mark.parametrize("bat", [62, 100, 3.9])
+def test_bateria_heredada(store, bat):
+    # El JSON heredado manda bat_v en %; solo un float <= 5 son volts
+    buf = _registro(store, {"id": 1, "lat": 19.2, "lon": -103.7, "bat_v": bat})
+    assert buf[store.FLAGS_OFF] & store.REC_LEGACY
+    assert bool(buf[store.FLAGS_OFF] & store.REC_VOLTS) == isinstance(bat, float)
+    assert store.unpack_record(buf)["bat_v"] == bat
+
+
+def test_heredado_con_fecha(frames, store):
+    buf = _registro(store, {"id": 2, "lat": 19.2, "lon": -103.7,
+                            "date": "170324", "gps_time": "123456.00"})
+    t = frames.gps_to_t2000("170324", "123456")
+    assert store.gps_t_of(buf) == t
+    r = store.unpack_record(buf)
+    assert (r["date"], r["gps_time"], r["ts"]) == ("170324", "123456", t + frames.EPOCH_2000)
+
+
+def test_heredado_hora_sin_fecha(store):
+    # Solo hora del día: se conserva, pero no cuenta como hora GPS
+    buf = _registro(store, {"id": 2, "lat": 19.2, "lon": -103.7, "gps_time": "123456"})
+    assert buf[store.FLAGS_OFF] & store.REC_TOD
+    assert store.gps_t_of(buf) == 0
+    r = store.unpack_record(buf)
+    assert (r["date"], r["gps_time"], r["ts"]) == (None, "123456", None)
+
+
+def test_sin_posicion(store):
+    r = store.unpack_record(_registro(store, {"id": 4}))
+    assert (r["lat"], r["lon"], r["alt"], r["bat_v"]) == (None, None, None, None)
+
+
+def test_almacen_reabre_y_retiene(store):
+    rs = store.RecordStore("/data", seg_records=8, max_bytes=1 << 20, max_age_s=0)
+    for i in range(20):
+        assert rs.append({"id": 1, "seq": i, "lat": 19.2, "lon": -103.7}) == i
+    buf = bytearray(32 * store.REC_SIZE)
+    n, nxt = rs.read(0, buf)
+    assert (n, nxt) == (20, 20)
+    assert [store.unpack_record(buf, i * store.REC_SIZE)["seq"] for i in range(n)] == list(range(20))
+
+    rs = store.RecordStore("/data", seg_records=8, max_bytes=1 << 20, max_age_s=0)
+    assert (rs.first_cursor(), rs.end_cursor(), len(rs.segments)) == (0, 20, 3)
+
+    # Por tamaño se borran los segmentos viejos, nunca el activo
+    rs = store.RecordStore("/data", seg_records=8, max_bytes=2 * (store.HDR_SIZE + 8 * 32),
+                           max_age_s=0)
+    assert rs.first_cursor() == 8 and rs.evicted == 1
+    n, nxt = rs.read(0, buf)
+    assert (n, nxt) == (12, 20)
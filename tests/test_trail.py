@@ -0,0 +1,85 @@
+import asyncio
+import math
+from array import array
+
+import pytest
+
+
+@pytest.fixture
+def trail(placa):
+    return placa.load("trail")
+
+
+def test_polyline_google(trail):
+    # Ejemplo de la documentación del algoritmo
+    lats = [385000000, 407000000, 432520000]
+    lons = [-1202000000, -1209500000, -1264530000]
+    assert trail.encode_polyline(lats, lons, [0, 1, 2]) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert trail.encode_polyline(lats, lons, []) == ""
+
+
+def _dp(trail, xs, ys, max_points, tol_m=0):
+    return asyncio.run(trail.douglas_peucker(xs, ys, max_points, tol_m))
+
+
+def test_dp_conserva_esquinas(trail):
+    # Una L de 100 + 100 puntos con un ruido de 1 cm
+    xs = array("f", [float(i) for i in range(100)] + [99.0] * 100)
+    ys = array("f", [0.01 * (i % 2) for i in range(100)] + [float(i + 1) for i in range(100)])
+    assert _dp(trail, xs, ys, 50, tol_m=0.5) == [0, 99, 199]
+    assert _dp(trail, xs, ys, 2) == [0, 199]
+    assert _dp(trail, xs[:5], ys[:5], 10) == [0, 1, 2, 3, 4]
+    assert len(_dp(trail, xs, ys, 50)) == 50
+
+
+def test_dp_cede_el_loop(trail, monkeypatch):
+    cesiones = []
+    dormir = trail.asyncio.sleep_ms
+
+    async def sleep_ms(ms):
+        cesiones.append(ms)
+        await dormir(ms)
+
+    monkeypatch.setattr(trail.asyncio, "sleep_ms", sleep_ms)
+    xs = array("f", (math.cos(i / 7) * i for i in range(2000)))
+    ys = array("f", (math.sin(i / 7) * i for i in range(2000)))
+    assert len(_dp(trail, xs, ys, 500)) == 500
+    assert len(cesiones) >= 499 // trail.DP_YIELD
+
+
+def test_por_franjas(trail):
+    ts = list(range(0, 1000, 3))
+    keep = trail.por_franjas(ts, 12)
+    assert keep[0] == 0 and keep[-1] == len(ts) - 1
+    assert len(keep) <= 12 and keep == sorted(set(keep))
+
+
+def test_puntos_decima_en_flujo(trail):
+    p = trail.Puntos(8)
+    for i in range(100):
+        p.add(i, i, -i)
+    assert p.seen == 100 and len(p) < 8
+    assert list(p.t) == sorted(p.t) and list(p.lat) == [-x for x in p.lon]
+
+
+def _almacen(store, puntos, id_=1):
+    rs = store.RecordStore("/data", seg_records=64, max_age_s=0)
+    for i, (lat, lon) in enumerate(puntos):
+        rs.append({"id": id_, "seq": i, "lat": lat, "lon": lon, "ts": 1700000000 + i * 30})
+    rs.append({"id": id_ + 1, "seq": 0, "lat": 0.0, "lon": 0.0, "ts": 1700000000})
+    rs.append({"id": id_, "seq": 999, "lat": 0.0, "lon": 0.0})        # sin hora GPS
+    return rs
+
+
+def test_consultar_lejos_del_origen(trail, store):
+    # Recta norte-sur con un desvío de 3 m a mitad de camino: lejos de lat/lon
+    # 0 tiene que verse igual (la proyección es relativa al primer punto)
+    puntos = [(19.249 + i * 1e-5, -103.698) for i in range(200)]
+    puntos[100] = (puntos[100][0], -103.698 + 3 / (111320 * math.cos(math.radians(19.25))))
+    rs = _almacen(store, puntos)
+    out = asyncio.run(trail.consultar(rs.read, rs.end_cursor, 1, max_points=100, tol_m=1))
+    assert out["matched"] == 200 and out["points"] == 5
+    assert out["t_first"] == 1700000000 and out["t_last"] == 1700000000 + 199 * 30
+    out = asyncio.run(trail.consultar(rs.read, rs.end_cursor, 1, 1700000000 + 50 * 30,
+                                      1700000000 + 60 * 30, mode="bucket"))
+    assert out["matched"] == out["points"] == 11
@@ -0,0 +1,247 @@
+# bench.py — Micro-benchmarks de los dos firmwares corriendo en la PC
+#
+#   python tools/bench.py [--quick] [--json salida.json] [--compare base.json]
+#
+# Usa el harness de tools/host (radio, UART, SPI y flash simulados, reloj
+# virtual), así que los tiempos son de CPU de la PC: sirven para comparar
+# un cambio contra otro, no para saber cuánto tarda el RP2040 o el ESP32.
+# Los conteos (transacciones SPI, bytes) sí son los del firmware real.
+#
+# - nmea:   throughput del lector NMEA del collar (sentencias/s)
+# - spi:    transacciones SPI por paquete (TX del collar, ventana RX,
+#           RX por IRQ del handheld, downlink)
+# - disk:   del RxDone al registro en cola (con el downlink) y flush a flash
+# - http:   tiempo de respuesta del servidor del handheld (keep-alive)
+#
+# --json guarda los resultados; --compare muestra la diferencia contra una
+# corrida anterior guardada con --json.
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from tools.host import Board, CLOCK, collar, gps_sentences, handheld  # noqa: E402
+
+
+def median_ms(samples):
+    return round(statistics.median(samples) * 1000, 4)
+
+
+# ------------------ NMEA ------------------
+def bench_nmea(tmp, n):
+    b = Board("nmea", [os.path.join(REPO, "collar"), os.path.join(REPO, "common")],
+              os.path.join(tmp, "nmea"))
+    nmea = b.load("nmea")
+    t = 1700000000
+    data = b"".join(gps_sentences(19.249 + i * 1e-5, -103.698, t + i) for i in range(n // 2))
+    uart = b.overrides["machine"].UART(1, rxbuf=len(data))
+    rd = nmea.NmeaReader(uart)
+    uart.feed(data)
+    t0 = time.perf_counter()
+    rd.poll()
+    dt = time.perf_counter() - t0
+    assert rd.bad_checksum == 0 and rd.sentences == n, (rd.sentences, rd.bad_checksum)
+    return {
+        "sentences_per_s": round(n / dt),
+        "bytes_per_s": round(len(data) / dt),
+        "us_per_sentence": round(dt / n * 1e6, 2),
+    }
+
+
+# ------------------ SPI ------------------
+def bench_spi(tmp):
+    c = collar(os.path.join(tmp, "spi_c"))
+    hh = handheld(os.path.join(tmp, "spi_h"))
+    frames = c.board.modules["frames"]
+    pl = frames.encode_fix(1, 1, 19.249, -103.698, spd_kn=0.4, crs=90, sats=8, hdop=0.9,
+                           bat=80, gps_t=1700000000)
+    out = {}
+
+    n0 = c.radio.transactions
+    c.lora.send(pl)
+    out["collar_send"] = c.radio.transactions - n0
+
+    # Ventana RX completa sin downlink: el peor caso del sondeo
+    n0 = c.radio.transactions
+    c.lora.rx_window(c.link.rx_window_ms())
+    out["collar_rx_window"] = c.radio.transactions - n0
+    out["collar_rx_window_ms"] = round(c.link.rx_window_ms())
+    c.lora.sleep()
+
+    n0 = hh.radio.transactions
+    hh.radio.deliver(pl)
+    pkt = hh.lora.recv_nowait()[0]
+    assert pkt == pl
+    out["handheld_irq_rx"] = hh.radio.transactions - n0
+
+    dl = frames.encode_downlink(1, 1, [])
+    n0 = hh.radio.transactions
+    asyncio.run(hh.enviar_downlink(dl, hh.lora.sf))
+    out["handheld_downlink"] = hh.radio.transactions - n0
+    return out
+
+
+# ------------------ Paquete a flash ------------------
+def bench_disk(tmp, n):
+    hh = handheld(os.path.join(tmp, "disk"))
+    frames = hh.board.modules["frames"]
+    loop = asyncio.new_event_loop()
+    rx = []
+    for seq in range(n):
+        pl = frames.encode_fix(1, seq, 19.249 + seq * 1e-5, -103.698, spd_kn=0.4, crs=90,
+                               sats=8, hdop=0.9, bat=80, gps_t=1700000000 + seq)
+        CLOCK.advance(1000)
+        t0 = time.perf_counter()
+        hh.radio.deliver(pl)
+        loop.run_until_complete(hh.atender_paquetes())
+        rx.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    hh.escritor.flush()
+    flush = time.perf_counter() - t0
+    loop.close()
+    assert hh.registros.count() >= n, hh.registros.count()
+    return hh, {
+        "rx_to_queue_ms": median_ms(rx),
+        "flush_ms_per_record": round(flush / n * 1000, 4),
+    }
+
+
+# ------------------ HTTP ------------------
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+async def http_get(reader, writer, path):
+    writer.write("GET {} HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: gzip\r\n\r\n"
+                 .format(path).encode())
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = None
+    chunked = False
+    keep = True
+    for line in head.split(b"\r\n")[1:]:
+        k, _, v = line.partition(b":")
+        k = k.strip().lower()
+        if k == b"content-length":
+            length = int(v)
+        elif k == b"transfer-encoding":
+            chunked = v.strip().lower() == b"chunked"
+        elif k == b"connection":
+            keep = v.strip().lower() == b"keep-alive"
+    if chunked:
+        parts = []
+        while True:
+            n = int((await reader.readline()).strip(), 16)
+            if not n:
+                await reader.readline()
+                break
+            parts.append(await reader.readexactly(n))
+            await reader.readexactly(2)
+        return status, b"".join(parts), keep
+    body = await (reader.readexactly(length) if length is not None else reader.read())
+    return status, body, keep and length is not None
+
+
+async def _bench_http(hh, paths, n):
+    hh.server.port = free_port()
+    srv = await hh.server.start()
+    out = {}
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", hh.server.port)
+        for path in paths:
+            samples = []
+            size = 0
+            for _ in range(n):
+                t0 = time.perf_counter()
+                status, body, keep = await http_get(reader, writer, path)
+                samples.append(time.perf_counter() - t0)
+                assert status in (200, 304), (path, status)
+                size = len(body)
+                if not keep:
+                    writer.close()
+                    reader, writer = await asyncio.open_connection("127.0.0.1", hh.server.port)
+            out[path] = {"ms": median_ms(samples), "bytes": size}
+        writer.close()
+        await writer.wait_closed()
+        while hh.server.clients:            # que el servidor vea el cierre
+            await asyncio.sleep(0.01)
+    finally:
+        srv.close()
+        await srv.wait_closed()
+    return out
+
+
+HTTP_PATHS = ("/latest", "/data.json", "/stats.json", "/metrics", "/trail?id=1", "/export.csv",
+              "/query?id=1", "/index.html")
+
+
+def bench_http(hh, n):
+    return asyncio.run(_bench_http(hh, HTTP_PATHS, n))
+
+
+# ------------------ Reporte ------------------
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = prefix + k
+        if isinstance(v, dict):
+            out.update(flatten(v, key + "."))
+        else:
+            out[key] = v
+    return out
+
+
+def report(results, base=None):
+    flat = flatten(results)
+    old = flatten(base) if base else {}
+    width = max(len(k) for k in flat)
+    for k, v in flat.items():
+        line = "{:<{}}  {:>12}".format(k, width, v)
+        b = old.get(k)
+        if isinstance(b, (int, float)) and b and isinstance(v, (int, float)):
+            line += "   {:+.1f} %".format((v - b) / b * 100)
+        print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Micro-benchmarks de los firmwares en la PC")
+    ap.add_argument("--quick", action="store_true", help="menos repeticiones")
+    ap.add_argument("--json", help="guardar resultados en este archivo")
+    ap.add_argument("--compare", help="comparar contra un --json anterior")
+    args = ap.parse_args()
+    reps = 20 if args.quick else 200
+
+    tmp = tempfile.mkdtemp(prefix="bench_")
+    try:
+        results = {"nmea": bench_nmea(tmp, 50 * reps), "spi": bench_spi(tmp)}
+        hh, results["disk"] = bench_disk(tmp, reps)
+        results["http"] = bench_http(hh, reps)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    base = None
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+    report(results, base)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
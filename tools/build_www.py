@@ -0,0 +1,100 @@
+# build_www.py — Prepara la carpeta /www del handheld (se corre en la PC)
+#
+#   python tools/build_www.py [origen] [destino]
+#   (por defecto handheald/www -> build/www)
+#
+# - Copia los archivos de origen a destino.
+# - Agrega ?v=<hash> a los css/js que referencia index.html, para que el
+#   navegador pueda guardarlos sin revalidar (Cache-Control immutable).
+# - Genera X.gz cuando gzip ahorra al menos 10 % (el png no).
+# - Escribe manifest.json con ETag, tamaños y política de caché; httpd.py lo
+#   carga al arrancar.
+#
+# Después se copia el contenido de destino a /www en el ESP32.
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+
+GZIP_MIN_SAVING = 0.10
+CACHE_HTML = "no-cache"                                  # siempre revalida (304)
+CACHE_VERSIONED = "public, max-age=31536000, immutable"  # url con ?v=hash
+CACHE_DEFAULT = "public, max-age=86400"
+
+REF_RE = re.compile(r'((?:href|src)=")([^"?#:]+)(")')
+
+
+def etag_of(data):
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def version_refs(html, files):
+    versioned = set()
+
+    def repl(m):
+        name = m.group(2)
+        if name not in files:
+            return m.group(0)
+        versioned.add(name)
+        return "{}{}?v={}{}".format(m.group(1), name, files[name][:8], m.group(3))
+
+    return REF_RE.sub(repl, html), versioned
+
+
+def build(src, dst):
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    os.makedirs(dst)
+
+    files = {}
+    for name in sorted(os.listdir(src)):
+        path = os.path.join(src, name)
+        if os.path.isfile(path) and not name.endswith(".gz") and name != "manifest.json":
+            with open(path, "rb") as f:
+                files[name] = f.read()
+
+    hashes = {name: etag_of(data) for name, data in files.items()}
+    versioned = set()
+    if "index.html" in files:
+        html, versioned = version_refs(files["index.html"].decode("utf-8"), hashes)
+        files["index.html"] = html.encode("utf-8")
+        hashes["index.html"] = etag_of(files["index.html"])
+
+    manifest = {}
+    total = sent = 0
+    for name, data in files.items():
+        with open(os.path.join(dst, name), "wb") as f:
+            f.write(data)
+        entry = {"etag": hashes[name], "size": len(data)}
+        if name.endswith(".html"):
+            entry["cache"] = CACHE_HTML
+        elif name in versioned:
+            entry["cache"] = CACHE_VERSIONED
+        else:
+            entry["cache"] = CACHE_DEFAULT
+
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) <= len(data) * (1 - GZIP_MIN_SAVING):
+            with open(os.path.join(dst, name + ".gz"), "wb") as f:
+                f.write(gz)
+            entry["gz"] = len(gz)
+        manifest["/" + name] = entry
+        total += len(data)
+        sent += entry.get("gz", len(data))
+        print("{:<14} {:>8} B  gzip {:>8}  {}".format(
+            name, len(data), entry.get("gz", "-"), entry["cache"]))
+
+    with open(os.path.join(dst, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    print("Total {} B -> {} B por visita en frío".format(total, sent))
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    root = os.path.dirname(here)
+    src = sys.argv[1] if len(sys.argv) > 1 else os.path.join(root, "handheald", "www")
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.join(root, "build", "www")
+    build(src, dst)
@@ -0,0 +1,104 @@
+# tools/host — Harness para correr los firmwares en la PC (CPython 3.8+)
+#
+#   from tools.host import Air, GpsSim, HandheldLoop, collar, handheld
+#   air = Air()
+#   hh = handheld("/tmp/hh", air)            # módulo main del handheld
+#   HandheldLoop(hh)                          # lo hace avanzar con el reloj
+#   c = collar("/tmp/c", air)                 # módulo main del collar
+#   GpsSim(c.gps, 19.249, -103.698)
+#   for _ in range(100):
+#       c.paso()
+#
+# Cada placa tiene su propio machine/os/flash (ver board.py); el reloj y el
+# aire son compartidos (clock.py, sx127x.py). Nada de esto se copia a las
+# placas.
+import asyncio
+import os
+
+from .board import Board
+from .clock import CLOCK
+from .gps import GpsSim, gps_sentences, nmea
+from .sx127x import Air, SimSX127x, airtime_ms
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(HERE))
+
+# Cableado de cada placa (mismos pines que collar/main.py y handheald/main.py)
+COLLAR_PINS = {"cs": 13, "dio0": 15}
+HANDHELD_PINS = {"cs": 7, "dio0": 3}
+COLLAR_VBAT_ADC = 26
+
+
+def collar(root, air=None, quiet=True, bat_mv=3900):
+    b = Board("collar", [os.path.join(REPO, "collar"), os.path.join(REPO, "common")],
+              root, quiet=quiet)
+    radio = b.attach_sx127x(COLLAR_PINS["cs"], COLLAR_PINS["dio0"], air)
+    # Divisor 1:2 y Vref 3.3 V como en power.Battery
+    b.adc[COLLAR_VBAT_ADC] = int(bat_mv / 2 / 3300 * 65535)
+    mod = b.load("main")
+    mod.board = b
+    mod.radio = radio
+    return mod
+
+
+def handheld(root, air=None, quiet=True, www=None):
+    if www is None:
+        built = os.path.join(REPO, "build", "www")
+        www = built if os.path.isdir(built) else os.path.join(REPO, "handheald", "www")
+    b = Board("handheld", [os.path.join(REPO, "handheald"), os.path.join(REPO, "common")],
+              root, files={"/www": www}, quiet=quiet)
+    radio = b.attach_sx127x(HANDHELD_PINS["cs"], HANDHELD_PINS["dio0"], air)
+    mod = b.load("main")
+    mod.board = b
+    mod.radio = radio
+    return mod
+
+
+class HandheldLoop:
+    """Lo mismo que radio_task del handheld, pero paso a paso desde el reloj.
+
+    En cada paso del reloj corre una vuelta del event loop del handheld: los
+    paquetes del anillo se procesan apenas llegan y el downlink sale mientras
+    la otra placa (el collar) sigue avanzando y abre su ventana RX. Sin
+    paquetes, resintoniza cuando vence la espera de plan_escucha(). No se
+    puede usar con otro event loop corriendo en el mismo hilo.
+    """
+
+    def __init__(self, hh):
+        self.hh = hh
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.retune_at = None
+        hh.board.stepped = True
+        CLOCK.hooks.append(self.step)
+
+    def close(self):
+        if self.step in CLOCK.hooks:
+            CLOCK.hooks.remove(self.step)
+        self.hh.board.stepped = False
+        self.loop.close()
+
+    def _run_once(self):
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def step(self):
+        hh = self.hh
+        if self.task is None:
+            if hh.lora.pending():
+                self.task = self.loop.create_task(hh.atender_paquetes())
+                self.retune_at = None
+            else:
+                now = CLOCK.now_ms()
+                target, hopping, wait_ms = hh.plan_escucha()
+                if self.retune_at is None:
+                    self.retune_at = now + wait_ms
+                elif now >= self.retune_at:
+                    hh.resintonizar(target, hopping)
+                    self.retune_at = None
+        if self.task is not None:
+            self._run_once()
+            if self.task.done():
+                task, self.task = self.task, None
+                task.result()           # que se vean las excepciones del firmware
+        hh.escritor.poll()
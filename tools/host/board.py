@@ -0,0 +1,287 @@
+# board.py — Una placa simulada: módulos, pines, SPI, UART y flash propios
+#
+# Board importa el firmware desde sus carpetas (p. ej. collar + common) con
+# un __import__ propio en lugar de sys.modules, así que el collar y el
+# handheld pueden convivir en el mismo proceso aunque los dos tengan
+# main.py, adr.py y tdma.py. Para los módulos de la placa:
+#
+#   machine, network   versiones simuladas (machine.py, network.py)
+#   time               ticks_* / sleep_ms sobre el reloj virtual (clock.py)
+#   asyncio            el de la PC + sleep_ms y ThreadSafeFlag; sleep_ms
+#                      mueve el reloj, o con `stepped` espera a que otro lo
+#                      mueva (la placa corre dentro de un hook)
+#   os, open()         rutas absolutas ("/data", "/backlog.bin") dentro de
+#                      `root`, una carpeta de la PC que hace de flash
+#   gc                 collect() real; mem_alloc/mem_free desde tracemalloc
+#   deflate            DeflateIO (solo comprimir) sobre zlib
+#
+# main.py se importa como "main" (no "__main__"), así que no arranca su
+# loop: el harness llama a paso() / atender_paquetes() cuando quiere.
+import asyncio
+import builtins
+import gc as _gc
+import os as _os
+import shutil
+import time as _time
+import tracemalloc
+import types
+import zlib
+
+from . import clock, machine, network
+from .clock import CLOCK
+from .sx127x import SimSX127x
+
+HEAP_BYTES = 192 * 1024        # para mem_free(): ~ lo libre en un ESP32-C3
+
+
+class ThreadSafeFlag:
+    """asyncio.ThreadSafeFlag de MicroPython: set() desde un IRQ."""
+
+    def __init__(self):
+        self._ev = asyncio.Event()
+
+    def set(self):
+        self._ev.set()
+
+    def clear(self):
+        self._ev.clear()
+
+    async def wait(self):
+        await self._ev.wait()
+        self._ev.clear()
+
+
+def _time_module():
+    mod = types.ModuleType("time")
+    for name in ("ticks_ms", "ticks_us", "ticks_add", "ticks_diff", "sleep_ms", "sleep_us",
+                 "sleep", "time"):
+        setattr(mod, name, getattr(clock, name))
+    mod.localtime = _time.localtime
+    mod.gmtime = _time.gmtime
+    mod.mktime = _time.mktime
+    mod.time_ns = lambda: int(clock.time() * 1e9)
+    mod.ticks_cpu = clock.ticks_us
+    return mod
+
+
+def _asyncio_module(board):
+    mod = types.ModuleType("asyncio")
+    for name in dir(asyncio):
+        if not name.startswith("__"):
+            setattr(mod, name, getattr(asyncio, name))
+
+    async def sleep_ms(ms):
+        if board.stepped:
+            # Otra placa mueve el reloj (HandheldLoop): se espera cediendo el loop
+            end = CLOCK.now_us() + int(ms * 1000)
+            while CLOCK.now_us() < end:
+                await asyncio.sleep(0)
+        else:
+            CLOCK.advance(ms)
+            await asyncio.sleep(0)
+
+    mod.sleep_ms = sleep_ms
+    mod.ThreadSafeFlag = ThreadSafeFlag
+    return mod
+
+
+def _gc_module():
+    mod = types.ModuleType("gc")
+    mod.collect = _gc.collect
+    mod.enable = _gc.enable
+    mod.disable = _gc.disable
+    mod.isenabled = _gc.isenabled
+
+    def mem_alloc():
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    mod.mem_alloc = mem_alloc
+    mod.mem_free = lambda: max(0, HEAP_BYTES - mem_alloc())
+    mod.threshold = lambda n=None: -1 if n is None else None
+    return mod
+
+
+def _deflate_module():
+    mod = types.ModuleType("deflate")
+    mod.AUTO, mod.RAW, mod.ZLIB, mod.GZIP = 0, 1, 2, 3
+
+    class DeflateIO:
+        def __init__(self, stream, format=0, wbits=0, close=False):
+            if format == mod.AUTO:
+                raise ValueError("deflate: AUTO solo sirve para descomprimir")
+            wb = max(9, wbits or 8)             # zlib no comprime con ventana < 512 B
+            wb = {mod.RAW: -wb, mod.ZLIB: wb, mod.GZIP: 16 + wb}[format]
+            self.stream = stream
+            self.close_stream = close
+            self.z = zlib.compressobj(wbits=wb)
+
+        def write(self, data):
+            out = self.z.compress(bytes(data))
+            if out:
+                self.stream.write(out)
+            return len(data)
+
+        def close(self):
+            self.stream.write(self.z.flush())
+            if self.close_stream:
+                self.stream.close()
+
+    mod.DeflateIO = DeflateIO
+    return mod
+
+
+class FlashOs:
+    """`os` de la placa: rutas absolutas dentro de `root`."""
+
+    def __init__(self, root):
+        self.root = root
+        self.sep = "/"
+        self.urandom = _os.urandom
+
+    def path(self, p):
+        p = str(p)
+        return _os.path.join(self.root, p.lstrip("/")) if p.startswith("/") else \
+            _os.path.join(self.root, p)
+
+    def stat(self, p):
+        return _os.stat(self.path(p))
+
+    def listdir(self, p="/"):
+        return _os.listdir(self.path(p))
+
+    def ilistdir(self, p="/"):
+        for name in self.listdir(p):
+            full = self.path(p.rstrip("/") + "/" + name)
+            yield (name, 0x4000 if _os.path.isdir(full) else 0x8000, 0)
+
+    def mkdir(self, p):
+        _os.mkdir(self.path(p))
+
+    def rmdir(self, p):
+        _os.rmdir(self.path(p))
+
+    def remove(self, p):
+        _os.remove(self.path(p))
+
+    def rename(self, a, b):
+        _os.replace(self.path(a), self.path(b))
+
+    def statvfs(self, p="/"):
+        st = _os.statvfs(self.path(p))
+        return (st.f_bsize, st.f_frsize, st.f_blocks, st.f_bfree, st.f_bavail,
+                st.f_files, st.f_ffree, st.f_favail, st.f_flag, st.f_namemax)
+
+    def sync(self):
+        pass
+
+    def uname(self):
+        return ("host", "host", "1.0", "host", "cpython")
+
+    def open(self, p, mode="r", *args, **kw):
+        return builtins.open(self.path(p), mode, *args, **kw)
+
+
+class Board:
+    def __init__(self, name, dirs, root, files=None, quiet=True, cpu_hz=160000000):
+        self.name = name
+        self.dirs = [_os.path.abspath(d) for d in dirs]
+        self.root = root
+        self.quiet = quiet
+        self.cpu_hz = cpu_hz
+        _os.makedirs(root, exist_ok=True)
+        for dst, src in (files or {}).items():
+            dst = _os.path.join(root, dst.lstrip("/"))
+            if _os.path.isdir(src):
+                shutil.copytree(src, dst, dirs_exist_ok=True)
+            else:
+                shutil.copyfile(src, dst)
+
+        # Hardware
+        self.pins = {}
+        self.uarts = {}
+        self.adc = {}
+        self.rtc_mem = bytearray()
+        self.spi_devices = []
+        self.spi_stats = {"transactions": 0, "bytes": 0}
+        self.spi_fail = None        # callable(spi) -> True para simular un bus roto
+        self.lightsleeps = 0
+        self.log = []
+        self.stepped = False        # True: asyncio.sleep_ms espera al reloj en vez de moverlo
+
+        # Entorno de los módulos del firmware
+        self.os = FlashOs(root)
+        self.overrides = {
+            "machine": machine.make(self),
+            "network": network.make(self),
+            "time": _time_module(),
+            "asyncio": _asyncio_module(self),
+            "gc": _gc_module(),
+            "deflate": _deflate_module(),
+            "os": self.os,
+        }
+        self.modules = {}
+        self.builtins = dict(builtins.__dict__)
+        self.builtins["__import__"] = self._import
+        self.builtins["open"] = self.os.open
+        self.builtins["print"] = self._print
+
+    # ------------------ Hardware ------------------
+    def pin(self, id_):
+        st = self.pins.get(id_)
+        if st is None:
+            st = self.pins[id_] = machine.PinState(id_)
+        return st
+
+    def attach_sx127x(self, cs, dio0, air=None):
+        radio = SimSX127x(self, cs, dio0, air)
+        self.spi_devices.append(radio)
+        return radio
+
+    def spi_selected(self):
+        for dev in self.spi_devices:
+            if dev.selected():
+                return dev
+        return None
+
+    def uart(self, id_):
+        return self.uarts[id_]
+
+    # ------------------ Módulos ------------------
+    def _print(self, *args, **kw):
+        if self.quiet:
+            self.log.append(args)
+            if len(self.log) > 200:
+                del self.log[:100]
+        else:
+            builtins.print("[{}]".format(self.name), *args, **kw)
+
+    def _find(self, name):
+        for d in self.dirs:
+            path = _os.path.join(d, name + ".py")
+            if _os.path.isfile(path):
+                return path
+        return None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        mod = self.overrides.get(name) or self.modules.get(name)
+        if mod is not None:
+            return mod
+        path = self._find(name)
+        if path is None:
+            return builtins.__import__(name, globals, locals, fromlist, level)
+        mod = types.ModuleType(name)
+        mod.__file__ = path
+        mod.__dict__["__builtins__"] = self.builtins
+        self.modules[name] = mod
+        with builtins.open(path, encoding="utf-8") as f:
+            code = compile(f.read(), path, "exec")
+        try:
+            exec(code, mod.__dict__)
+        except BaseException:
+            del self.modules[name]
+            raise
+        return mod
+
+    def load(self, name="main"):
+        """Importa un módulo del firmware (y lo que éste importe)."""
+        return self._import(name)
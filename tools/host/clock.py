@@ -0,0 +1,83 @@
+# clock.py — Reloj virtual compartido por las placas simuladas
+#
+# ticks_ms() sigue al reloj monotónico de la PC más un desfase; sleep_ms,
+# lightsleep y asyncio.sleep_ms no bloquean, solo suman al desfase. Así un
+# frame TDMA de 60 s o un TX a SF12 pasan en microsegundos reales, y el
+# costo de CPU que se mide es solo el del firmware.
+#
+# El avance se hace en pasos de `step_ms` y después de cada paso corren los
+# hooks (el aire entrega paquetes, el harness hace avanzar otra placa). Un
+# hook no se vuelve a llamar mientras está corriendo: si la placa que
+# avanza dentro del hook duerme, el tiempo corre pero sin recursión.
+import time as _time
+
+TICKS_PERIOD = 1 << 30      # como en MicroPython: ticks_* dan la vuelta
+
+
+class Clock:
+    def __init__(self, step_ms=20):
+        self.offset_ms = 0.0
+        self.step_ms = step_ms
+        self.hooks = []
+        self._running = set()
+
+    def now_us(self):
+        return int(_time.monotonic() * 1000000 + self.offset_ms * 1000)
+
+    def now_ms(self):
+        return self.now_us() // 1000
+
+    def advance(self, ms):
+        while ms > 0:
+            d = ms if ms < self.step_ms else self.step_ms
+            self.offset_ms += d
+            ms -= d
+            self.run_hooks()
+
+    def run_hooks(self):
+        for hook in self.hooks:
+            key = id(hook)
+            if key in self._running:
+                continue
+            self._running.add(key)
+            try:
+                hook()
+            finally:
+                self._running.discard(key)
+
+
+CLOCK = Clock()
+
+
+# ------------------ API de time de MicroPython ------------------
+def ticks_ms():
+    return CLOCK.now_ms() & (TICKS_PERIOD - 1)
+
+
+def ticks_us():
+    return CLOCK.now_us() & (TICKS_PERIOD - 1)
+
+
+def ticks_add(t, delta):
+    return (t + delta) & (TICKS_PERIOD - 1)
+
+
+def ticks_diff(a, b):
+    d = (a - b) & (TICKS_PERIOD - 1)
+    return d - TICKS_PERIOD if d >= TICKS_PERIOD // 2 else d
+
+
+def sleep_ms(ms):
+    CLOCK.advance(ms)
+
+
+def sleep_us(us):
+    CLOCK.advance(us / 1000)
+
+
+def sleep(s):
+    CLOCK.advance(s * 1000)
+
+
+def time():
+    return _time.time() + CLOCK.offset_ms / 1000
@@ -0,0 +1,89 @@
+# gps.py — NEO-6M emulado: RMC + GGA una vez por segundo por la UART
+#
+# Corre como hook del reloj virtual. Si el collar manda UBX-RXM-PMREQ
+# (power.GpsPower.backup) deja de emitir hasta que vence el backup, igual
+# que el receptor real.
+import math
+import struct
+import time
+
+from .clock import CLOCK
+
+PMREQ = b"\xb5\x62\x02\x41"
+
+
+def nmea(body):
+    """'GPRMC,...' -> b'$GPRMC,...*CS\\r\\n'."""
+    ck = 0
+    for c in body.encode():
+        ck ^= c
+    return "${}*{:02X}\r\n".format(body, ck).encode()
+
+
+def _dm(value, deg_digits):
+    a = abs(value)
+    deg = int(a)
+    return "{:0{}d}{:07.4f}".format(deg, deg_digits, (a - deg) * 60)
+
+
+def gps_sentences(lat, lon, t, spd_kn=0.4, crs=90.0, sats=8, hdop=0.9, valid=True):
+    """RMC + GGA de un fix en `t` (segundos UTC desde 1970)."""
+    tm = time.gmtime(t)
+    hms = "{:02d}{:02d}{:02d}.00".format(tm.tm_hour, tm.tm_min, tm.tm_sec)
+    dmy = "{:02d}{:02d}{:02d}".format(tm.tm_mday, tm.tm_mon, tm.tm_year % 100)
+    la = _dm(lat, 2) + "," + ("N" if lat >= 0 else "S")
+    lo = _dm(lon, 3) + "," + ("E" if lon >= 0 else "W")
+    rmc = "GPRMC,{},{},{},{},{:.1f},{:.1f},{},,,A".format(
+        hms, "A" if valid else "V", la, lo, spd_kn, crs, dmy)
+    gga = "GPGGA,{},{},{},{},{},{:.1f},1520.0,M,-6.0,M,,".format(
+        hms, la, lo, 1 if valid else 0, sats, hdop)
+    return nmea(rmc) + nmea(gga)
+
+
+class GpsSim:
+    def __init__(self, uart, lat, lon, epoch=None, spd_kn=0.4, crs=90.0):
+        self.uart = uart
+        self.lat = lat
+        self.lon = lon
+        self.spd_kn = spd_kn
+        self.crs = crs
+        self.epoch = int(time.time() if epoch is None else epoch)
+        self.start_ms = CLOCK.now_ms()
+        self.next_ms = self.start_ms
+        self.asleep_until = 0
+        self.seen_tx = 0
+        self.sentences = 0
+        self.backups = 0
+        CLOCK.hooks.append(self.step)
+
+    def close(self):
+        if self.step in CLOCK.hooks:
+            CLOCK.hooks.remove(self.step)
+
+    def _check_ubx(self, now):
+        tx = self.uart.tx
+        i = tx.find(PMREQ, self.seen_tx)
+        while i >= 0 and len(tx) >= i + 14:
+            ms, _flags = struct.unpack_from("<II", tx, i + 6)
+            self.asleep_until = now + ms
+            self.backups += 1
+            self.seen_tx = i + 14
+            i = tx.find(PMREQ, self.seen_tx)
+
+    def step(self):
+        now = CLOCK.now_ms()
+        self._check_ubx(now)
+        if now < self.asleep_until:
+            self.next_ms = self.asleep_until
+            return
+        if now - self.next_ms > 2000:
+            self.next_ms = now - now % 1000      # salió de backup: no reenviar lo viejo
+        while now >= self.next_ms:
+            t = self.epoch + (self.next_ms - self.start_ms) / 1000
+            # Caminata lenta hacia `crs` a `spd_kn`
+            d = self.spd_kn * 0.514 / 111320
+            self.lat += d * math.cos(math.radians(self.crs))
+            self.lon += d * math.sin(math.radians(self.crs))
+            self.uart.feed(gps_sentences(self.lat, self.lon, t, self.spd_kn, self.crs))
+            self.sentences += 2
+            self.next_ms += 1000
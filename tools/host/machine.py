@@ -0,0 +1,235 @@
+# machine.py — `machine` de MicroPython para una placa simulada
+#
+# make(board) arma un módulo `machine` propio de cada placa: los Pin con el
+# mismo número comparten estado dentro de la placa (el driver y el radio
+# simulado ven el mismo CS y el mismo DIO0), y un flanco en un pin con irq()
+# llama al handler en el acto, como una interrupción.
+#
+# SPI y SoftSPI son el mismo bus: cada byte va al dispositivo cuyo CS está
+# en bajo (ver Board.attach_spi) y el bus cuenta transacciones y bytes.
+import types
+
+from .clock import CLOCK
+
+
+class PinState:
+    def __init__(self, id_):
+        self.id = id_
+        self.level = 0
+        self.handler = None
+        self.trigger = 0
+        self.pin = None
+        self.watchers = []      # callbacks(level) del lado simulado
+
+    def set(self, level):
+        level = 1 if level else 0
+        old = self.level
+        self.level = level
+        if old == level:
+            return
+        for w in self.watchers:
+            w(level)
+        if self.handler is not None:
+            if (level and self.trigger & Pin.IRQ_RISING) or (not level and self.trigger & Pin.IRQ_FALLING):
+                self.handler(self.pin)
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    board = None
+
+    def __init__(self, id_, mode=-1, pull=-1, value=None):
+        self.id = id_
+        self.st = self.board.pin(id_)
+        if value is not None:
+            self.st.set(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self.st.level
+        self.st.set(v)
+
+    __call__ = value
+
+    def on(self):
+        self.st.set(1)
+
+    def off(self):
+        self.st.set(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self.st.handler = handler
+        self.st.trigger = trigger
+        self.st.pin = self
+
+    def __repr__(self):
+        return "Pin({})".format(self.id)
+
+
+class SPI:
+    MSB = 0
+    LSB = 1
+
+    board = None
+
+    def __init__(self, id_=-1, baudrate=1000000, polarity=0, phase=0, bits=8,
+                 firstbit=0, sck=None, mosi=None, miso=None):
+        self.id = id_
+        self.baudrate = baudrate
+        if self.board.spi_fail is not None and self.board.spi_fail(self):
+            raise OSError("SPI({}) no disponible".format(id_))
+
+    def init(self, baudrate=None, **kw):
+        if baudrate:
+            self.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def _dev(self):
+        return self.board.spi_selected()
+
+    def write(self, buf):
+        dev = self._dev()
+        stats = self.board.spi_stats
+        stats["bytes"] += len(buf)
+        if dev is None:
+            return
+        for b in bytes(buf):
+            dev.spi_byte(b)
+
+    def read(self, n, write=0):
+        buf = bytearray(n)
+        self.readinto(buf, write)
+        return bytes(buf)
+
+    def readinto(self, buf, write=0):
+        dev = self._dev()
+        self.board.spi_stats["bytes"] += len(buf)
+        for i in range(len(buf)):
+            buf[i] = dev.spi_byte(write) if dev is not None else 0xFF
+
+    def write_readinto(self, out, into):
+        dev = self._dev()
+        self.board.spi_stats["bytes"] += len(out)
+        for i in range(len(out)):
+            into[i] = dev.spi_byte(out[i]) if dev is not None else 0xFF
+
+
+class SoftSPI(SPI):
+    def __init__(self, baudrate=500000, polarity=0, phase=0, bits=8, firstbit=0,
+                 sck=None, mosi=None, miso=None):
+        self.id = -1
+        self.baudrate = baudrate
+
+
+class UART:
+    board = None
+
+    def __init__(self, id_, baudrate=9600, bits=8, parity=None, stop=1, tx=None, rx=None,
+                 timeout=0, rxbuf=256, **kw):
+        self.id = id_
+        self.baudrate = baudrate
+        self.rxbuf = rxbuf
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.overruns = 0
+        self.board.uarts[id_] = self
+
+    # Lado simulado: lo que "manda" el otro extremo
+    def feed(self, data):
+        room = self.rxbuf - len(self.rx)
+        if len(data) > room:
+            self.overruns += len(data) - room
+            data = data[:room]
+        self.rx += data
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, n=None):
+        if not self.rx:
+            return None
+        n = len(self.rx) if n is None else min(n, len(self.rx))
+        out = bytes(self.rx[:n])
+        del self.rx[:n]
+        return out
+
+    def readinto(self, buf, n=None):
+        n = len(buf) if n is None else n
+        n = min(n, len(self.rx))
+        if not n:
+            return None
+        buf[:n] = self.rx[:n]
+        del self.rx[:n]
+        return n
+
+    def readline(self):
+        i = self.rx.find(b"\n")
+        return self.read(len(self.rx) if i < 0 else i + 1)
+
+    def write(self, buf):
+        self.tx += buf
+        return len(buf)
+
+
+class ADC:
+    board = None
+
+    def __init__(self, pin):
+        self.id = pin.id if isinstance(pin, Pin) else pin
+
+    def read_u16(self):
+        return self.board.adc.get(self.id, 0)
+
+
+class RTC:
+    board = None
+
+    def __init__(self, id_=0):
+        pass
+
+    def memory(self, data=None):
+        if data is None:
+            return bytes(self.board.rtc_mem)
+        if len(data) > 2048:
+            raise ValueError("RTC memory: máximo 2048 bytes")
+        self.board.rtc_mem = bytearray(data)
+
+    def datetime(self, dt=None):
+        return (2000, 1, 1, 5, 0, 0, 0, 0)
+
+
+def make(board):
+    """Módulo `machine` propio de `board`."""
+    mod = types.ModuleType("machine")
+    for cls in (Pin, SPI, SoftSPI, UART, ADC, RTC):
+        setattr(mod, cls.__name__, type(cls.__name__, (cls,), {"board": board}))
+
+    def lightsleep(ms=None):
+        board.lightsleeps += 1
+        CLOCK.advance(ms or 0)
+
+    def deepsleep(ms=None):
+        raise SystemExit("deepsleep")
+
+    def reset():
+        raise SystemExit("reset")
+
+    def freq(hz=None):
+        return board.cpu_hz
+
+    mod.lightsleep = lightsleep
+    mod.deepsleep = deepsleep
+    mod.reset = reset
+    mod.freq = freq
+    mod.idle = lambda: None
+    mod.unique_id = lambda: board.name.encode()[:8]
+    return mod
@@ -0,0 +1,57 @@
+# network.py — `network` de MicroPython sobre los sockets de la PC
+#
+# No hay radio Wi-Fi que simular: el AP "se levanta" al instante e informa
+# 127.0.0.1, y el servidor del handheld (asyncio.start_server) abre un
+# socket TCP real en la PC, así que se le puede pegar con curl, un
+# navegador o el cliente de tools/bench.py.
+import types
+
+STA_IF = 0
+AP_IF = 1
+AUTH_OPEN = 0
+AUTH_WEP = 1
+AUTH_WPA_PSK = 2
+AUTH_WPA2_PSK = 3
+AUTH_WPA_WPA2_PSK = 4
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._config = {"essid": "", "channel": 1, "authmode": AUTH_OPEN}
+
+    def active(self, on=None):
+        if on is None:
+            return self._active
+        self._active = bool(on)
+
+    def config(self, *args, **kw):
+        if args:
+            return self._config.get(args[0])
+        self._config.update(kw)
+
+    def ifconfig(self, conf=None):
+        return ("127.0.0.1", "255.255.255.0", "127.0.0.1", "127.0.0.1")
+
+    def isconnected(self):
+        return self._active
+
+    def connect(self, ssid=None, key=None, **kw):
+        self._config["essid"] = ssid
+        self._active = True
+
+    def disconnect(self):
+        self._active = False
+
+    def status(self, *args):
+        return 1010 if self._active else 1000
+
+
+def make(board):
+    mod = types.ModuleType("network")
+    for name, value in globals().items():
+        if name.isupper():
+            setattr(mod, name, value)
+    mod.WLAN = WLAN
+    return mod
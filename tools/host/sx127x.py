@@ -0,0 +1,314 @@
+# sx127x.py — SX1276/SX1278 emulado (registros + FIFO) y canal de radio
+#
+# SimSX127x responde por SPI como el chip en modo LoRa: el primer byte de
+# cada transacción es la dirección (bit 7 = escritura), las ráfagas avanzan
+# la dirección salvo en RegFifo, que usa RegFifoAddrPtr. Lo que el driver
+# necesita está modelado: modos sleep/standby/TX/RX continuo, IrqFlags con
+# borrado por escritura de 1, DIO0 según RegDioMapping1 (RxDone/TxDone),
+# RegRxNbBytes/RegFifoRxCurrentAddr, SNR/RSSI del paquete y RegModemStat.
+#
+# Un TX dura su tiempo en aire (fórmula de la hoja de datos, calculada aquí
+# aparte de la del driver) sobre el reloj virtual; al terminar, Air entrega
+# el paquete a los radios en RX continuo con el mismo SF, BW y frecuencia.
+import math
+import random
+
+from .clock import CLOCK
+
+REG_FIFO = 0x00
+REG_OP_MODE = 0x01
+REG_FRF_MSB = 0x06
+REG_FIFO_ADDR_PTR = 0x0D
+REG_FIFO_TX_BASE_ADDR = 0x0E
+REG_FIFO_RX_BASE_ADDR = 0x0F
+REG_FIFO_RX_CURRENT_ADDR = 0x10
+REG_IRQ_FLAGS = 0x12
+REG_RX_NB_BYTES = 0x13
+REG_MODEM_STAT = 0x18
+REG_PKT_SNR_VALUE = 0x19
+REG_PKT_RSSI_VALUE = 0x1A
+REG_MODEM_CONFIG_1 = 0x1D
+REG_MODEM_CONFIG_2 = 0x1E
+REG_PREAMBLE_MSB = 0x20
+REG_PREAMBLE_LSB = 0x21
+REG_PAYLOAD_LENGTH = 0x22
+REG_MODEM_CONFIG_3 = 0x26
+REG_DIO_MAPPING_1 = 0x40
+REG_VERSION = 0x42
+
+MODE_MASK = 0x07
+MODE_SLEEP = 0x00
+MODE_STDBY = 0x01
+MODE_TX = 0x03
+MODE_RX_CONTINUOUS = 0x05
+MODE_RX_SINGLE = 0x06
+
+IRQ_TX_DONE = 0x08
+IRQ_VALID_HEADER = 0x10
+IRQ_CRC_ERROR = 0x20
+IRQ_RX_DONE = 0x40
+
+BW_HZ = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+
+def airtime_ms(n, sf, bw_hz, cr, preamble, crc=True, explicit=True, ldo=False):
+    """Tiempo en aire LoRa (hoja de datos SX1276, sección 4.1.1.7)."""
+    tsym = (1 << sf) * 1000.0 / bw_hz
+    de = 1 if ldo else 0
+    ih = 0 if explicit else 1
+    num = 8 * n - 4 * sf + 28 + (16 if crc else 0) - 20 * ih
+    nsym = 8 + max(math.ceil(num / (4.0 * (sf - 2 * de))) * (cr + 4), 0)
+    return (preamble + 4.25 + nsym) * tsym
+
+
+class SimSX127x:
+    def __init__(self, board, cs, dio0, air=None, version=0x12):
+        self.board = board
+        self.air = air
+        self.reg = bytearray(0x80)
+        self.fifo = bytearray(256)
+        self.reg[REG_OP_MODE] = 0x09
+        self.reg[REG_FIFO_TX_BASE_ADDR] = 0x80
+        self.reg[REG_MODEM_CONFIG_1] = 0x72
+        self.reg[REG_MODEM_CONFIG_2] = 0x70
+        self.reg[REG_PREAMBLE_LSB] = 0x08
+        self.reg[REG_PAYLOAD_LENGTH] = 0x01
+        self.reg[REG_VERSION] = version
+        self.cs = board.pin(cs)
+        self.dio0 = board.pin(dio0)
+        self.cs.level = 1
+        self.cs.watchers.append(self._on_cs)
+        self._addr = None
+        self._write_op = False
+        self.tx_end = None
+        # Estadísticas
+        self.transactions = 0
+        self.tx_packets = 0
+        self.rx_packets = 0
+        self.rx_missed = 0          # llegó un paquete y el radio no escuchaba
+        self.rx_overwritten = 0     # RxDone pendiente pisado por otro paquete
+        self.tx_log = []
+        if air is not None:
+            air.attach(self)
+
+    # ------------------ Parámetros efectivos ------------------
+    @property
+    def mode(self):
+        return self.reg[REG_OP_MODE] & MODE_MASK
+
+    @property
+    def sf(self):
+        return self.reg[REG_MODEM_CONFIG_2] >> 4
+
+    @property
+    def bw(self):
+        return self.reg[REG_MODEM_CONFIG_1] >> 4
+
+    @property
+    def cr(self):
+        return (self.reg[REG_MODEM_CONFIG_1] >> 1) & 0x07
+
+    @property
+    def frf(self):
+        r = self.reg
+        return (r[REG_FRF_MSB] << 16) | (r[REG_FRF_MSB + 1] << 8) | r[REG_FRF_MSB + 2]
+
+    @property
+    def preamble(self):
+        return (self.reg[REG_PREAMBLE_MSB] << 8) | self.reg[REG_PREAMBLE_LSB]
+
+    def channel(self):
+        return (self.frf, self.bw, self.sf)
+
+    def airtime_ms(self, n):
+        return airtime_ms(n, self.sf, BW_HZ[self.bw], self.cr, self.preamble,
+                          crc=bool(self.reg[REG_MODEM_CONFIG_2] & 0x04),
+                          explicit=not (self.reg[REG_MODEM_CONFIG_1] & 0x01),
+                          ldo=bool(self.reg[REG_MODEM_CONFIG_3] & 0x08))
+
+    # ------------------ SPI ------------------
+    def _on_cs(self, level):
+        if level == 0:
+            self._addr = None
+            self.transactions += 1
+            self.board.spi_stats["transactions"] += 1
+
+    def selected(self):
+        return self.cs.level == 0
+
+    def spi_byte(self, b):
+        if self._addr is None:
+            self._addr = b & 0x7F
+            self._write_op = bool(b & 0x80)
+            return 0
+        a = self._addr
+        if self._write_op:
+            self._write(a, b)
+            v = 0
+        else:
+            v = self._read(a)
+        if a != REG_FIFO:
+            self._addr = (a + 1) & 0x7F
+        return v
+
+    def _read(self, a):
+        if a == REG_FIFO:
+            p = self.reg[REG_FIFO_ADDR_PTR]
+            self.reg[REG_FIFO_ADDR_PTR] = (p + 1) & 0xFF
+            return self.fifo[p]
+        if a == REG_IRQ_FLAGS:
+            self._check_tx()
+        elif a == REG_MODEM_STAT:
+            busy = self.air is not None and self.mode in (MODE_RX_CONTINUOUS, MODE_RX_SINGLE) \
+                and self.air.busy(self)
+            return 0x01 if busy else 0x00
+        return self.reg[a]
+
+    def _write(self, a, v):
+        if a == REG_FIFO:
+            p = self.reg[REG_FIFO_ADDR_PTR]
+            self.fifo[p] = v
+            self.reg[REG_FIFO_ADDR_PTR] = (p + 1) & 0xFF
+            return
+        if a == REG_IRQ_FLAGS:
+            self.reg[a] &= ~v & 0xFF
+            self._update_dio0()
+            return
+        if a == REG_VERSION:
+            return
+        if a == REG_OP_MODE:
+            self._set_mode(v)
+            return
+        self.reg[a] = v
+        if a == REG_DIO_MAPPING_1:
+            self._update_dio0()
+
+    def _set_mode(self, v):
+        old = self.mode
+        self.reg[REG_OP_MODE] = v
+        new = v & MODE_MASK
+        if new == MODE_TX and old != MODE_TX:
+            self._start_tx()
+        elif new != MODE_TX:
+            if self.tx_end is not None and self.air is not None:
+                self.air.abort(self)
+            self.tx_end = None
+
+    # ------------------ TX ------------------
+    def _start_tx(self):
+        n = self.reg[REG_PAYLOAD_LENGTH]
+        base = self.reg[REG_FIFO_TX_BASE_ADDR]
+        data = bytes(self.fifo[(base + i) & 0xFF] for i in range(n))
+        toa = self.airtime_ms(n)
+        self.tx_end = CLOCK.now_us() + int(toa * 1000)
+        self.tx_packets += 1
+        self.tx_log.append(data)
+        if self.air is not None:
+            self.air.start(self, data, self.tx_end)
+
+    def _check_tx(self):
+        if self.tx_end is not None and CLOCK.now_us() >= self.tx_end:
+            if self.air is not None:
+                self.air.tick()
+            else:
+                self.tx_done()
+
+    def tx_done(self):
+        """Llamado al terminar el tiempo en aire: vuelve a standby."""
+        self.tx_end = None
+        self.reg[REG_OP_MODE] = (self.reg[REG_OP_MODE] & ~MODE_MASK) | MODE_STDBY
+        self.reg[REG_IRQ_FLAGS] |= IRQ_TX_DONE
+        self._update_dio0()
+
+    # ------------------ RX ------------------
+    def listening(self, channel):
+        return self.mode in (MODE_RX_CONTINUOUS, MODE_RX_SINGLE) and self.channel() == channel
+
+    def deliver(self, data, rssi=-80, snr=9.0, crc_ok=True):
+        """Pone un paquete en la FIFO como si acabara de llegar."""
+        if self.reg[REG_IRQ_FLAGS] & IRQ_RX_DONE:
+            self.rx_overwritten += 1
+        base = self.reg[REG_FIFO_RX_BASE_ADDR]
+        for i, b in enumerate(data):
+            self.fifo[(base + i) & 0xFF] = b
+        self.reg[REG_FIFO_RX_CURRENT_ADDR] = base
+        self.reg[REG_RX_NB_BYTES] = len(data)
+        self.reg[REG_PKT_SNR_VALUE] = int(round(snr * 4)) & 0xFF
+        self.reg[REG_PKT_RSSI_VALUE] = max(0, min(255, int(rssi) + 164))
+        flags = IRQ_RX_DONE | IRQ_VALID_HEADER
+        if not crc_ok:
+            flags |= IRQ_CRC_ERROR
+        self.reg[REG_IRQ_FLAGS] |= flags
+        self.rx_packets += 1
+        if self.mode == MODE_RX_SINGLE:
+            self.reg[REG_OP_MODE] = (self.reg[REG_OP_MODE] & ~MODE_MASK) | MODE_STDBY
+        self._update_dio0()
+
+    def _update_dio0(self):
+        mapping = self.reg[REG_DIO_MAPPING_1] >> 6
+        flags = self.reg[REG_IRQ_FLAGS]
+        if mapping == 0:
+            level = flags & IRQ_RX_DONE
+        elif mapping == 1:
+            level = flags & IRQ_TX_DONE
+        else:
+            level = 0
+        self.dio0.set(level)
+
+
+class Air:
+    """Canal compartido: entrega cada TX al terminar su tiempo en aire."""
+
+    def __init__(self, rssi=-80, snr=9.0, loss=0.0, seed=1):
+        self.radios = []
+        self.flight = []            # [fin_us, emisor, datos, canal]
+        self.rssi = rssi
+        self.snr = snr
+        self.loss = loss
+        self.rand = random.Random(seed)
+        self.delivered = 0
+        self.lost = 0
+        CLOCK.hooks.append(self.tick)
+
+    def attach(self, radio):
+        self.radios.append(radio)
+
+    def close(self):
+        if self.tick in CLOCK.hooks:
+            CLOCK.hooks.remove(self.tick)
+
+    def start(self, sender, data, end_us):
+        self.flight.append([end_us, sender, data, sender.channel()])
+
+    def abort(self, sender):
+        self.flight = [f for f in self.flight if f[1] is not sender]
+
+    def busy(self, radio):
+        ch = radio.channel()
+        return any(f[3] == ch for f in self.flight if f[1] is not radio)
+
+    def link(self, sender, receiver):
+        """(rssi, snr) del enlace; se puede reemplazar por otro modelo."""
+        return self.rssi, self.snr
+
+    def tick(self):
+        if not self.flight:
+            return
+        now = CLOCK.now_us()
+        done = [f for f in self.flight if f[0] <= now]
+        if not done:
+            return
+        self.flight = [f for f in self.flight if f[0] > now]
+        for end, sender, data, ch in done:
+            sender.tx_done()
+            for r in self.radios:
+                if r is sender or not r.listening(ch):
+                    if r is not sender:
+                        r.rx_missed += 1
+                    continue
+                if self.loss and self.rand.random() < self.loss:
+                    self.lost += 1
+                    continue
+                rssi, snr = self.link(sender, r)
+                r.deliver(data, rssi, snr)
+                self.delivered += 1